@@ -0,0 +1,104 @@
+import asyncio
+import contextlib
+import hashlib
+import threading
+import time
+from collections import deque
+
+# AIMD (additive increase, multiplicative decrease) concurrency control for provider calls.
+# The limit grows by ~1 per round of successful requests and is halved on a 429 or when p95
+# latency climbs well above the best p95 seen, so batches settle near the highest rate the provider
+# sustains. Controllers are process-wide, keyed like the rate limiters, and outlive single batches.
+
+INITIAL_LIMIT = 4
+MIN_LIMIT = 1
+MAX_LIMIT = 64
+
+LATENCY_WINDOW = 40  # recent successful calls used for p95
+MIN_SAMPLES = 10
+LATENCY_TOLERANCE = 1.5  # back off when p95 exceeds the baseline by this factor
+DECREASE_FACTOR = 0.5
+DECREASE_COOLDOWN = 2.0  # seconds; one burst of 429s only halves the limit once
+
+POLL_INTERVAL = 0.05  # seconds between checks for a free slot
+
+
+class AdaptiveConcurrency:
+    def __init__(self, initial=INITIAL_LIMIT, minimum=MIN_LIMIT, maximum=MAX_LIMIT):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.baseline_p95 = None
+        self.last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def current_limit(self):
+        return int(self.limit)
+
+    def p95(self):
+        with self._lock:
+            return self._p95()
+
+    def _p95(self):
+        if len(self.latencies) < MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def _try_enter(self):
+        with self._lock:
+            if self.in_flight < self.current_limit:
+                self.in_flight += 1
+                return True
+            return False
+
+    def _leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _decrease(self, now):
+        if now - self.last_decrease >= DECREASE_COOLDOWN:
+            self.limit = max(self.minimum, self.limit * DECREASE_FACTOR)
+            self.last_decrease = now
+            self.latencies.clear()
+
+    def on_success(self, latency):
+        with self._lock:
+            self.latencies.append(latency)
+            p95 = self._p95()
+            if p95 is not None:
+                # Let the baseline drift up slowly so a permanently slower provider isn't punished forever
+                self.baseline_p95 = p95 if self.baseline_p95 is None else min(p95, self.baseline_p95 * 1.01)
+                if p95 > self.baseline_p95 * LATENCY_TOLERANCE:
+                    self._decrease(time.monotonic())
+                    return
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_rate_limited(self):
+        with self._lock:
+            self._decrease(time.monotonic())
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        # Polling keeps this usable from any event loop (each Streamlit session runs its own)
+        while not self._try_enter():
+            await asyncio.sleep(POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            self._leave()
+
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+
+def controller_for(api_url, api_key):
+    key = (str(api_url), hashlib.sha256(str(api_key).encode()).hexdigest())
+    with _controllers_lock:
+        if key not in _controllers:
+            _controllers[key] = AdaptiveConcurrency()
+        return _controllers[key]
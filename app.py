@@ -1,3 +1,9 @@
+import startup_profile
+
+# EMAILBOT_PROFILE_STARTUP=1 times every import from here on and shows the report in the sidebar
+if startup_profile.ENABLED:
+    startup_profile.enable()
+
 import streamlit as st
 import importlib
 
@@ -38,7 +44,12 @@ st.write(f"🔹 Running: `{script_name}.py`")
 
 # Import and run the selected script
 try:
-    module = importlib.import_module(script_name)
-    module.main()  # Ensure each script has a `main()` function
+    with startup_profile.phase(f"import {script_name}"):
+        module = importlib.import_module(script_name)
+    with startup_profile.phase(f"{script_name}.main()"):
+        module.main()  # Ensure each script has a `main()` function
 except Exception as e:
     st.error(f"⚠️ Error running `{script_name}.py`: {e}")
+
+if startup_profile.ENABLED:
+    startup_profile.render()
@@ -0,0 +1,167 @@
+import argparse
+import csv
+import importlib
+import json
+import sys
+import time
+
+import startup_profile
+
+# EMAILBOT_PROFILE_STARTUP=1 prints the import and setup times of a headless run (see startup_profile)
+if startup_profile.ENABLED:
+    startup_profile.enable()
+
+import batch_engine
+import email_journal
+import llm_cache
+import merchant_store
+import multi_merchant
+import providers
+import reasoning
+import token_ledger
+
+# Headless bulk email generation, for large campaigns run overnight from cron or batch jobs:
+#   python batch_cli.py --provider openai --variant shorter --filter "merchant_category == 'Cafe'" \
+#       --output emails.jsonl
+# It uses the same EmailAgent, sender and batch_engine as the bot's "Generate Emails" button, without
+# Streamlit: credentials come from EMAILBOT_* environment variables or .streamlit/secrets.toml (see
+# providers). Each email is written to disk as soon as it is generated, so a long run can be followed
+# with `tail -f`. Emails are also journaled (see email_journal), so re-running the same command after a
+# crash or an expired key restores what was already generated and only generates the rest.
+
+PROVIDERS = {
+    "openai": lambda module: module.EmailAgent(client=providers.openai_client()),
+    "deepseek": lambda module: module.EmailAgent(client=providers.kluster_client()),
+    "llama": lambda module: module.EmailAgent(),
+}
+VARIANTS = {"default": "", "shorter": "_shorter", "sumit": "_sumit"}
+FIELDS = ["row", "Merchant Name", "To", "Subject", "Body", "Error"]
+
+
+def bot_module(provider, variant):
+    return f"emailbot_{provider}{VARIANTS[variant]}"
+
+
+def select_merchants(csv_path, filter_expression=None, limit=None):
+    df = merchant_store.load_merchants(csv_path)
+    if filter_expression:
+        df = df.query(filter_expression)  # pandas query syntax, e.g. "google_review_score >= 4.5"
+    return df.head(limit) if limit else df
+
+
+def email_record(index, merchant_details, result):
+    # One output row per merchant; `row` is the merchant's position in the selection
+    record = {"row": index, "Merchant Name": merchant_details.get("merchant_name")}
+    if result.error is not None:
+        return {**record, "To": None, "Subject": None, "Body": None, "Error": str(result.error)}
+    to_email, subject, body = result.value
+    return {**record, "To": to_email, "Subject": subject, "Body": body, "Error": None}
+
+
+class CsvWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.writer = csv.DictWriter(stream, fieldnames=FIELDS)
+        self.writer.writeheader()
+
+    def write(self, record):
+        self.writer.writerow(record)
+        self.stream.flush()
+
+
+class JsonlWriter:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, record):
+        self.stream.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self.stream.flush()
+
+
+WRITERS = {"csv": CsvWriter, "jsonl": JsonlWriter}
+
+
+def output_format(path, requested=None):
+    if requested:
+        return requested
+    return "jsonl" if path.lower().endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate merchant emails without the Streamlit app.")
+    parser.add_argument("--provider", choices=sorted(PROVIDERS), default="openai")
+    parser.add_argument("--variant", choices=list(VARIANTS), default="default", help="prompt variant of the bot")
+    parser.add_argument("--input", default=providers.MERCHANTS_CSV, help="merchant CSV")
+    parser.add_argument("--filter", help="pandas query expression selecting the merchants")
+    parser.add_argument("--limit", type=int, help="only the first N selected merchants")
+    parser.add_argument("--output", required=True, help="file the emails are written to as they are generated")
+    parser.add_argument("--format", choices=sorted(WRITERS), help="default: from the --output extension")
+    parser.add_argument("--concurrency", type=int, default=batch_engine.DEFAULT_CONCURRENCY)
+    parser.add_argument("--group-size", type=int, default=1, help="merchants per request (see multi_merchant)")
+    parser.add_argument("--reasoning", choices=list(reasoning.MODES), default="auto", help="DeepSeek only")
+    parser.add_argument(
+        "--bypass-cache", action="store_true", help="don't answer from the LLM response cache or the email journal"
+    )
+    parser.add_argument(
+        "--sender", nargs=4, metavar=("NAME", "POSITION", "EMAIL", "PHONE"), help="default: the variant's sender"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with startup_profile.phase("load merchants"):
+        merchants = select_merchants(args.input, args.filter, args.limit)
+    module_name = bot_module(args.provider, args.variant)
+    with startup_profile.phase(f"import {module_name}"):
+        module = importlib.import_module(module_name)
+    with startup_profile.phase("create agent"):
+        agent = PROVIDERS[args.provider](module)
+    sender = tuple(args.sender) if args.sender else module.SENDER
+
+    token_ledger.current_variant.set(module_name)
+    reasoning.current_mode.set(args.reasoning)
+    llm_cache.bypass.set(args.bypass_cache)
+    if startup_profile.ENABLED:
+        print("Startup profile:\n" + startup_profile.report(), file=sys.stderr)
+
+    merchant_rows = [row.to_dict() for _, row in merchants.iterrows()]
+    print(f"Generating {len(merchant_rows)} emails with {module_name} -> {args.output}", file=sys.stderr)
+    started, failed = time.monotonic(), 0
+    with open(args.output, "w", newline="", encoding="utf-8") as stream:
+        writer = WRITERS[output_format(args.output, args.format)](stream)
+        done = 0
+
+        def on_restored(results):
+            nonlocal done
+            done += len(results)
+            for result in results:
+                writer.write(email_record(result.index, merchant_rows[result.index], result))
+            if results:
+                print(f"{len(results)} emails restored from the journal", file=sys.stderr)
+
+        def on_result(result):
+            nonlocal done, failed
+            done += 1
+            failed += result.error is not None
+            merchant_details = merchant_rows[result.index]
+            writer.write(email_record(result.index, merchant_details, result))
+            status = "ok" if result.error is None else f"error: {result.error}"
+            print(f"[{done}/{len(merchant_rows)}] {merchant_details.get('merchant_name')}: {status}", file=sys.stderr)
+
+        email_journal.generate_batch(
+            agent, merchant_rows, sender, args.concurrency, args.group_size,
+            on_result=on_result, on_restored=on_restored,
+        )
+
+    print(f"Done in {time.monotonic() - started:.0f}s: {len(merchant_rows) - failed} emails, {failed} failed",
+          file=sys.stderr)
+    summaries = [llm_cache.summary(), email_journal.summary(), multi_merchant.summary(), token_ledger.summary()]
+    if args.provider == "deepseek":
+        summaries.append(reasoning.summary())
+    print("\n".join(summaries), file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
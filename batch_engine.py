@@ -0,0 +1,80 @@
+import asyncio
+from collections import namedtuple
+
+import multi_merchant
+import retry_policy
+import token_ledger
+
+# Concurrent email generation shared by every bot module.
+# Each agent exposes `async_session()` (an async context manager yielding its HTTP client)
+# and `agenerate_email(session, merchant_details, your_name, your_position, your_email, your_phone)`.
+# Grouped generation (group_size > 1, see multi_merchant) also uses `acomplete(session, payload, title)` and
+# `parse_email(response_text, merchant_details, your_name, your_position, your_email, your_phone)`.
+
+DEFAULT_CONCURRENCY = 8
+
+# One entry per input item, in input order. Exactly one of `value` / `error` is set.
+# `on_result`, when given, is called with each BatchResult as soon as it is ready (completion order),
+# so callers can write results out while the rest of the batch is still running.
+BatchResult = namedtuple("BatchResult", ["index", "value", "error"])
+
+
+async def run_batch(items, worker, concurrency=DEFAULT_CONCURRENCY, on_result=None):
+    semaphore = asyncio.Semaphore(max(1, int(concurrency)))
+
+    async def run_one(index, item):
+        async with semaphore:
+            try:
+                result = BatchResult(index, await worker(item), None)
+            except Exception as e:
+                # Keep the failure with its item so one bad merchant doesn't sink the batch
+                result = BatchResult(index, None, e)
+        if on_result is not None:
+            on_result(result)
+        return result
+
+    # gather() preserves argument order, so results line up with `items`
+    return await asyncio.gather(*(run_one(index, item) for index, item in enumerate(items)))
+
+
+def _flatten_group(group_result, group, group_size):
+    # One BatchResult per merchant of a group, indexed by the merchant's position in the whole batch
+    start = group_result.index * group_size
+    pairs = group_result.value if group_result.error is None else [(None, group_result.error)] * len(group)
+    return [BatchResult(start + offset, value, error) for offset, (value, error) in enumerate(pairs)]
+
+
+def generate_batch(agent, merchant_rows, sender, concurrency=DEFAULT_CONCURRENCY, group_size=1, on_result=None):
+    your_name, your_position, your_email, your_phone = sender
+
+    async def _generate():
+        # One retry budget for the whole batch; the per-merchant tasks inherit it through the context
+        retry_policy.current_budget.set(retry_policy.budget_for_batch(len(merchant_rows)))
+        token_ledger.current_batch.set(token_ledger.new_batch_id())
+        async with agent.async_session() as session:
+            if group_size <= 1:
+                return await run_batch(
+                    merchant_rows,
+                    lambda merchant_details: agent.agenerate_email(
+                        session, merchant_details, your_name, your_position, your_email, your_phone
+                    ),
+                    concurrency,
+                    on_result,
+                )
+            groups = [merchant_rows[start:start + group_size] for start in range(0, len(merchant_rows), group_size)]
+
+            def group_done(group_result):
+                for result in _flatten_group(group_result, groups[group_result.index], group_size):
+                    on_result(result)
+
+            grouped = await run_batch(
+                groups,
+                lambda group: multi_merchant.agenerate_group(agent, session, group, sender),
+                concurrency,
+                group_done if on_result is not None else None,
+            )
+            # Flatten back to one result per merchant, in input order
+            return [result for group, group_result in zip(groups, grouped)
+                    for result in _flatten_group(group_result, group, group_size)]
+
+    return asyncio.run(_generate())
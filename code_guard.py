@@ -0,0 +1,284 @@
+import ast
+import functools
+import importlib
+import re
+import types
+
+# Static check of LLM-generated query code before it reaches the sandbox (query_sandbox).
+# The code is parsed once and its AST walked:
+#   - reads of the dataset (pd.read_csv("merchants_sg_emails.csv"), read_excel, ...) are rewritten to
+#     the in-memory `df`, which is already loaded, normalized and typed
+#   - imports of what the sandbox already provides (pandas as pd, plotly.express as px, streamlit as st)
+#     are dropped, or under another name or as a from-import turned into an assignment from the provided
+#     object (`import pandas` -> `pandas = pd`, `from pandas import DataFrame` -> `DataFrame = pd.DataFrame`);
+#     other imports outside SAFE_MODULES are rejected, which also keeps network and file-system libraries out
+#   - attribute chains through imported modules are resolved against the real modules, one member at a time:
+#     private members, submodules other than ALLOWED_SUBMODULES (pd.io.common.os, datetime.sys, ...) and
+#     FORBIDDEN_MEMBERS (np.load, pd.eval, ...) are rejected, and a module can't be passed around by name
+#   - file access, dynamic code (open, exec, eval, __import__, ...), dunder attributes and file writes
+#     (to_excel, to_parquet, ..., or to_csv/to_json/... given a path) are rejected; readers and text exports
+#     must be called where they are named (`f = pd.read_csv` is rejected), and methods can't be named by string
+#     (df.apply("to_pickle", ...))
+#   - df.query/df.eval strings are evaluated by pandas, so they must be literals and are checked the same way
+# Validated sources and their compiled code objects are cached by content, so rerunning the same
+# snippet (e.g. from query_cache) skips parsing and compilation.
+
+PROVIDED_MODULES = {"pandas": "pd", "plotly.express": "px", "streamlit": "st"}
+PROVIDED_PACKAGES = {"plotly"}  # bound by a plain `import plotly.express`; the sandbox provides it along with px
+SAFE_MODULES = {"datetime", "json", "math", "numpy", "re", "statistics", "string"}
+# Names bound to a module before any import; st is the sandbox's recorder, not the real module
+PROVIDED_NAMES = {"pd": "pandas", "px": "plotly.express", "plotly": "plotly"}
+ALLOWED_SUBMODULES = {
+    "numpy.linalg", "numpy.random", "pandas.api", "pandas.api.types", "pandas.tseries.offsets", "plotly.express",
+    "plotly.express.colors",
+}
+ALLOWED_SUBMODULE_PREFIXES = ("_plotly_utils.colors.",)  # px.colors.qualitative, ...
+FORBIDDEN_MEMBERS = {
+    "numpy": {
+        "load", "save", "savez", "savez_compressed", "savetxt", "loadtxt", "genfromtxt", "fromfile", "fromregex",
+        "memmap", "DataSource",
+    },
+    "pandas": {"eval", "to_pickle", "ExcelFile", "ExcelWriter", "HDFStore"},
+}
+
+FORBIDDEN_NAMES = {
+    "open", "exec", "eval", "compile", "__import__", "input", "breakpoint", "globals", "locals",
+    "vars", "getattr", "setattr", "delattr", "exit", "quit",
+}
+FORBIDDEN_METHODS = {
+    "to_excel", "to_parquet", "to_pickle", "to_sql", "to_hdf", "to_feather", "to_stata", "to_clipboard",
+    "write_html", "write_image", "tofile", "dump",
+}
+# Return a string when called without a destination, write a file otherwise
+TEXT_EXPORTS = {"to_csv", "to_json", "to_html", "to_xml", "to_markdown", "to_string", "to_latex"}
+PATH_KEYWORDS = {"path_or_buf", "buf", "path"}
+# Evaluate their string argument as an expression
+EXPRESSION_METHODS = {"query", "eval"}
+EXPRESSION_KEYWORD = "expr"
+
+_BACKTICKED = re.compile(r"`[^`]*`")
+
+CACHE_SIZE = 256
+
+_FENCE = re.compile(r"^\s*```(?:python)?\s*|\s*```\s*$")
+
+
+class UnsafeCode(ValueError):
+    pass
+
+
+def _allowed_module(module):
+    name = module.__name__
+    return name in ALLOWED_SUBMODULES or name.startswith(ALLOWED_SUBMODULE_PREFIXES)
+
+
+def _member(module, name):
+    # module.name, if generated code may use it
+    value = getattr(module, name, None)
+    if (
+        name.startswith("_")
+        or name in FORBIDDEN_MEMBERS.get(module.__name__, ())
+        or (module.__name__ == "pandas" and name.startswith("read_"))  # reached only when not called right away
+        or (isinstance(value, types.ModuleType) and not _allowed_module(value))
+    ):
+        raise UnsafeCode(f"Generated code uses '{module.__name__}.{name}', which is not allowed")
+    return value
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _load(path):
+    # A module, or a member of one, by dotted name
+    try:
+        return importlib.import_module(path)
+    except ImportError:
+        module, _, name = path.rpartition(".")
+        return getattr(_load(module), name, None) if module else None
+
+
+def _import_names(tree):
+    # Name -> dotted path of what every import in the code binds, collected up front so uses anywhere
+    # (e.g. in a function defined above the import) are checked against it
+    names = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if _importable(alias.name):
+                    path = alias.name if alias.asname else alias.name.split(".")[0]
+                    names[alias.asname or path] = path
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and _importable(node.module):
+            for alias in node.names:
+                names[alias.asname or alias.name] = f"{node.module}.{alias.name}"
+    return names
+
+
+def _importable(module):
+    # Only modules the code may import are ever loaded to check it (streamlit is the sandbox's recorder)
+    return module != "streamlit" and (
+        module in PROVIDED_MODULES or module in PROVIDED_PACKAGES or module.split(".")[0] in SAFE_MODULES
+    )
+
+
+def _bind(name, provided, attribute=None):
+    # `name = provided` or `name = provided.attribute`
+    value = ast.Name(id=provided, ctx=ast.Load())
+    if attribute is not None:
+        value = ast.Attribute(value=value, attr=attribute, ctx=ast.Load())
+    return ast.Assign(targets=[ast.Name(id=name, ctx=ast.Store())], value=value)
+
+
+class _Guard(ast.NodeTransformer):
+    def __init__(self, tree):
+        self.modules = dict(PROVIDED_NAMES, **_import_names(tree))  # name -> what it was imported as
+
+    def _resolve(self, node):
+        # The object an attribute chain rooted at an imported name (np.random.rand) refers to, checking each
+        # member on the way; None for any other expression
+        if isinstance(node, ast.Name):
+            path = self.modules.get(node.id)
+            return _load(path) if path else None
+        if isinstance(node, ast.Attribute):
+            owner = self._resolve(node.value)
+            if isinstance(owner, types.ModuleType):
+                return _member(owner, node.attr)
+        return None
+
+    def _visit_owner(self, node):
+        # The object of `owner.attr`: a module is checked member by member, anything else as usual
+        owner = self._resolve(node.value)
+        if isinstance(owner, types.ModuleType):
+            _member(owner, node.attr)
+            return node
+        return self.generic_visit(node)
+
+    def _bindings(self, bindings, node):
+        # The assignments replacing an import, checked like code written out by hand (a bare module is not
+        # visited, since passing it around is only allowed here)
+        for binding in bindings:
+            binding.targets = [self.visit(target) for target in binding.targets]
+            if isinstance(binding.value, ast.Attribute):
+                binding.value = self.visit(binding.value)
+        return [ast.copy_location(binding, node) for binding in bindings]
+
+    def visit_Import(self, node):
+        kept, bindings = [], []
+        for alias in node.names:
+            provided = PROVIDED_MODULES.get(alias.name)
+            if provided is not None:
+                name = alias.asname or alias.name.split(".")[0]
+                if name != provided and not (alias.asname is None and name in PROVIDED_PACKAGES):
+                    bindings.append(_bind(name, provided))
+                continue
+            if alias.name.split(".")[0] not in SAFE_MODULES:
+                raise UnsafeCode(f"Generated code imports '{alias.name}', which is not allowed")
+            self._check_path(alias.name)
+            self.visit(ast.Name(id=alias.asname or alias.name.split(".")[0], ctx=ast.Store()))
+            kept.append(alias)
+        bindings = self._bindings(bindings, node)
+        if kept:
+            node.names = kept
+            bindings.insert(0, node)
+        return bindings or None
+
+    def visit_ImportFrom(self, node):
+        module = node.module or ""
+        if node.level == 0 and (module in PROVIDED_MODULES or module in PROVIDED_PACKAGES):
+            bindings = []
+            for alias in node.names:
+                full_name = f"{module}.{alias.name}"
+                if alias.name == "*":
+                    raise UnsafeCode(f"Generated code uses 'from {module} import *', which is not allowed")
+                if full_name in PROVIDED_MODULES:  # from plotly import express as px
+                    bindings.append(_bind(alias.asname or alias.name, PROVIDED_MODULES[full_name]))
+                elif module in PROVIDED_MODULES:
+                    bindings.append(_bind(alias.asname or alias.name, PROVIDED_MODULES[module], alias.name))
+                else:
+                    raise UnsafeCode(f"Generated code imports '{full_name}', which is not allowed")
+            return self._bindings(bindings, node)
+        if module.split(".")[0] not in SAFE_MODULES:
+            raise UnsafeCode(f"Generated code imports from '{node.module}', which is not allowed")
+        module = self._check_path(node.module)
+        for alias in node.names:
+            if alias.name == "*":
+                raise UnsafeCode(f"Generated code uses 'from {node.module} import *', which is not allowed")
+            _member(module, alias.name)
+            self.visit(ast.Name(id=alias.asname or alias.name, ctx=ast.Store()))
+        return node
+
+    def _check_path(self, path):
+        # A safe module's dotted submodule path (numpy.random), member by member
+        root, *parts = path.split(".")
+        module = importlib.import_module(root)
+        for part in parts:
+            module = _member(module, part)
+            if not isinstance(module, types.ModuleType):
+                raise UnsafeCode(f"Generated code imports '{path}', which is not allowed")
+        return module
+
+    def visit_Name(self, node):
+        if node.id in FORBIDDEN_NAMES or node.id.startswith("__"):
+            raise UnsafeCode(f"Generated code uses '{node.id}', which is not allowed")
+        if isinstance(node.ctx, ast.Load) and isinstance(self._resolve(node), types.ModuleType):
+            raise UnsafeCode(f"Generated code passes the module '{node.id}' around, which is not allowed")
+        return node
+
+    def visit_Constant(self, node):
+        # Methods named by string (df.apply("to_pickle", ...), df.agg("query", ...)) are looked up by pandas
+        if isinstance(node.value, str) and node.value in FORBIDDEN_METHODS | TEXT_EXPORTS | EXPRESSION_METHODS:
+            raise UnsafeCode(f"Generated code names the method '{node.value}', which is not allowed")
+        return node
+
+    def visit_Attribute(self, node):
+        if node.attr.startswith("__") or node.attr in FORBIDDEN_METHODS:
+            raise UnsafeCode(f"Generated code uses '.{node.attr}', which is not allowed")
+        if node.attr in TEXT_EXPORTS:
+            raise UnsafeCode(f"Generated code uses '.{node.attr}' without calling it, which is not allowed")
+        return self._visit_owner(node)
+
+    def visit_Call(self, node):
+        function = node.func
+        if not isinstance(function, ast.Attribute):
+            return self.generic_visit(node)
+        if function.attr.startswith("read_") and getattr(self._resolve(function.value), "__name__", None) == "pandas":
+            # Re-reading the dataset from disk: use the frame that is already loaded
+            return ast.copy_location(ast.Name(id="df", ctx=ast.Load()), node)
+        if function.attr in TEXT_EXPORTS:
+            if node.args or PATH_KEYWORDS & {keyword.arg for keyword in node.keywords}:
+                raise UnsafeCode(f"Generated code writes a file with '.{function.attr}', which is not allowed")
+            # Called right here, so it returns text: check the owner and arguments only
+            node.func = self._visit_owner(function)
+            node.keywords = [self.visit(keyword) for keyword in node.keywords]
+            return node
+        if function.attr in EXPRESSION_METHODS:
+            self._check_expression(node)
+        return self.generic_visit(node)
+
+    def _check_expression(self, node):
+        # df.query("...") / df.eval("...") run their string through pandas' evaluator, which resolves attributes
+        # and calls methods (and, after "@", outside names) just like Python
+        expressions = node.args[:1] + [keyword.value for keyword in node.keywords if keyword.arg == EXPRESSION_KEYWORD]
+        if not expressions or not all(
+            isinstance(expression, ast.Constant) and isinstance(expression.value, str) for expression in expressions
+        ):
+            raise UnsafeCode(f"Generated code passes '.{node.func.attr}' a computed expression, which is not allowed")
+        for expression in expressions:
+            source = _BACKTICKED.sub("column", expression.value).replace("@", "")
+            try:
+                tree = ast.parse(source.strip())
+            except SyntaxError:
+                raise UnsafeCode(f"Generated code passes '.{node.func.attr}' an expression that can't be checked")
+            self.visit(tree)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def validate(code):
+    # -> the source to run (possibly rewritten); raises UnsafeCode or SyntaxError
+    code = _FENCE.sub("", code)
+    tree = ast.parse(code)
+    guarded = ast.fix_missing_locations(_Guard(tree).visit(tree))
+    return ast.unparse(guarded)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def compiled(code):
+    # Called in the sandbox workers with validated source
+    return compile(code, "<generated>", "exec")
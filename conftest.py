@@ -0,0 +1 @@
+# The modules are flat at the top of the repository; this file puts it on sys.path for tests/
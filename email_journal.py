@@ -0,0 +1,154 @@
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import batch_engine
+import llm_cache
+import merchant_prompt
+import multi_merchant
+import sqlite_writer
+import token_ledger
+
+# Append-only journal of generated emails, so an interrupted batch (crash, expired key, retries used
+# up) can be resumed instead of started over.
+# Every email is appended as soon as it is generated, keyed by
+#   - the merchant fingerprint: a hash of the details the prompt is given (merchant_prompt.compact)
+#   - the bot variant (token_ledger.current_variant)
+#   - the prompt version: a hash of the agent's payload with the merchant left out (model, instructions,
+#     sender, settings), so editing a prompt starts a new version instead of reusing old emails
+# A batch first takes the merchants already in the journal for its variant and prompt version and only
+# generates the rest. Failures aren't journaled, so they are retried. Bypassing the LLM cache also
+# bypasses the journal (everything is regenerated and appended; the newest entry wins).
+# Emails arrive inside the batch's event loop, so they are written by a background thread (sqlite_writer).
+
+JOURNAL_PATH = os.environ.get("EMAILBOT_EMAIL_JOURNAL", ".cache/email_journal.sqlite")
+LOOKUP_CHUNK = 500  # keys per SELECT, under SQLite's bound parameter limit
+
+stats = {"restored": 0, "journaled": 0}
+_stats_lock = threading.Lock()
+_schema_ready = set()
+
+
+def summary():
+    with _stats_lock:
+        return f"Email journal: {stats['restored']} restored, {stats['journaled']} saved"
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        stats[name] += amount
+
+
+def _connect(path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    connection = sqlite3.connect(path, timeout=10)
+    if path not in _schema_ready:
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS emails ("
+                "ts REAL, variant TEXT, prompt_version TEXT, fingerprint TEXT, merchant_name TEXT, "
+                "to_email TEXT, subject TEXT, body TEXT)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS emails_key ON emails (variant, prompt_version, fingerprint)"
+            )
+        _schema_ready.add(path)
+    return connection
+
+
+@contextlib.contextmanager
+def _connection(path=None):
+    connection = _connect(path or JOURNAL_PATH)
+    try:
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def _insert(path, rows):
+    with _connection(path) as connection:
+        connection.executemany(
+            "INSERT INTO emails (ts, variant, prompt_version, fingerprint, merchant_name, to_email, subject, body) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+    _count("journaled", len(rows))
+
+
+_writer = sqlite_writer.BackgroundWriter("email-journal-writer", _insert, "Email journal")
+
+
+def fingerprint(merchant_details):
+    return hashlib.sha256(merchant_prompt.compact(merchant_details).encode()).hexdigest()[:16]
+
+
+def prompt_version(agent, sender):
+    payload = agent.build_payload(multi_merchant.MERCHANT_SLOT, *sender)
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
+def completed(variant, version, fingerprints):
+    # -> {fingerprint: (to_email, subject, body)} for the journaled ones, newest entry per merchant
+    found = {}
+    unique = sorted(set(fingerprints))
+    _writer.flush()
+    with _connection() as connection:
+        for start in range(0, len(unique), LOOKUP_CHUNK):
+            chunk = unique[start:start + LOOKUP_CHUNK]
+            rows = connection.execute(
+                "SELECT fingerprint, to_email, subject, body FROM emails "
+                f"WHERE variant IS ? AND prompt_version = ? AND fingerprint IN ({', '.join('?' * len(chunk))}) "
+                "ORDER BY rowid",
+                [variant, version, *chunk],
+            )
+            for key, to_email, subject, body in rows:
+                found[key] = (to_email, subject, body)
+    return found
+
+
+def append(variant, version, key, merchant_details, email):
+    # Queued for the writer thread; a failed write is only reported, the email itself is still returned
+    to_email, subject, body = email
+    _writer.append(
+        JOURNAL_PATH,
+        (time.time(), variant, version, key, merchant_details.get("merchant_name"), to_email, subject, body),
+    )
+
+
+def generate_batch(agent, merchant_rows, sender, concurrency=batch_engine.DEFAULT_CONCURRENCY, group_size=1,
+                   on_result=None, on_restored=None):
+    # batch_engine.generate_batch with resume. `on_restored` gets the journaled results (once, before
+    # generating); `on_result` then gets each new one, both with indexes into `merchant_rows`.
+    variant = token_ledger.current_variant.get()
+    version = prompt_version(agent, sender)
+    keys = [fingerprint(merchant_details) for merchant_details in merchant_rows]
+    done = {} if llm_cache.bypass.get() else completed(variant, version, keys)
+
+    restored = [batch_engine.BatchResult(index, done[key], None) for index, key in enumerate(keys) if key in done]
+    pending = [index for index, key in enumerate(keys) if key not in done]
+    _count("restored", len(restored))
+    if on_restored is not None:
+        on_restored(restored)
+
+    def record(result):
+        # Indexes from the pending sub-batch back to `merchant_rows`
+        index = pending[result.index]
+        if result.error is None:
+            append(variant, version, keys[index], merchant_rows[index], result.value)
+        result = batch_engine.BatchResult(index, result.value, result.error)
+        if on_result is not None:
+            on_result(result)
+        return result
+
+    generated = []
+    if pending:
+        batch_engine.generate_batch(
+            agent, [merchant_rows[index] for index in pending], sender, concurrency, group_size,
+            on_result=lambda result: generated.append(record(result)),
+        )
+    return sorted(restored + generated, key=lambda result: result.index)
@@ -1,33 +1,31 @@
-import streamlit as st
+try:
+    import streamlit as st
+except ImportError:  # only main() needs Streamlit; batch_cli uses the agents headless
+    st = None
 import pandas as pd
-from openai import OpenAI
-import io
 from contextlib import redirect_stdout
-import plotly.express as px
 import re
-import openai
-
-# Load data
-@st.cache_data
+import job_runner
+import live_output
+import llm_cache
+import llm_client
+import merchant_prompt
+import merchant_store
+import providers
+import query_engine
+import reasoning
+import sidebar
+import structured_output
+import token_ledger
+
+# Load data (one frame shared by every bot module, see providers.merchants)
 def load_data():
     try:
-        return pd.read_csv("merchants_sg_emails.csv")
+        return providers.merchants()
     except FileNotFoundError:
         st.error("The file 'merchants_sg_emails.csv' was not found.")
         return pd.DataFrame()  # Return an empty DataFrame
 
-df = load_data()
-
-# Retrieve the Kluster API key and base URL securely from Streamlit secrets
-kluster_api_key = st.secrets["kluster"]["api_key"]
-base_url = st.secrets["kluster"]["base_url"]
-
-# Set up DeepSeek API via Kluster AI
-client = OpenAI(
-    api_key=kluster_api_key,  # Use the API key from secrets
-    base_url=base_url  # Use the base URL from secrets
-)
-
 # Update the parsing logic for the response
 
 
@@ -72,6 +70,17 @@ def parse_email_response(response_text):
         return None, None, None
 
 
+# Like parse_email_response, but raises instead of returning Nones so incomplete emails are never cached
+def parse_complete_email(response_text):
+    to_email, subject, body = parse_email_response(response_text)
+    if to_email is None:
+        raise ValueError("Parsing error: Missing one or more email components.")
+    return to_email, subject, body
+
+
+# JSON replies first (see structured_output); the text layout is still accepted as a fallback
+def parse_structured_email(response_text):
+    return structured_output.parse_email(response_text, parse_complete_email)
 
 
 # Email Agent (for email generation)
@@ -79,9 +88,8 @@ class EmailAgent:
     def __init__(self, client):
         self.client = client
 
-        # Modify your generate_email function to use the updated parsing logic
-    def generate_email(self, merchant_details, your_name, your_position, your_email, your_phone):
-        prompt = f"""
+    def build_payload(self, merchant_details, your_name, your_position, your_email, your_phone):
+        instructions = """
         Assume yourself as a lead Marketing Lead, with years of experiences working for leading merchant sourcing and acquiring companies such as wirecard, cardlytics, fave that has helped to connect with small to medium merchants to source an offer. 
         Generate a personalized email for <merchant_name> with a compelling and curiosity-piquing subject line that feels authentic and human-crafted, ensuring the recipient does not perceive it as spam or automated. 
 
@@ -111,67 +119,69 @@ class EmailAgent:
         But you can use similar making it tailor made written for the email sender making more personalized and emotionally engage answering a problem and pain of a merchant
 
 
-        Merchant Details:
-        {merchant_details}
-
+        Please generate a full and detailed email that includes a proper closing and call to action, ensuring the email does not get cut off at any point.
+        """
 
+        details = f"""
         Always include the sender's details:
         Name: {your_name}
         Position: {your_position}
         Email: {your_email}
         Phone: {your_phone}
 
-        Respond in the following format:
-        To: <merchant_email>
-        Subject: <subject_line>
-        Body: <email_body>
-
-
-        Please generate a full and detailed email that includes a proper closing and call to action, ensuring the email does not get cut off at any point.
+        Merchant Details:
+        {merchant_prompt.serialize(merchant_details)}
         """
 
+        payload = {
+            "model": reasoning.model_for("short_email"),
+            "messages": [
+                {"role": "system", "content": "Assume yourself as a lead Marketing Lead, with years of experience working for leading merchant sourcing and acquiring companies such as Wirecard, Cardlytics, and Fave, helping connect small to medium merchants to source an offer."},
+                {"role": "user", "content": instructions},
+                {"role": "user", "content": details}
+            ],
+            "max_completion_tokens": 1500,
+            "temperature": 0.7,
+        }
+        return structured_output.request_json(payload, structured_output.PROMPT_ONLY)
+
+    def async_session(self):
+        return llm_client.async_openai_client(self.client)
+
+    async def acomplete(self, session, payload, title="Merchant"):
+        # Always streamed, so reasoning is dropped and a malformed reply cut short as it arrives
         try:
-            response = self.client.chat.completions.create(
-                model="deepseek-ai/DeepSeek-R1",
-                messages=[
-                    {"role": "system", "content": "Assume yourself as a lead Marketing Lead, with years of experience working for leading merchant sourcing and acquiring companies such as Wirecard, Cardlytics, and Fave, helping connect small to medium merchants to source an offer."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_completion_tokens=1500,
-                temperature=0.7,
+            return await llm_client.async_openai_stream(
+                session, payload, live_output.sink(title, payload), reasoning_budget=reasoning.budget_for(payload)
+            )
+        except reasoning.ReasoningOverBudget:
+            # R1 kept thinking past its budget: answer with the non-reasoning model instead
+            payload = reasoning.without_reasoning(payload)
+            return await llm_client.async_openai_stream(
+                session, payload, live_output.sink(f"{title} (no reasoning)", payload)
             )
-            response_text = response.choices[0].message.content
-
-            # Use the new parsing logic to extract the components
-            to_email, subject, body = parse_email_response(response_text)
-            
-            return to_email, subject, body
-        except Exception as e:
-            st.error(f"Error generating email: {str(e)}")
-            return None, None, None
 
+    def parse_email(self, response_text, merchant_details, your_name, your_position, your_email, your_phone):
+        return parse_structured_email(response_text)
 
-# Function to generate emails for all merchants
-def generate_emails_with_agent(merchants, agent):
-    emails = []
-    your_name = "Sumit"
-    your_position = "Marketing Manager"
-    your_email = "sumit@pulseid.com"
-    your_phone = "+971504959576"
-    
-    for _, row in merchants.iterrows():
-        merchant_details = row.to_dict()
-        to_email, subject, body = agent.generate_email(
-            merchant_details, your_name, your_position, your_email, your_phone
+    async def agenerate_email(self, session, merchant_details, your_name, your_position, your_email, your_phone):
+        payload = self.build_payload(merchant_details, your_name, your_position, your_email, your_phone)
+        return await llm_cache.async_cached_text(
+            payload,
+            lambda: self.acomplete(session, payload, merchant_details.get('merchant_name', 'Merchant')),
+            parse_structured_email,
         )
-        emails.append({
-            "Merchant Name": row["merchant_name"],
-            "Email": f"To: {to_email}\n\nSubject: {subject}\n\n{body}",
-        })
-    return pd.DataFrame(emails)
+
+
+# Sender signed into every email (the page's jobs and batch_cli's default sender for this variant)
+SENDER = ("Sumit", "Marketing Manager", "sumit@pulseid.com", "+971504959576")
+
 
 def main():
     # Streamlit app starts here
+    token_ledger.current_variant.set(__name__)  # tags this run's provider calls in the ledger
+    df = load_data()
+    client = providers.kluster_client()  # created once per process, see providers
     st.title("Merchant Bot")
     st.write("Interact with your Email Generator Bot!")
 
@@ -179,6 +189,11 @@ def main():
     st.subheader("Dataset Preview")
     st.dataframe(df.head(3))  # Display the first 5 rows
 
+    # Which steps may use DeepSeek-R1's reasoning (code generation, email generation)
+    reasoning.current_mode.set(
+        st.sidebar.selectbox("DeepSeek reasoning", list(reasoning.MODES), format_func=reasoning.MODES.get)
+    )
+
     # User Input
     query = st.text_input("Which kind of merchants are you seeking? (e.g., Who are the top merchants in Singapore)")
 
@@ -192,6 +207,7 @@ def main():
             openai_prompt = f"""
             You are a helpful assistant that generates Python code for data analysis. The dataset contains the following columns:
             {', '.join(df.columns)}
+            {merchant_store.COLUMN_NOTES}
 
             The user has requested the following:
             {query}
@@ -213,30 +229,19 @@ def main():
             - Skip all reasoning steps. Do not include `<think>` or any other meta-content.
             """
 
-            try:
-                response = client.chat.completions.create(
-                    model="deepseek-ai/DeepSeek-R1",
-                    messages=[
+            def generate_code():
+                # Streamed so any reasoning is dropped as it arrives rather than stripped afterwards
+                return llm_client.openai_stream_text(client, {
+                    "model": reasoning.model_for("code"),
+                    "messages": [
                         {"role": "system", "content": "You are a helpful data assistant that generates Python code."},
                         {"role": "user", "content": openai_prompt}
                     ]
-                )
-                python_code = response.choices[0].message.content.strip()
-                raw_output = response.choices[0].message.content.strip()
+                }).strip()
 
-                #st.write("Generated Python Code:")
-                #st.code(python_code)
-
-
-                # Remove <think>...</think> section
-                cleaned_output = re.sub(r"<think>.*?</think>", "", raw_output, flags=re.DOTALL).strip()
-                python_code = cleaned_output
-                #st.write("Generated Python Code:")
-                #st.code(cleaned_output)
-
-                exec_globals = {"df": df, "pd": pd, "px": px, "st": st}
-                exec(python_code, exec_globals)
-                st.session_state.output_data = exec_globals.get('output_data', pd.DataFrame())
+            try:
+                # Repeated queries reuse previously validated code instead of calling the LLM
+                st.session_state.output_data = query_engine.run_query(query, df, generate_code)
             
             except Exception as e:
                 st.error(f"Error: {e}")
@@ -247,27 +252,20 @@ def main():
         st.write("### Extracted Merchants")
         st.dataframe(st.session_state.output_data)  # Display merchant data
         
-        if st.button("Generate Emails"):
-            email_agent = EmailAgent(client=client)  # Initialize the agent
-            generated_emails_df = generate_emails_with_agent(merchants, email_agent)
-            
-            st.write("Generated Emails:")
-            for _, row in generated_emails_df.iterrows():
-                st.write(f"### Email for {row['Merchant Name']}")
-                st.write(row['Email'])
-                st.write("---")
-            
-            csv_buffer = io.StringIO()
-            generated_emails_df.to_csv(csv_buffer, index=False)
-            st.download_button(
-                label="Download Emails as CSV",
-                data=csv_buffer.getvalue(),
-                file_name="generated_emails.csv",
-                mime="text/csv",
+        concurrency, group_size = sidebar.generation_settings(llm_client.openai_controller(client), [reasoning.summary()])
+
+        # Generation runs as a background job (see job_runner), so using the page meanwhile doesn't cancel it
+        if st.button("Generate Emails", disabled=job_runner.is_active(st.session_state.get("email_job"))):
+            st.session_state.email_job = job_runner.submit(
+                EmailAgent(client=client), merchants, SENDER, concurrency, group_size
             )
+        if "email_job" in st.session_state:
+            job_runner.render(st.session_state.email_job)
     else:
         st.write("No merchant data available.")
 
+    token_ledger.render_panel()
+
 # Run the app
 if __name__ == "__main__":
     main()
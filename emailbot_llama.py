@@ -1,45 +1,71 @@
-import streamlit as st
+try:
+    import streamlit as st
+except ImportError:  # only main() needs Streamlit; batch_cli uses the agents headless
+    st = None
 import pandas as pd
-import requests
-import io
-import plotly.express as px
 import re
-import time
-import random
+import job_runner
+import live_output
+import llm_cache
+import llm_client
+import merchant_prompt
+import merchant_store
+import providers
+import query_engine
+import sidebar
+import retry_policy
+import structured_output
+import token_ledger
 
 ######
-# Load data
-@st.cache_data
+# Load data (one frame shared by every bot module, see providers.merchants)
 def load_data():
     try:
-        return pd.read_csv("merchants_sg_emails.csv")
+        return providers.merchants()
         #return pd.read_csv("burpple_data_with_emails.csv")
     except FileNotFoundError:
         st.error("The file 'merchants_sg_emails.csv' was not found.")
         #st.error("The file 'burpple_data_with_emails.csv' was not found.")
         return pd.DataFrame()  # Return an empty DataFrame
 
+# Parse the old 'To: / Subject: / Body:' layout, for replies that don't come back as JSON
+def parse_email_response(response_text, your_name, your_position, your_email, your_phone):
+    # Check if response_text is a string and not empty
+    if not response_text.strip():
+        raise ValueError("Empty response text received from API.")
 
-df = load_data()
+    # Use regex to capture the Subject and Body directly
+    subject_match = re.search(r"Subject:\s*(.*)", response_text)
+    body_match = re.search(r"(Dear\s*\w+|Hello\s*\w+|Hi\s*\w+)[\s\S]*", response_text)
 
-# Set your Groq API endpoint and API key securely
-groq_api_url = "https://api.groq.com/openai/v1/chat/completions"  # Correct endpoint
-groq_api_key = st.secrets["groq"]["api_key"]  # Make sure to securely fetch the API key from environment variables  # Make sure to securely fetch the API key from environment variables
+    # Check if Subject and Body were found
+    if not (subject_match and body_match):
+        raise ValueError("Parsing error: Missing 'Subject' or 'Body'.")
 
-headers = {
-    "Authorization": f"Bearer {groq_api_key}",
-    "Content-Type": "application/json"
-}
+    subject = subject_match.group(1).strip()
+    body = body_match.group(0).strip()
+
+    # Extract 'To' directly
+    to_match = re.search(r"To:\s*(\S+@\S+)", response_text)
+    to_email = to_match.group(1).strip() if to_match else "Error: No email found"
+
+    # Fix: Add line breaks to sender details
+    body = body.replace(
+        f"{your_name} {your_position} {your_email} {your_phone}",
+        f"{your_name}\n\n{your_position}\n\n{your_email}\n\n{your_phone}"
+    )
+
+    return to_email, subject, body
 
 # Email Agent (for email generation)
 class EmailAgent:
-    def __init__(self, max_retries=10, base_delay=10):
-        self.max_retries = max_retries  # Maximum retry attempts
-        self.base_delay = base_delay  # Initial delay in seconds
+    def __init__(self, max_retries=3, base_delay=1):
+        # Retries apply to rate limits, 5xx and timeouts only; waits follow the server's Retry-After
+        self.retry_policy = retry_policy.RetryPolicy(max_retries=max_retries, base_delay=base_delay)
+        self.headers = providers.groq_headers()
 
-    def generate_email(self, merchant_details, your_name, your_position, your_email, your_phone):
-        merchant_name = merchant_details.get('merchant_name', 'Merchant')  # Extract the merchant name from the details
-        prompt = f"""
+    def build_payload(self, merchant_details, your_name, your_position, your_email, your_phone):
+        instructions = """
         Assume yourself as a lead Marketing Lead, with years of experiences working for leading merchant sourcing and acquiring companies such as wirecard, cardlytics, fave that has helped to connect with small to medium merchants to source an offer. 
         Generate a personalized email for <merchant_name> with a compelling and curiosity-piquing subject line that feels authentic and human-crafted, ensuring the recipient does not perceive it as spam or automated. 
 
@@ -72,119 +98,64 @@ class EmailAgent:
 
          Pulse iD Website Link: https://www.pulseid.com/
 
-        Merchant Details:
-        {merchant_details}
-
+        """
 
+        details = f"""
         Always include the sender's details:
         Name: {your_name}
         Position: {your_position}
         Email: {your_email}
         Phone: {your_phone}
 
-        Respond in the following format:
-        To: <merchant_email>
-        Subject: <subject_line>
-        Body: <email_body>
+        Merchant Details:
+        {merchant_prompt.serialize(merchant_details)}
         """
 
         payload = {
             "model": "llama-3.3-70b-versatile",  # Correct model name
             "messages": [
                 {"role": "system", "content": "You are a lead marketing manager with extensive experience."},
-                {"role": "user", "content": prompt}
+                {"role": "user", "content": instructions},
+                {"role": "user", "content": details}
             ]
         }
-        
-        retries = 0
+        return structured_output.request_json(payload, structured_output.JSON_OBJECT)
 
-        while retries < self.max_retries:
-            try:
-                response = requests.post(groq_api_url, json=payload, headers=headers)
-                if response.status_code == 200:
-                    response_text = response.json()['choices'][0]['message']['content']
-                    
-                    # Debugging step: print raw response
-                    print(response.json())
-
-                    # Display email content for a specific merchant
-                    st.write(f"****************************************")
-                    st.write(f"### Email for: {merchant_name}")
-                    st.text(response_text)  # Display the raw response text
-                    
-                    # Check if response_text is a string and not empty
-                    if not response_text.strip():
-                        raise ValueError("Empty response text received from API.")
-
-                    # Use regex to capture the Subject and Body directly
-                    subject_match = re.search(r"Subject:\s*(.*)", response_text)
-                    body_match = re.search(r"(Dear\s*\w+|Hello\s*\w+|Hi\s*\w+)[\s\S]*", response_text)
-
-                    # Check if Subject and Body were found
-                    if subject_match and body_match:
-                        subject = subject_match.group(1).strip()
-                        body = body_match.group(0).strip()
-
-                        # Extract 'To' directly
-                        to_match = re.search(r"To:\s*(\S+@\S+)", response_text)
-                        to_email = to_match.group(1).strip() if to_match else "Error: No email found"
-
-                        # Fix: Add line breaks to sender details
-                        body = body.replace(
-                            f"{your_name} {your_position} {your_email} {your_phone}",
-                            f"{your_name}\n\n{your_position}\n\n{your_email}\n\n{your_phone}"
-                        )
-                        
-                        return to_email, subject, body
-                    else:
-                        raise ValueError("Parsing error: Missing 'Subject' or 'Body'.")
-                
-                elif response.status_code == 429:  # Rate Limit Exceeded
-                    retries += 1
-                    wait_time = 2 ** retries + random.uniform(0, 1)  # Exponential backoff with jitter
-                    print(f"Rate limit hit. Retrying in {wait_time:.2f} seconds...")
-                    time.sleep(wait_time)
-                
-                else:
-                    raise Exception(f"API request failed with status code {response.status_code}")
+    async def acomplete(self, session, payload, title="Merchant"):
+        # Always streamed, so a malformed reply is cut short as it arrives (see live_output.sink)
+        return await llm_client.async_groq_stream(
+            session, payload, self.headers, live_output.sink(title, payload), policy=self.retry_policy
+        )
 
-            except Exception as e:
-                print("Error occurred:", str(e))  # Log the error for better debugging
-                retries += 1
-                wait_time = 2 ** retries + random.uniform(0, 1)  # Exponential backoff
-                print(f"Retrying ({retries}/{self.max_retries}) in {wait_time:.2f} seconds...")
-                time.sleep(wait_time)
-
-        return "Error", "Error generating email", "Max retries exceeded."
-
-# Function to generate emails for all merchants
-def generate_emails_with_agent(merchants, agent):
-    emails = []
-    your_name = "Rasika Galhena"
-    your_position = "Marketing Manager"
-    your_email = "rasika@pulseid.net"
-    your_phone = "+94775052158"
-    
-    for _, row in merchants.iterrows():
-        merchant_details = row.to_dict()
-        
-        # Add a delay before making the request
-        time.sleep(random.uniform(1.5, 3.0))  # Random delay between 1.5 to 3 seconds
-        
-        to_email, subject, body = agent.generate_email(
-            merchant_details, your_name, your_position, your_email, your_phone
+    def parse_email(self, response_text, merchant_details, your_name, your_position, your_email, your_phone):
+        # JSON replies first (see structured_output); the text layout is still accepted as a fallback
+        return structured_output.parse_email(
+            response_text,
+            lambda text: parse_email_response(text, your_name, your_position, your_email, your_phone),
+        )
+
+    async def agenerate_email(self, session, merchant_details, your_name, your_position, your_email, your_phone):
+        payload = self.build_payload(merchant_details, your_name, your_position, your_email, your_phone)
+        return await llm_cache.async_cached_text(
+            payload,
+            lambda: self.acomplete(session, payload, merchant_details.get('merchant_name', 'Merchant')),
+            lambda response_text: self.parse_email(
+                response_text, merchant_details, your_name, your_position, your_email, your_phone
+            ),
         )
-        emails.append({
-            "Merchant Name": row["merchant_name"],
-            "Email": f"To: {to_email}\n\nSubject: {subject}\n\n{body}",
-        })
-    
-    return pd.DataFrame(emails)
 
+    def async_session(self):
+        return llm_client.async_groq_client()
+
+# Sender signed into every email (the page's jobs and batch_cli's default sender for this variant)
+SENDER = ("Rasika Galhena", "Marketing Manager", "rasika@pulseid.net", "+94775052158")
 
 
 def main():
     # Streamlit app starts here
+    token_ledger.current_variant.set(__name__)  # tags this run's provider calls in the ledger
+    df = load_data()
+    headers = providers.groq_headers()  # created once per process, see providers
     st.title("Merchant Bot")
     st.write("Interact with your Email Generator Bot!")
 
@@ -205,6 +176,7 @@ def main():
             openai_prompt = f"""
             You are a helpful assistant that generates Python code for data analysis. The dataset contains the following columns:
             {', '.join(df.columns)}
+            {merchant_store.COLUMN_NOTES}
 
             The user has requested the following:
             {query}
@@ -217,7 +189,7 @@ def main():
             when generate Python code that first displays the result using Streamlit functions (`st.write()`, `st.dataframe()`, etc.). Once the result is displayed, store it in the variable 'output_data' in last line of the code. Ensure that the result is properly displayed **before** being assigned to the 'output_data' variable.
             """
             
-            try:
+            def generate_code():
                 # Use Llama API to generate Python code
                 payload = {
                     "model": "llama-3.3-70b-versatile",
@@ -227,14 +199,12 @@ def main():
                     ]
                 }
 
-                response = requests.post(groq_api_url, json=payload, headers=headers)
-                if response.status_code == 200:
-                    python_code = response.json()['choices'][0]['message']['content'].strip()
+                response = llm_client.groq_chat(payload, headers)
+                return response.json()['choices'][0]['message']['content'].strip()
 
-                    # Execute the code
-                    exec_globals = {"df": df, "pd": pd, "px": px, "st": st}
-                    exec(python_code, exec_globals)
-                    st.session_state.output_data = exec_globals.get('output_data', pd.DataFrame())
+            try:
+                # Repeated queries reuse previously validated code instead of calling the LLM
+                st.session_state.output_data = query_engine.run_query(query, df, generate_code)
             
             except Exception as e:
                 st.error(f"Error: {e}")
@@ -248,23 +218,20 @@ def main():
         # Display the extracted merchants count
         #st.write(f"Extracted merchants count: {len(merchants)}")
 
-        if st.button("Generate Emails"):
-            email_agent = EmailAgent()
-            generated_emails_df = generate_emails_with_agent(merchants, email_agent)
+        concurrency, group_size = sidebar.generation_settings(llm_client.groq_controller(headers))
 
-            
-            # Allow user to download the generated emails as CSV
-            csv_buffer = io.StringIO()
-            generated_emails_df.to_csv(csv_buffer, index=False)
-            st.download_button(
-                label="Download Emails as CSV",
-                data=csv_buffer.getvalue(),
-                file_name="generated_emails.csv",
-                mime="text/csv",
+        # Generation runs as a background job (see job_runner), so using the page meanwhile doesn't cancel it
+        if st.button("Generate Emails", disabled=job_runner.is_active(st.session_state.get("email_job"))):
+            st.session_state.email_job = job_runner.submit(
+                EmailAgent(), merchants, SENDER, concurrency, group_size
             )
+        if "email_job" in st.session_state:
+            job_runner.render(st.session_state.email_job)
     else:
         st.write("No merchant data available.")
 
+    token_ledger.render_panel()
+
 
 # Run the app
 if __name__ == "__main__":
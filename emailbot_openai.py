@@ -1,38 +1,62 @@
-import streamlit as st
+try:
+    import streamlit as st
+except ImportError:  # only main() needs Streamlit; batch_cli uses the agents headless
+    st = None
 import pandas as pd
-from openai import OpenAI
-import io
-import plotly.express as px
-import openai
+import job_runner
+import live_output
+import llm_cache
+import llm_client
+import merchant_prompt
+import merchant_store
+import providers
+import query_engine
+import sidebar
+import structured_output
+import token_ledger
 
 ###
-# Load data
-@st.cache_data
+# Load data (one frame shared by every bot module, see providers.merchants)
 def load_data():
     try:
-        return pd.read_csv("merchants_sg_emails.csv")
+        return providers.merchants()
     except FileNotFoundError:
         st.error("The file 'merchants_sg_emails.csv' was not found.")
         return pd.DataFrame()  # Return an empty DataFrame
 
-df = load_data()
+# Parse the old 'To: / Subject: / Body:' layout, for replies that don't come back as JSON
+def parse_email_response(response_text):
+    # Initialize variables
+    to_email, subject, body = None, None, None
 
-# Initialize OpenAI Client
-# Set your API key securely from Streamlit secrets
-openai.api_key = st.secrets["openai"]["api_key"] # Replace with your actual key
-# Alternatively, you can use an environment variable:
-# os.environ["OPENAI_API_KEY"] = "your-api-key"
-# Then use: openai.api_key = os.getenv("OPENAI_API_KEY")
+    # Split the response into lines
+    lines = response_text.split("\n")
 
-client = OpenAI(api_key=openai.api_key)  # Initialize the client with API key
+    # Parse the lines for email components
+    for index, line in enumerate(lines):
+        if line.lower().startswith("to:"):
+            to_email = line.split(":", 1)[1].strip()
+        elif line.lower().startswith("subject:"):
+            subject = line.split(":", 1)[1].strip()
+        elif line.lower().startswith("body:"):
+            body = "\n".join(lines[index + 1:]).strip()
+
+    if not (to_email and subject and body):
+        raise ValueError("Parsing error: Missing one or more email components.")
+
+    return to_email, subject, body
+
+# JSON replies first (see structured_output); the text layout is still accepted as a fallback
+def parse_structured_email(response_text):
+    return structured_output.parse_email(response_text, parse_email_response)
 
 # Email Agent (for email generation)
 class EmailAgent:
     def __init__(self, client):
         self.client = client
 
-    def generate_email(self, merchant_details, your_name, your_position, your_email, your_phone):
-        prompt = f"""
+    def build_payload(self, merchant_details, your_name, your_position, your_email, your_phone):
+        instructions = """
         Assume yourself as a lead Marketing Lead, with years of experiences working for leading merchant sourcing and acquiring companies such as wirecard, cardlytics, fave that has helped to connect with small to medium merchants to source an offer. 
         Generate a personalized email for <merchant_name> with a compelling and curiosity-piquing subject line that feels authentic and human-crafted, ensuring the recipient does not perceive it as spam or automated. 
 
@@ -65,82 +89,58 @@ class EmailAgent:
         
         Pulse iD Website Link: https://www.pulseid.com/
 
-        Merchant Details:
-        {merchant_details}
-
+        """
 
+        details = f"""
         Always include the sender's details:
         Name: {your_name}
         Position: {your_position}
         Email: {your_email}
         Phone: {your_phone}
 
-        Respond in the following format:
-        To: <merchant_email>
-        Subject: <subject_line>
-        Body: <email_body>
-        Ensure the response strictly follows this format, including the "Body:" label before the message content.
+        Merchant Details:
+        {merchant_prompt.serialize(merchant_details)}
         """
 
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "Assume yourself as a lead Marketing Lead with extensive experience."},
-                    {"role": "user", "content": prompt},
-                ],
-                max_tokens=600,
-                temperature=0.7,
-            )
-            response_text = response.choices[0].message.content
+        payload = {
+            "model": "gpt-4o",
+            "messages": [
+                {"role": "system", "content": "Assume yourself as a lead Marketing Lead with extensive experience."},
+                {"role": "user", "content": instructions},
+                {"role": "user", "content": details},
+            ],
+            "max_tokens": 600,
+            "temperature": 0.7,
+        }
+        return structured_output.request_json(payload, structured_output.JSON_SCHEMA)
+
+    def async_session(self):
+        return llm_client.async_openai_client(self.client)
+
+    async def acomplete(self, session, payload, title="Merchant"):
+        # Always streamed, so a malformed reply is cut short as it arrives (see live_output.sink)
+        return await llm_client.async_openai_stream(session, payload, live_output.sink(title, payload))
+
+    def parse_email(self, response_text, merchant_details, your_name, your_position, your_email, your_phone):
+        return parse_structured_email(response_text)
+
+    async def agenerate_email(self, session, merchant_details, your_name, your_position, your_email, your_phone):
+        payload = self.build_payload(merchant_details, your_name, your_position, your_email, your_phone)
+        return await llm_cache.async_cached_text(
+            payload,
+            lambda: self.acomplete(session, payload, merchant_details.get('merchant_name', 'Merchant')),
+            parse_structured_email,
+        )
 
-            #st.write("API Raw Response:", response)
-            #st.write("API Text Response:", response.choices[0].message.content)
+# Sender signed into every email (the page's jobs and batch_cli's default sender for this variant)
+SENDER = ("Rasika Galhena", "Marketing Manager", "rasika@pulseid.net", "+94775052158")
 
-            # Initialize variables
-            to_email, subject, body = None, None, None
-            
-            # Split the response into lines
-            lines = response_text.split("\n")
-            
-            # Parse the lines for email components
-            for line in lines:
-                if line.lower().startswith("to:"):
-                    to_email = line.split(":", 1)[1].strip()
-                elif line.lower().startswith("subject:"):
-                    subject = line.split(":", 1)[1].strip()
-                elif line.lower().startswith("body:"):
-                    body = "\n".join(lines[lines.index(line) + 1:]).strip()
-
-            if not (to_email and subject and body):
-                raise ValueError("Parsing error: Missing one or more email components.")
-        
-        except Exception as e:
-            to_email, subject, body = "Error", "Error generating email", str(e)
-        
-        return to_email, subject, body
-
-# Function to generate emails for all merchants
-def generate_emails_with_agent(merchants, agent):
-    emails = []
-    your_name = "Rasika Galhena"
-    your_position = "Marketing Manager"
-    your_email = "rasika@pulseid.net"
-    your_phone = "+94775052158"
-    
-    for _, row in merchants.iterrows():
-        merchant_details = row.to_dict()
-        to_email, subject, body = agent.generate_email(
-            merchant_details, your_name, your_position, your_email, your_phone
-        )
-        emails.append({
-            "Merchant Name": row["merchant_name"],
-            "Email": f"To: {to_email}\n\nSubject: {subject}\n\n{body}",
-        })
-    return pd.DataFrame(emails)
 
 def main():
     # Streamlit app starts here
+    token_ledger.current_variant.set(__name__)  # tags this run's provider calls in the ledger
+    df = load_data()
+    client = providers.openai_client()  # created once per process, see providers
     st.title("Merchant Bot")
     st.write("Interact with your Email Generator Bot!")
 
@@ -161,6 +161,7 @@ def main():
             openai_prompt = f"""
             You are a helpful assistant that generates Python code for data analysis. The dataset contains the following columns:
             {', '.join(df.columns)}
+            {merchant_store.COLUMN_NOTES}
 
             The user has requested the following:
             {query}
@@ -173,20 +174,19 @@ def main():
             when generate Python code that first displays the result using Streamlit functions (`st.write()`, `st.dataframe()`, etc.). Once the result is displayed, store it in the variable 'output_data' in last line of the code. Ensure that the result is properly displayed **before** being assigned to the 'output_data' variable.
             """
 
-            try:
-                response = client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=[
+            def generate_code():
+                response = llm_client.openai_chat(client, {
+                    "model": "gpt-4o",
+                    "messages": [
                         {"role": "system", "content": "You are a helpful data assistant that generates Python code."},
                         {"role": "user", "content": openai_prompt},
                     ]
-                )
-                python_code = response.choices[0].message.content.strip()
+                })
+                return response.choices[0].message.content.strip()
 
-                # Execute the code
-                exec_globals = {"df": df, "pd": pd, "px": px, "st": st}
-                exec(python_code, exec_globals)
-                st.session_state.output_data = exec_globals.get('output_data', pd.DataFrame())
+            try:
+                # Repeated queries reuse previously validated code instead of calling the LLM
+                st.session_state.output_data = query_engine.run_query(query, df, generate_code)
             
             except Exception as e:
                 st.error(f"Error: {e}")
@@ -197,28 +197,20 @@ def main():
         st.write("### Extracted Merchants")
         st.dataframe(st.session_state.output_data)  # Display merchant data
         
-        if st.button("Generate Emails"):
-            email_agent = EmailAgent(client=client)
-            generated_emails_df = generate_emails_with_agent(merchants, email_agent)
-            
-            st.write("Generated Emails:")
-            for _, row in generated_emails_df.iterrows():
-                st.write(f"### Email for {row['Merchant Name']}")
-                st.write(row['Email'])
-                st.write("---")
-            
-            # Allow user to download the generated emails as CSV
-            csv_buffer = io.StringIO()
-            generated_emails_df.to_csv(csv_buffer, index=False)
-            st.download_button(
-                label="Download Emails as CSV",
-                data=csv_buffer.getvalue(),
-                file_name="generated_emails.csv",
-                mime="text/csv",
+        concurrency, group_size = sidebar.generation_settings(llm_client.openai_controller(client))
+
+        # Generation runs as a background job (see job_runner), so using the page meanwhile doesn't cancel it
+        if st.button("Generate Emails", disabled=job_runner.is_active(st.session_state.get("email_job"))):
+            st.session_state.email_job = job_runner.submit(
+                EmailAgent(client=client), merchants, SENDER, concurrency, group_size
             )
+        if "email_job" in st.session_state:
+            job_runner.render(st.session_state.email_job)
     else:
         st.write("No merchant data available.")
 
+    token_ledger.render_panel()
+
 
 # Run the app
 if __name__ == "__main__":
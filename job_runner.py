@@ -0,0 +1,195 @@
+import contextvars
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import batch_engine
+import email_journal
+import live_output
+
+# Background email generation jobs.
+# Any widget click reruns the Streamlit script, which used to abandon a "Generate Emails" batch running
+# inside main() together with everything it had generated. Batches now run as jobs on a process-level
+# executor instead: the page keeps only the job id in st.session_state, and each email is added to the
+# job as soon as it is ready. render() polls the job and shows progress, the emails so far and an ETA,
+# so the rest of the page can be used meanwhile, plus the emails still streaming in (see live_output).
+# A job runs in a copy of the submitting script run's context, so the cache bypass, reasoning mode and
+# ledger variant chosen on the page apply to it.
+# Jobs go through email_journal: merchants whose emails were already generated (e.g. by a job that died
+# part-way) are restored from the journal at the start, and only the rest are generated.
+
+MAX_RUNNING = 2  # jobs generating at the same time across all sessions; others wait in the queue
+POLL_INTERVAL = 1  # seconds between refreshes of the progress and the emails streaming in
+KEEP_FINISHED = 20  # finished jobs kept for their pages before the oldest are dropped
+
+_executor = ThreadPoolExecutor(max_workers=MAX_RUNNING, thread_name_prefix="email-job")
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def email_row(merchant_details, result):
+    # One row of the results table and its CSV download
+    if result.error is not None:
+        to_email, subject, body = "Error", "Error generating email", str(result.error)
+    else:
+        to_email, subject, body = result.value
+    return {
+        "Merchant Name": merchant_details.get("merchant_name"),
+        "Email": f"To: {to_email}\n\nSubject: {subject}\n\n{body}",
+    }
+
+
+class Job:
+    def __init__(self, merchant_rows):
+        self.id = uuid.uuid4().hex[:12]
+        self.merchant_rows = merchant_rows
+        self.status = "queued"  # -> running -> done | failed
+        self.error = None
+        self.failed = 0
+        self.restored = 0
+        self.started = None
+        self.finished = None
+        self._rows = {}  # input index -> email row, filled in as merchants finish
+        self.live = live_output.LiveView()  # requests streaming right now
+        self._lock = threading.Lock()
+
+    @property
+    def total(self):
+        return len(self.merchant_rows)
+
+    @property
+    def done(self):
+        with self._lock:
+            return len(self._rows)
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def add(self, result):
+        row = email_row(self.merchant_rows[result.index], result)
+        with self._lock:
+            self._rows[result.index] = row
+            self.failed += result.error is not None
+
+    def restore(self, results):
+        for result in results:
+            self.add(result)
+        self.restored = len(results)
+
+    def eta(self):
+        # Seconds left at the generation rate so far (restored emails took no time), or None before the first email
+        done = self.done
+        generated = done - self.restored
+        if self.started is None or generated <= 0:
+            return None
+        return (time.monotonic() - self.started) / generated * (self.total - done)
+
+    def results(self):
+        # The emails generated so far, in input order
+        with self._lock:
+            rows = [self._rows[index] for index in sorted(self._rows)]
+        return pd.DataFrame(rows, columns=["Merchant Name", "Email"])
+
+    def run(self, agent, sender, concurrency, group_size):
+        self.status, self.started = "running", time.monotonic()
+        live_output.current_view.set(self.live)  # this job's own context copy, see submit()
+        try:
+            email_journal.generate_batch(
+                agent, self.merchant_rows, sender, concurrency, group_size, on_result=self.add, on_restored=self.restore
+            )
+            status = "done"
+        except Exception as e:
+            # Per-merchant failures are kept as rows; this is the batch itself failing (e.g. no client)
+            status, self.error = "failed", e
+            print(f"Email job {self.id} failed: {e}")
+        self.finished = time.monotonic()
+        self.status = status  # after `finished`, so a job that is no longer active always has its end time
+        _prune()
+
+
+def _prune():
+    with _jobs_lock:
+        finished = sorted((job for job in _jobs.values() if not job.active), key=lambda job: job.finished)
+        for job in finished[:max(0, len(finished) - KEEP_FINISHED)]:
+            del _jobs[job.id]
+
+
+def submit(agent, merchants, sender, concurrency=batch_engine.DEFAULT_CONCURRENCY, group_size=1):
+    job = Job([row.to_dict() for _, row in merchants.iterrows()])
+    with _jobs_lock:
+        _jobs[job.id] = job
+    context = contextvars.copy_context()
+    _executor.submit(context.run, job.run, agent, sender, concurrency, group_size)
+    return job.id
+
+
+def get(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def is_active(job_id):
+    job = get(job_id) if job_id else None
+    return job is not None and job.active
+
+
+def _duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}m {seconds:02d}s" if minutes else f"{seconds}s"
+
+
+def render(job_id):
+    import streamlit as st
+
+    job = get(job_id)
+    if job is None:
+        st.caption("The last email job is no longer available (the server restarted or it expired).")
+        return
+
+    # Only this part of the page re-runs while the job is active; a full rerun once it finishes
+    # refreshes the sidebar summaries
+    @st.fragment(run_every=POLL_INTERVAL if job.active else None)
+    def progress():
+        done, total, active = job.done, job.total, job.active
+        if job.status == "queued":
+            text = f"Waiting for a free slot ({MAX_RUNNING} jobs run at a time)"
+        elif active:
+            eta = job.eta()
+            text = f"{done}/{total} emails ({job.restored} from the journal), {job.failed} failed · " + (
+                f"about {_duration(eta)} left" if eta is not None else "estimating time left…"
+            )
+        else:
+            text = (
+                f"{done}/{total} emails ({job.restored} from the journal), {job.failed} failed · "
+                f"took {_duration(job.finished - job.started)}"
+            )
+        st.progress(done / total if total else 1.0, text=text)
+        if job.status == "failed":
+            st.error(f"Email generation stopped: {job.error}")
+        if active:
+            # Emails still being written, field by field as they stream in
+            for title, text in job.live.in_flight():
+                st.markdown(f"**{title}**")
+                st.text(text)
+
+        results = job.results()
+        if not results.empty:
+            st.write("Generated Emails:")
+            st.dataframe(results)
+            # Allow user to download the generated emails (so far) as CSV
+            st.download_button(
+                label="Download Emails as CSV",
+                data=results.to_csv(index=False),
+                file_name="generated_emails.csv",
+                mime="text/csv",
+                key=f"download_{job.id}_{done}",
+            )
+        if not active and st.session_state.get("email_job_refreshed") != job.id:
+            st.session_state.email_job_refreshed = job.id
+            st.rerun()
+
+    progress()
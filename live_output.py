@@ -0,0 +1,84 @@
+import contextvars
+import itertools
+import threading
+import time
+
+import rate_limiter
+import stream_parser
+
+# Streamed email replies: checked as they arrive and, while a view is active, shown token by token.
+# Every email request that actually reaches the provider (cache hits don't) is streamed through a
+# stream_parser, with or without a page, so a reply that goes wrong is cut short there (headless and
+# background runs included).
+# A background job (see job_runner) sets its own LiveView as `current_view` on its thread. Each of its
+# requests then keeps the email fields rendered so far (rather than raw JSON) in the view while it
+# streams, and the job's page fragment polls `in_flight()` to show them. A request leaves the view once
+# its email is in the job's results.
+
+RENDER_INTERVAL = 0.1  # seconds between redraws of a streaming box
+
+current_view = contextvars.ContextVar("live_output_view", default=None)
+
+
+class LiveText:
+    # `box` is None when nothing is shown; the parser checks the reply either way
+    def __init__(self, parser, box=None):
+        self.parser = parser
+        self.box = box
+        self.rendered_at = 0.0
+
+    @property
+    def done(self):
+        return self.parser.done
+
+    def restart(self):
+        # A retried request streams again from the beginning
+        self.parser.restart()
+        if self.box is not None:
+            self.box.text("…")
+
+    def write(self, text):
+        self.parser.write(text)  # raises retry_policy.MalformedResponse to cut the stream
+        now = time.monotonic()
+        if self.box is not None and now - self.rendered_at >= RENDER_INTERVAL:
+            self.box.text(self.parser.render())
+            self.rendered_at = now
+
+    def close(self):
+        if self.box is not None:
+            self.box.clear()
+
+
+class LiveView:
+    # The requests of one job that are streaming right now; written from the job's thread, read by the page
+    def __init__(self):
+        self._texts = {}  # box id -> (title, text so far), in the order the requests started
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def box(self, title):
+        return _Box(self, next(self._ids), title)
+
+    def in_flight(self):
+        with self._lock:
+            return list(self._texts.values())
+
+
+class _Box:
+    def __init__(self, view, box_id, title):
+        self.view, self.id, self.title = view, box_id, title  # shown from the first restart() on
+
+    def text(self, value):
+        with self.view._lock:
+            self.view._texts[self.id] = (self.title, value)
+
+    def clear(self):
+        with self.view._lock:
+            self.view._texts.pop(self.id, None)
+
+
+def sink(title, payload):
+    # A LiveText for one request, shown in the current view if there is one
+    view = current_view.get()
+    parser = stream_parser.EmailStreamParser(rate_limiter.completion_cap(payload))
+    return LiveText(parser, view.box(title) if view is not None else None)
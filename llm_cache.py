@@ -0,0 +1,134 @@
+import asyncio
+import contextlib
+import contextvars
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Persistent, content-addressed cache of LLM responses.
+# Entries are keyed by a hash of the request (model, messages, temperature, token cap, ...), expire
+# after CACHE_TTL and are evicted least-recently-used once the cache exceeds CACHE_MAX_BYTES.
+# Only responses that parsed successfully are stored, so a malformed answer is never replayed.
+# The cache's size is kept as a running total, so a put only sums the table when eviction is due (the
+# total is recomputed then, which also picks up what other processes stored). Batches look up and store
+# responses off the event loop.
+
+CACHE_PATH = os.environ.get("EMAILBOT_LLM_CACHE", ".cache/llm_responses.sqlite")
+CACHE_TTL = 7 * 24 * 3600  # seconds
+CACHE_MAX_BYTES = 50 * 1024 * 1024
+EVICT_TO = 0.9  # of CACHE_MAX_BYTES, so a full cache isn't due for eviction again on the next put
+
+# Set per Streamlit run (the "Bypass cache" toggle); bypassing skips reads but still refreshes entries
+bypass = contextvars.ContextVar("llm_cache_bypass", default=False)
+
+stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+_schema_ready = set()
+_sizes = {}  # cache path -> bytes of responses stored
+_sizes_lock = threading.Lock()
+
+
+def _connect():
+    os.makedirs(os.path.dirname(CACHE_PATH) or ".", exist_ok=True)
+    connection = sqlite3.connect(CACHE_PATH, timeout=10)
+    if CACHE_PATH not in _schema_ready:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT, size INTEGER, created REAL, accessed REAL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        with _sizes_lock:
+            _sizes[CACHE_PATH] = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        _schema_ready.add(CACHE_PATH)
+    return connection
+
+
+@contextlib.contextmanager
+def _connection():
+    # Short-lived connections keep this safe across Streamlit threads and processes
+    connection = _connect()
+    try:
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def cache_key(payload):
+    # Everything that shapes the completion; streaming only changes delivery, not content
+    request = {name: value for name, value in payload.items() if name not in ("stream", "stream_options")}
+    return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _count(name):
+    with _stats_lock:
+        stats[name] += 1
+
+
+def summary():
+    with _stats_lock:
+        return f"LLM cache: {stats['hits']} hits / {stats['misses']} misses"
+
+
+def get(payload):
+    if bypass.get():
+        _count("misses")
+        return None
+    now = time.time()
+    key = cache_key(payload)
+    with _connection() as connection:
+        row = connection.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or now - row[1] > CACHE_TTL:
+            _count("misses")
+            return None
+        connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+    _count("hits")
+    return row[0]
+
+
+def put(payload, response_text):
+    now = time.time()
+    key = cache_key(payload)
+    size = len(response_text.encode())
+    with _connection() as connection:
+        replaced = connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        connection.execute(
+            "INSERT OR REPLACE INTO responses (key, response, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+            (key, response_text, size, now, now),
+        )
+        with _sizes_lock:
+            _sizes[CACHE_PATH] += size - (replaced[0] if replaced else 0)
+            full = _sizes[CACHE_PATH] > CACHE_MAX_BYTES
+        if full:
+            _evict(connection, now)
+
+
+def _evict(connection, now):
+    # Drop expired entries, then least-recently-used ones until the cache is down to EVICT_TO
+    # (expired entries are never served, so they can wait until the space is needed)
+    connection.execute("DELETE FROM responses WHERE created < ?", (now - CACHE_TTL,))
+    total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    if total > CACHE_MAX_BYTES:
+        for key, size in connection.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= CACHE_MAX_BYTES * EVICT_TO:
+                break
+    with _sizes_lock:
+        _sizes[CACHE_PATH] = total
+
+
+async def async_cached_text(payload, fetch, parse):
+    # Parse a cached response, or fetch, parse and then store a fresh one. SQLite is used from a worker
+    # thread (which sees `bypass` through the copied context) so the batch's other requests keep going.
+    response_text = await asyncio.to_thread(get, payload)
+    if response_text is not None:
+        return parse(response_text)
+    response_text = await fetch()
+    result = parse(response_text)
+    await asyncio.to_thread(put, payload, response_text)
+    return result
@@ -0,0 +1,347 @@
+import json
+import time
+
+import adaptive_concurrency
+import rate_limiter
+import reasoning
+import retry_policy
+import token_ledger
+
+# Shared transport used by every email bot.
+# OpenAI and Kluster (DeepSeek) go through the OpenAI SDK, Groq (LLaMA) through its REST endpoint.
+# Every call first takes its share of the per-key request/token budget from rate_limiter, and
+# transient failures are retried by retry_policy (the SDK's own retries are switched off).
+# Async (batch) calls additionally hold a slot of the key's adaptive concurrency controller.
+# The *_stream variants deliver the reply incrementally to an optional sink (see live_output): `restart()`
+# once the provider accepts an attempt, `write(text)` per chunk and `close()` when the attempt ends either
+# way; they return the text.
+# Once the sink reports `done` the rest of the reply is dropped, but the stream is still read up to the
+# provider's final usage chunk (for the ledger and the rate limiter); an exception from `write` cancels it.
+# Every request the provider accepts is recorded in token_ledger, counted before sending and reconciled with
+# `usage` (or flagged aborted, with the tokens streamed so far, when it is cut short).
+# The HTTP libraries and the OpenAI SDK are imported where they are first needed, so a bot only loads
+# what its own provider uses.
+
+GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
+
+REQUEST_TIMEOUT = 120  # seconds
+
+
+def groq_headers(api_key):
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+
+def _openai_limiter(client):
+    return rate_limiter.limiter_for(client.base_url, client.api_key)
+
+
+def _groq_limiter(headers, api_url):
+    return rate_limiter.limiter_for(api_url, headers["Authorization"])
+
+
+def openai_controller(client):
+    return adaptive_concurrency.controller_for(client.base_url, client.api_key)
+
+
+def groq_controller(headers, api_url=GROQ_API_URL):
+    return adaptive_concurrency.controller_for(api_url, headers["Authorization"])
+
+
+async def _controlled(controller, request):
+    # Run one request inside a concurrency slot and feed its outcome back to the controller
+    async with controller.slot():
+        started = time.monotonic()
+        try:
+            response = await request()
+        except Exception as e:
+            if retry_policy.error_details(e)[0] == 429:
+                controller.on_rate_limited()
+            raise
+        controller.on_success(time.monotonic() - started)
+        return response
+
+
+def _openai_usage(response):
+    usage = getattr(response, "usage", None)
+    return usage.model_dump() if usage is not None else {}
+
+
+def _openai_provider(client):
+    return token_ledger.provider_name(client.base_url)
+
+
+def _check_groq_response(response):
+    if response.status_code != 200:
+        raise retry_policy.ProviderHTTPError(response.status_code, response.headers, response.text[:200])
+    return response
+
+
+def _note_failure(limiter, error):
+    status_code, headers = retry_policy.error_details(error)
+    limiter.observe(headers)
+    if status_code == 429:
+        delay = retry_policy.server_delay(headers)
+        # A wait too long to retry through fails the call instead (see retry_policy), so don't hold everyone
+        if delay and delay <= retry_policy.MAX_SERVER_DELAY:
+            limiter.pause(delay)
+
+
+# Sync calls (single requests, e.g. the pandas code generation step)
+def openai_chat(client, payload, policy=retry_policy.DEFAULT_POLICY):
+    limiter = _openai_limiter(client)
+    client = client.with_options(max_retries=0)
+
+    def attempt():
+        reserved = limiter.acquire(limiter.estimate(payload))
+        entry = token_ledger.Entry(_openai_provider(client), payload)
+        try:
+            response = client.chat.completions.create(**payload)
+        except Exception as e:
+            _note_failure(limiter, e)
+            raise
+        usage = _openai_usage(response)
+        entry.record(usage)
+        limiter.settle(reserved, usage)
+        return response
+
+    return policy.call(attempt)
+
+
+def groq_chat(payload, headers, api_url=GROQ_API_URL, policy=retry_policy.DEFAULT_POLICY):
+    import requests
+
+    limiter = _groq_limiter(headers, api_url)
+
+    def attempt():
+        reserved = limiter.acquire(limiter.estimate(payload))
+        entry = token_ledger.Entry(token_ledger.provider_name(api_url), payload)
+        try:
+            response = _check_groq_response(
+                requests.post(api_url, json=payload, headers=headers, timeout=REQUEST_TIMEOUT)
+            )
+        except Exception as e:
+            _note_failure(limiter, e)
+            raise
+        limiter.observe(response.headers)
+        usage = response.json().get("usage") or {}
+        entry.record(usage)
+        limiter.settle(reserved, usage)
+        return response
+
+    return policy.call(attempt)
+
+
+# Async calls (batch email generation)
+def async_openai_client(client):
+    # Build an async twin of an existing sync client so both share the same key and base URL.
+    # Async clients are bound to the event loop they run on, so one is opened per batch.
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(api_key=client.api_key, base_url=client.base_url, max_retries=0)
+
+
+def async_groq_client():
+    import httpx
+
+    return httpx.AsyncClient(timeout=REQUEST_TIMEOUT)
+
+
+# Streamed calls.
+# Reasoning (<think> blocks or `reasoning_content` deltas) is counted and dropped as it arrives, so
+# only the answer is returned and shown; `reasoning_budget` cuts off a reply that keeps thinking past it.
+# A reader is created once the provider has accepted the request and always closed, so the ledger gets
+# every accepted call, including streams cut short (malformed, over the reasoning budget, dropped).
+class _StreamReader:
+    def __init__(self, payload, sink, reasoning_budget, entry):
+        self.payload = payload
+        self.entry = entry  # created before sending, so the ledger times the whole call
+        self.sink = sink
+        self.think = reasoning.ThinkFilter(reasoning_budget)
+        self.parts = []
+        self.usage = None
+        self.started = time.monotonic()
+        self.first_answer = None
+        self.finished = False
+        if sink is not None:
+            sink.restart()
+
+    @property
+    def done(self):
+        return self.sink is not None and self.sink.done
+
+    @property
+    def complete(self):
+        # The reply is done and its usage has arrived, so nothing more is needed from the stream
+        return self.done and self.usage is not None
+
+    def reasoning_text(self, text):
+        if text:
+            self.think.add_reasoning(text)
+
+    def content(self, text):
+        if text:
+            self._answer(self.think.feed(text))
+
+    def _answer(self, text):
+        if not text or self.done:
+            return
+        if self.first_answer is None:
+            self.first_answer = time.monotonic() - self.started
+        self.parts.append(text)
+        if self.sink is not None:
+            self.sink.write(text)
+
+    def finish(self):
+        # The stream ended normally -> (answer text, usage)
+        self._answer(self.think.flush())
+        self.finished = True
+        return "".join(self.parts), self.usage or {}
+
+    def close(self):
+        # Called once the stream ends either way
+        if self.sink is not None:
+            self.sink.close()
+        usage = self.usage or {}
+        details = usage.get("completion_tokens_details") or {}
+        reasoning_tokens = details.get("reasoning_tokens") or self.think.reasoning_tokens
+        if not self.finished:
+            # A stream cut short carries no usage; the ledger gets the tokens that arrived so far
+            streamed = reasoning_tokens + self.think.answer_tokens
+            usage = dict(usage, completion_tokens=usage.get("completion_tokens") or streamed)
+            self.entry.record(usage, reasoning_tokens, aborted=True)
+            return
+        answer_tokens = (
+            usage["completion_tokens"] - reasoning_tokens if usage.get("completion_tokens") else self.think.answer_tokens
+        )
+        reasoning.record(
+            self.payload.get("model"), reasoning_tokens, answer_tokens, time.monotonic() - self.started, self.first_answer
+        )
+        self.entry.record(usage, reasoning_tokens)
+
+
+def _openai_stream_payload(payload):
+    return dict(payload, stream=True, stream_options={"include_usage": True})
+
+
+def _read_openai_chunk(reader, chunk):
+    if chunk.usage is not None:
+        reader.usage = chunk.usage.model_dump()
+    if chunk.choices:
+        delta = chunk.choices[0].delta
+        reader.reasoning_text(getattr(delta, "reasoning_content", None))
+        reader.content(delta.content)
+
+
+def openai_stream_text(client, payload, policy=retry_policy.DEFAULT_POLICY, reasoning_budget=None):
+    # Sync, sink-less stream: the answer text without any reasoning (e.g. the code generation step)
+    limiter = _openai_limiter(client)
+    client = client.with_options(max_retries=0)
+    payload = _openai_stream_payload(payload)
+
+    def attempt():
+        reserved = limiter.acquire(limiter.estimate(payload))
+        entry = token_ledger.Entry(_openai_provider(client), payload)
+        try:
+            with client.chat.completions.create(**payload) as stream:
+                limiter.observe(stream.response.headers)
+                reader = _StreamReader(payload, None, reasoning_budget, entry)
+                try:
+                    for chunk in stream:
+                        _read_openai_chunk(reader, chunk)
+                    text, usage = reader.finish()
+                finally:
+                    reader.close()
+        except Exception as e:
+            _note_failure(limiter, e)
+            raise
+        limiter.settle(reserved, usage)
+        return text
+
+    return policy.call(attempt)
+
+
+async def async_openai_stream(async_client, payload, sink, policy=retry_policy.DEFAULT_POLICY, reasoning_budget=None):
+    limiter = _openai_limiter(async_client)
+    controller = openai_controller(async_client)
+    payload = _openai_stream_payload(payload)
+
+    async def request():
+        entry = token_ledger.Entry(_openai_provider(async_client), payload)
+        stream = await async_client.chat.completions.create(**payload)
+        limiter.observe(stream.response.headers)
+        reader = _StreamReader(payload, sink, reasoning_budget, entry)
+        try:
+            async for chunk in stream:
+                _read_openai_chunk(reader, chunk)
+                if reader.complete:
+                    break
+            return reader.finish()
+        finally:
+            reader.close()
+            await stream.close()  # closing the connection stops generation on the provider's side
+
+    async def attempt():
+        reserved = await limiter.async_acquire(limiter.estimate(payload))
+        try:
+            text, usage = await _controlled(controller, request)
+        except Exception as e:
+            _note_failure(limiter, e)
+            raise
+        limiter.settle(reserved, usage)
+        return text
+
+    return await policy.acall(attempt)
+
+
+async def _async_groq_stream(session, payload, headers, api_url, sink, limiter):
+    entry = token_ledger.Entry(token_ledger.provider_name(api_url), payload)
+    async with session.stream("POST", api_url, json=payload, headers=headers) as response:
+        if response.status_code != 200:
+            await response.aread()
+            _check_groq_response(response)
+        limiter.observe(response.headers)
+        reader = _StreamReader(payload, sink, None, entry)
+        try:
+            # Server-sent events: "data: {chunk}" lines, ending with "data: [DONE]"
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                # Groq reports usage on the last chunk under x_groq
+                usage = chunk.get("usage") or (chunk.get("x_groq") or {}).get("usage")
+                if usage:
+                    reader.usage = usage
+                for choice in chunk.get("choices", []):
+                    reader.content((choice.get("delta") or {}).get("content"))
+                if reader.complete:
+                    break
+            return reader.finish()
+        finally:
+            reader.close()
+
+
+async def async_groq_stream(session, payload, headers, sink, api_url=GROQ_API_URL, policy=retry_policy.DEFAULT_POLICY):
+    limiter = _groq_limiter(headers, api_url)
+    controller = groq_controller(headers, api_url)
+    payload = dict(payload, stream=True)
+
+    async def attempt():
+        reserved = await limiter.async_acquire(limiter.estimate(payload))
+        try:
+            text, usage = await _controlled(
+                controller,
+                lambda: _async_groq_stream(session, payload, headers, api_url, sink, limiter),
+            )
+        except Exception as e:
+            _note_failure(limiter, e)
+            raise
+        limiter.settle(reserved, usage)
+        return text
+
+    return await policy.acall(attempt)
@@ -0,0 +1,81 @@
+import threading
+
+import pandas as pd
+
+import rate_limiter
+
+# Compact merchant details for email prompts.
+# The prompts used to interpolate the whole row as a Python dict: every column, `nan` values, map and
+# menu PDF URLs, the data source and the typed helper columns added by merchant_store. Only the fields
+# an email can use are kept here, empty values are dropped, long text is cut to a per-field token
+# budget, and the result is a "label: value" line per field.
+# Token counts use the same rough chars-per-token estimate as rate_limiter.
+
+# (column, label, token budget)
+PROMPT_FIELDS = [
+    ("merchant_name", "name", 20),
+    ("merchant_email", "email", 20),
+    ("merchant_category", "category", 10),
+    ("Cuisine_Type", "cuisine", 20),
+    ("merchant_address", "address", 25),
+    ("google_review_score", "google rating", 5),
+    ("google_review_count", "google reviews", 5),
+    ("Cost_per_two", "cost for two", 10),
+    ("Operating_Hours", "hours", 25),
+    ("merchant_website", "website", 10),
+    ("merchant_social_media", "social", 10),
+    ("Recent_review", "recent review", 50),
+]
+
+stats = {"merchants": 0, "tokens_before": 0, "tokens_after": 0}
+_stats_lock = threading.Lock()
+
+
+def summary():
+    with _stats_lock:
+        if not stats["merchants"]:
+            return "Merchant details: nothing sent yet"
+        before = stats["tokens_before"] / stats["merchants"]
+        after = stats["tokens_after"] / stats["merchants"]
+    return f"Merchant details: ~{before:.0f} → ~{after:.0f} tokens per merchant ({100 * (1 - after / before):.0f}% less)"
+
+
+def _tokens(text):
+    return len(text) // rate_limiter.CHARS_PER_TOKEN
+
+
+def _is_empty(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return True
+    return not str(value).strip() or str(value).strip().lower() in ("nan", "none", "n/a")
+
+
+def shorten(text, budget):
+    # Cut at a word boundary to about `budget` tokens
+    limit = budget * rate_limiter.CHARS_PER_TOKEN
+    text = " ".join(text.split())
+    if len(text) <= limit:
+        return text
+    return text[:limit].rsplit(" ", 1)[0].rstrip(",.;:") + "…"
+
+
+def compact(merchant_details):
+    # The "label: value" lines without counting them (email_journal fingerprints merchants with this)
+    lines = []
+    for column, label, budget in PROMPT_FIELDS:
+        value = merchant_details.get(column)
+        if not _is_empty(value):
+            lines.append(f"{label}: {shorten(str(value), budget)}")
+    return "\n".join(lines)
+
+
+def serialize(merchant_details):
+    # Strings (e.g. multi_merchant's placeholder) pass through unchanged
+    if isinstance(merchant_details, str):
+        return merchant_details
+    text = compact(merchant_details)
+    with _stats_lock:
+        stats["merchants"] += 1
+        stats["tokens_before"] += _tokens(str(merchant_details))
+        stats["tokens_after"] += _tokens(text)
+    return text
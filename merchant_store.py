@@ -0,0 +1,249 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+import pandas as pd
+import pyarrow as pa
+
+# Load-time normalization of the merchant CSVs.
+# The raw files store review counts as "2000+"/"~2984", costs as "S$160-240"/"AED 600–700",
+# postal codes as ints that lose leading zeros and phone numbers with a "tel:" prefix. This adds
+# typed columns next to the originals so queries and prompts can filter and sort vectorized:
+#   review_count_min        lower bound of google_review_count (nullable int)
+#   cost_min / cost_max     Cost_per_two range in local currency, cost_currency its ISO code
+#   operating_intervals     JSON list of [weekday (0=Mon), open minute, close minute]
+#   weekly_open_hours, latest_close_minute   derived from the intervals (close may exceed 1440)
+# The normalized frame is cached as a memory-mappable Arrow IPC file, validated against the source
+# CSV's mtime/size (falling back to a content hash), and shared in-process through shared_merchants().
+
+CACHE_DIR = ".cache"
+NORMALIZER_VERSION = 2  # bump when normalize() changes so stale caches are rebuilt
+
+CATEGORY_COLUMNS = ["merchant_category", "Cuisine_Type", "city", "nearest_city", "country_code", "cost_currency"]
+POSTAL_CODE_DIGITS = {"SG": 6}
+
+CURRENCIES = {"s$": "SGD", "sgd": "SGD", "aed": "AED", "us$": "USD", "usd": "USD", "$": "USD"}
+
+# Told to the code-generation LLM alongside the column list
+COLUMN_NOTES = (
+    "Typed helper columns (prefer these for filtering and sorting): review_count_min (int lower bound of "
+    "google_review_count), cost_min/cost_max (float Cost_per_two range in cost_currency), weekly_open_hours "
+    "(float), latest_close_minute (int minutes after midnight, >1440 means after midnight), operating_intervals "
+    "(JSON [weekday 0=Mon, open minute, close minute] list). merchant_postal_code is a zero-padded string."
+)
+
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+_RANGE = r"\s*(?:-|\bto\b)\s*"  # "Mon-Fri", "10:00 AM to 9:30 PM"
+_WEEKDAY = r"(mon|tue|wed|thu|fri|sat|sun)[a-z]*"
+_DAYS = re.compile(rf"\b(daily|everyday|every day|{_WEEKDAY}(?:{_RANGE}{_WEEKDAY})?)\b")
+_TIME_RANGE = re.compile(
+    rf"(\d{{1,2}})(?:[:.](\d{{2}}))?\s*(am|pm)?{_RANGE}(?:(\d{{1,2}})(?:[:.](\d{{2}}))?\s*(am|pm)?|(midnight|noon))"
+)
+
+
+def review_count_min(values):
+    counts = values.astype("string").str.replace(",", "", regex=False).str.extract(r"(\d+)")[0]
+    return pd.to_numeric(counts, errors="coerce").astype("Int64")
+
+
+def parse_cost(value):
+    # "S$160-240" -> ("SGD", 160, 240); "AED 900+" -> ("AED", 900, nan); per-person prices are doubled
+    if not isinstance(value, str):
+        return None, float("nan"), float("nan")
+    text = value.lower()
+    # Longest symbol first, so "us$" isn't read as "s$"
+    symbols = sorted(CURRENCIES, key=len, reverse=True)
+    currency = next((CURRENCIES[symbol] for symbol in symbols if symbol in text), None)
+    numbers = [float(number) for number in re.findall(r"\d+(?:\.\d+)?", text.replace(",", ""))]
+    if not numbers:
+        return currency, float("nan"), float("nan")
+    factor = 2 if "per person" in text else 1
+    low = numbers[0] * factor
+    high = numbers[1] * factor if len(numbers) > 1 else float("nan")
+    return currency, low, high
+
+
+def _minutes(hour, minute, suffix):
+    hour, minute = int(hour), int(minute or 0)
+    if suffix == "pm" and hour != 12:
+        hour += 12
+    elif suffix == "am" and hour == 12:
+        hour = 0
+    return hour * 60 + minute
+
+
+def _day_span(match):
+    if match.group(1) in ("daily", "everyday", "every day"):
+        return list(range(7))
+    start = WEEKDAYS.index(match.group(2))
+    end = WEEKDAYS.index(match.group(3)) if match.group(3) else start
+    return [(start + offset) % 7 for offset in range((end - start) % 7 + 1)]
+
+
+def parse_operating_hours(value):
+    # "Mon-Fri 12:00pm-2:30pm & 3:00pm-10:30pm, Sat-Sun ..." -> [[weekday, open, close], ...]; ranges may
+    # also be written with "to" ("Daily from 10:00 AM to 9:30 PM")
+    if not isinstance(value, str):
+        return []
+    text = value.lower().replace("–", "-").replace("—", "-")
+    if "24 hours" in text or "24/7" in text:
+        return [[day, 0, 1440] for day in range(7)]
+    intervals = []
+    days = list(range(7))  # times without a day spec apply every day
+    for segment in re.split(r"[,;]", text):
+        day_match = _DAYS.search(segment)
+        if day_match:
+            days = _day_span(day_match)
+        for match in _TIME_RANGE.finditer(segment):
+            open_hour, open_minute, open_suffix, close_hour, close_minute, close_suffix, word = match.groups()
+            if not (open_minute or close_minute or open_suffix or close_suffix or word):
+                continue  # a bare "15-20" is a price or a count, not opening hours
+            if word:
+                close = 0 if word == "midnight" else 720
+            else:
+                close = _minutes(close_hour, close_minute, close_suffix)
+            # "3:00-10:30pm": the opening time shares the closing suffix unless that would invert it
+            if open_suffix is None and close_suffix is not None:
+                open_suffix = close_suffix if _minutes(open_hour, open_minute, close_suffix) <= close else "am"
+            opening = _minutes(open_hour, open_minute, open_suffix)
+            if close <= opening:
+                close += 1440  # closes after midnight
+            intervals.extend([day, opening, close] for day in days)
+    return intervals
+
+
+def _postal_code(code, country):
+    if pd.isna(code):
+        return pd.NA
+    code = str(code).split(".")[0].strip()
+    digits = POSTAL_CODE_DIGITS.get(country)
+    return code.zfill(digits) if digits and code.isdigit() else code
+
+
+def normalize(df):
+    df = df.loc[:, [column for column in df.columns if not str(column).startswith("Unnamed")]].copy()
+
+    if "merchant_phone_number" in df.columns:
+        df["merchant_phone_number"] = df["merchant_phone_number"].astype("string").str.replace(
+            r"^\s*tel:\s*", "", regex=True
+        )
+    if "merchant_postal_code" in df.columns:
+        countries = df["country_code"] if "country_code" in df.columns else pd.Series(None, index=df.index)
+        df["merchant_postal_code"] = pd.Series(
+            [_postal_code(code, country) for code, country in zip(df["merchant_postal_code"], countries)],
+            index=df.index,
+            dtype="string",
+        )
+    if "google_review_count" in df.columns:
+        df["review_count_min"] = review_count_min(df["google_review_count"])
+    if "Cost_per_two" in df.columns:
+        costs = [parse_cost(value) for value in df["Cost_per_two"]]
+        df["cost_currency"] = [currency for currency, _, _ in costs]
+        df["cost_min"] = pd.Series([low for _, low, _ in costs], index=df.index, dtype="float64")
+        df["cost_max"] = pd.Series([high for _, _, high in costs], index=df.index, dtype="float64")
+    if "Operating_Hours" in df.columns:
+        intervals = [parse_operating_hours(value) for value in df["Operating_Hours"]]
+        df["operating_intervals"] = [json.dumps(value) if value else None for value in intervals]
+        df["weekly_open_hours"] = pd.Series(
+            [sum(close - opening for _, opening, close in value) / 60 if value else float("nan") for value in intervals],
+            index=df.index,
+        )
+        df["latest_close_minute"] = pd.Series(
+            [max(close for _, _, close in value) if value else pd.NA for value in intervals],
+            index=df.index,
+            dtype="Int64",
+        )
+
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype("category")
+    return df
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cache_path(csv_path):
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(CACHE_DIR, f"{stem}.arrow")
+
+
+def _cached_source(cache_path):
+    # Metadata the cache was built from, or None if there is no usable cache file
+    try:
+        with pa.memory_map(cache_path, "r") as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return None
+    return {key.decode(): value.decode() for key, value in metadata.items() if key.startswith(b"source_")}
+
+
+def _read_cache(cache_path):
+    # Memory-mapped read: fixed-width columns come straight from the page cache
+    with pa.memory_map(cache_path, "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def _write_cache(df, cache_path, source):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata.update({f"source_{key}".encode(): str(value).encode() for key, value in source.items()})
+    table = table.replace_schema_metadata(metadata)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # Write then rename so concurrent Streamlit processes never read a half-written file
+    temporary_path = f"{cache_path}.{os.getpid()}.tmp"
+    with pa.OSFile(temporary_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(temporary_path, cache_path)
+
+
+def load_merchants(csv_path):
+    # Raises FileNotFoundError like pd.read_csv when the CSV is missing
+    stat = os.stat(csv_path)
+    source = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "version": NORMALIZER_VERSION}
+    cache_path = _cache_path(csv_path)
+    cached = _cached_source(cache_path)
+
+    if cached and cached.get("source_version") == str(NORMALIZER_VERSION):
+        if cached.get("source_mtime_ns") == str(stat.st_mtime_ns) and cached.get("source_size") == str(stat.st_size):
+            return _read_cache(cache_path)
+        # Touched but unchanged (e.g. a fresh checkout): confirm by content hash before reusing
+        source["sha256"] = _file_sha256(csv_path)
+        if cached.get("source_sha256") == source["sha256"]:
+            df = _read_cache(cache_path)
+            _write_cache(df, cache_path, source)  # record the new mtime so the next start skips hashing
+            return df
+
+    source.setdefault("sha256", _file_sha256(csv_path))
+    df = normalize(pd.read_csv(csv_path))
+    _write_cache(df, cache_path, source)
+    return df
+
+
+# One frame per CSV for the whole process, shared by every bot module and session
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_merchants(csv_path):
+    path = os.path.abspath(csv_path)
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _shared_lock:
+        if path not in _shared or _shared[path][0] != signature:
+            _shared[path] = (signature, load_merchants(path))
+        return _shared[path][1]
+
+
+def source_path(df):
+    # The CSV a shared frame was loaded from (matched by identity), or None for any other frame
+    with _shared_lock:
+        return next((path for path, (_, frame) in _shared.items() if frame is df), None)
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import threading
+
+import llm_cache
+import merchant_prompt
+import structured_output
+
+# Multi-merchant prompts: several merchants share one copy of the instruction block.
+# The agent's usual single-merchant prompt is built once with a placeholder where the merchant details
+# go, the merchants are listed at the end, and the model answers with {"emails": [...]} holding one
+# structured email per merchant (see structured_output), which the agent's own parser then reads.
+# A group whose response can't be used is split in half and retried; a single merchant goes through
+# the regular one-merchant request, so every merchant still ends up with the same kind of email.
+
+DEFAULT_GROUP_SIZE = 1  # each merchant alone unless grouping is chosen (it changes how emails come out)
+MAX_COMPLETION_TOKENS = 16000  # ceiling for the scaled-up token cap of a group request
+TOKEN_CAP_FIELDS = ("max_tokens", "max_completion_tokens")
+
+MERCHANT_SLOT = "<<MERCHANT_DETAILS>>"
+SLOT_REPLACEMENT = "(listed separately for each merchant under MERCHANTS at the end)"
+
+stats = {"group_requests": 0, "grouped_emails": 0, "splits": 0, "single_requests": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        stats[name] += amount
+
+
+def summary():
+    with _stats_lock:
+        return (
+            f"Grouped prompts: {stats['grouped_emails']} emails from {stats['group_requests']} requests, "
+            f"{stats['splits']} splits, {stats['single_requests']} single-merchant requests"
+        )
+
+
+def _group_instructions(group):
+    merchants = "\n\n".join(
+        f"Merchant {number}:\n{merchant_prompt.serialize(details)}" for number, details in enumerate(group, 1)
+    )
+    return f"""
+
+        ----------------------------------------------------
+        MULTIPLE MERCHANTS
+        ----------------------------------------------------
+        Write {len(group)} separate emails, one for each merchant listed under MERCHANTS below.
+        Apply every instruction above to each merchant on its own, as if it were the only merchant, and never mix details between merchants.
+        Return ONLY a JSON object whose "emails" array has exactly {len(group)} entries, in the same order as the merchants:
+        {{"emails": [{{"merchant": 1, "to": "...", "subject": "...", "body": "..."}}, ...]}}
+        Each entry holds the email for that merchant with the fields described above. Do not write anything before or after the JSON.
+
+        MERCHANTS:
+        {merchants}
+        """
+
+
+def _group_title(group):
+    return " · ".join(str(merchant.get("merchant_name", "Merchant")) for merchant in group)
+
+
+def group_payload(agent, group, sender):
+    payload = agent.build_payload(MERCHANT_SLOT, *sender)
+    messages = [dict(message) for message in payload["messages"]]
+    prompt = messages[-1]["content"]
+    if MERCHANT_SLOT not in prompt:
+        raise ValueError("The agent's prompt has no merchant details to group.")
+    messages[-1]["content"] = prompt.replace(MERCHANT_SLOT, SLOT_REPLACEMENT) + _group_instructions(group)
+
+    payload = structured_output.for_group(dict(payload, messages=messages))
+    for field in TOKEN_CAP_FIELDS:
+        if field in payload:
+            payload[field] = min(MAX_COMPLETION_TOKENS, payload[field] * len(group))
+    return payload
+
+
+def parse_group(response_text, size):
+    # -> list of `size` reply texts, one per merchant; raises on anything else so a bad response is never cached
+    value = structured_output.extract_json(response_text)
+    entries = value.get("emails") if isinstance(value, dict) else value
+    if not isinstance(entries, list) or len(entries) != size:
+        raise ValueError(f"Expected {size} emails in the grouped response.")
+    if not all(isinstance(entry, dict) for entry in entries):
+        raise ValueError("Grouped response has an entry that is not an object.")
+    if all(isinstance(entry.get("merchant"), int) for entry in entries):
+        entries = sorted(entries, key=lambda entry: entry["merchant"])
+    # Plain-text emails ("email") are passed on as is, structured ones as their JSON
+    return [entry["email"] if isinstance(entry.get("email"), str) else json.dumps(entry) for entry in entries]
+
+
+async def agenerate_group(agent, session, group, sender):
+    # -> one (value, error) pair per merchant in `group`, in order; never raises
+    if len(group) == 1:
+        _count("single_requests")
+        try:
+            return [(await agent.agenerate_email(session, group[0], *sender), None)]
+        except Exception as e:
+            return [(None, e)]
+
+    results = [None] * len(group)
+    try:
+        payload = group_payload(agent, group, sender)
+        _count("group_requests")
+        emails = await llm_cache.async_cached_text(
+            payload,
+            lambda: agent.acomplete(session, payload, _group_title(group)),
+            lambda text: parse_group(text, len(group)),
+        )
+    except Exception:
+        emails = [None] * len(group)  # the whole response is unusable
+
+    for position, (merchant_details, email) in enumerate(zip(group, emails)):
+        if email is None:
+            continue
+        try:
+            results[position] = (agent.parse_email(email, merchant_details, *sender), None)
+            _count("grouped_emails")
+        except Exception:
+            pass
+
+    failed = [position for position, result in enumerate(results) if result is None]
+    if not failed:
+        return results
+    # Retry what failed in smaller groups; a group that failed entirely is halved
+    if len(failed) == len(group):
+        middle = len(group) // 2
+        retries = [failed[:middle], failed[middle:]]
+    else:
+        retries = [failed]
+    _count("splits")
+    retried = await asyncio.gather(
+        *(agenerate_group(agent, session, [group[position] for position in positions], sender) for positions in retries)
+    )
+    for positions, pairs in zip(retries, retried):
+        for position, pair in zip(positions, pairs):
+            results[position] = pair
+    return results
@@ -0,0 +1,66 @@
+import os
+import threading
+
+import llm_client
+import merchant_store
+import query_engine
+
+# Process-wide registry of provider clients and the merchant dataset, shared by every bot module.
+# Nothing is created when a bot module is imported: a client is built the first time a bot's main()
+# (or batch_cli) asks for it and is then kept for the life of the process, so switching between the
+# variants in app.py reuses the same clients and the same merchant frame.
+# Credentials come from EMAILBOT_<SECTION>_<KEY> environment variables when set (e.g.
+# EMAILBOT_OPENAI_API_KEY, for cron jobs), otherwise from st.secrets.
+# The OpenAI SDK is only imported by the bots that use it (OpenAI and DeepSeek; LLaMA talks REST).
+
+MERCHANTS_CSV = "merchants_sg_emails.csv"
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def secret(section, key):
+    value = os.environ.get(f"EMAILBOT_{section}_{key}".upper())
+    if value is not None:
+        return value
+    import streamlit as st  # reads .streamlit/secrets.toml, with or without a running app
+
+    return st.secrets[section][key]
+
+
+def _shared(name, create):
+    with _clients_lock:
+        if name not in _clients:
+            _clients[name] = create()
+        return _clients[name]
+
+
+def openai_client():
+    def create():
+        from openai import OpenAI
+
+        return OpenAI(api_key=secret("openai", "api_key"))
+
+    return _shared("openai", create)
+
+
+def kluster_client():
+    # DeepSeek through Kluster's OpenAI-compatible endpoint
+    def create():
+        from openai import OpenAI
+
+        return OpenAI(api_key=secret("kluster", "api_key"), base_url=secret("kluster", "base_url"))
+
+    return _shared("kluster", create)
+
+
+def groq_headers():
+    return _shared("groq", lambda: llm_client.groq_headers(secret("groq", "api_key")))
+
+
+def merchants():
+    # Not in the registry: merchant_store already keeps one frame per process and reloads it when the CSV
+    # changes. Raises FileNotFoundError when the CSV is missing.
+    df = merchant_store.shared_merchants(MERCHANTS_CSV)
+    query_engine.prewarm(df)  # start the sandbox workers for generated query code
+    return df
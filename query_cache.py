@@ -0,0 +1,96 @@
+import contextlib
+import hashlib
+import os
+import re
+import sqlite3
+import time
+
+# Persistent cache of natural-language query -> generated pandas code.
+# Keys combine the normalized query text with a fingerprint of the dataset schema, so a change to
+# the columns or their types never replays code written for a different frame. Only code that ran
+# successfully and produced merchants is stored; it is shared by every session and bot module.
+# The same database holds query_templates' parameterized code, keyed by query shape instead of text.
+
+CACHE_PATH = os.environ.get("EMAILBOT_QUERY_CACHE", ".cache/query_code.sqlite")
+
+
+def normalize_query(query):
+    # Case, whitespace and trailing punctuation don't change what the user asked for
+    return re.sub(r"\s+", " ", query).strip().lower().rstrip("?.! ")
+
+
+def schema_fingerprint(df):
+    schema = ",".join(f"{column}:{dtype}" for column, dtype in df.dtypes.items())
+    return hashlib.sha256(schema.encode()).hexdigest()[:16]
+
+
+def cache_key(query, df):
+    return hashlib.sha256(f"{schema_fingerprint(df)}|{normalize_query(query)}".encode()).hexdigest()
+
+
+def template_key(shape, df):
+    return hashlib.sha256(f"{schema_fingerprint(df)}|shape:{shape}".encode()).hexdigest()
+
+
+@contextlib.contextmanager
+def _connection():
+    os.makedirs(os.path.dirname(CACHE_PATH) or ".", exist_ok=True)
+    connection = sqlite3.connect(CACHE_PATH, timeout=10)
+    try:
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS query_code ("
+                "key TEXT PRIMARY KEY, query TEXT, code TEXT, created REAL, hits INTEGER DEFAULT 0)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS query_templates ("
+                "key TEXT PRIMARY KEY, shape TEXT, code TEXT, literals TEXT, created REAL, hits INTEGER DEFAULT 0)"
+            )
+            yield connection
+    finally:
+        connection.close()
+
+
+def get(query, df):
+    key = cache_key(query, df)
+    with _connection() as connection:
+        row = connection.execute("SELECT code FROM query_code WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            connection.execute("UPDATE query_code SET hits = hits + 1 WHERE key = ?", (key,))
+    return row[0] if row else None
+
+
+def put(query, df, code):
+    with _connection() as connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO query_code (key, query, code, created) VALUES (?, ?, ?, ?)",
+            (cache_key(query, df), normalize_query(query), code, time.time()),
+        )
+
+
+def discard(query, df):
+    with _connection() as connection:
+        connection.execute("DELETE FROM query_code WHERE key = ?", (cache_key(query, df),))
+
+
+def get_template(shape, df):
+    # -> (code, literals JSON) or None
+    key = template_key(shape, df)
+    with _connection() as connection:
+        row = connection.execute("SELECT code, literals FROM query_templates WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            connection.execute("UPDATE query_templates SET hits = hits + 1 WHERE key = ?", (key,))
+    return tuple(row) if row else None
+
+
+def put_template(shape, df, code, literals):
+    with _connection() as connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO query_templates (key, shape, code, literals, created) VALUES (?, ?, ?, ?, ?)",
+            (template_key(shape, df), shape, code, literals, time.time()),
+        )
+
+
+def discard_template(shape, df):
+    with _connection() as connection:
+        connection.execute("DELETE FROM query_templates WHERE key = ?", (template_key(shape, df),))
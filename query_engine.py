@@ -0,0 +1,103 @@
+import threading
+
+import pandas as pd
+
+try:
+    import streamlit as st
+except ImportError:  # the bot modules import this; headless runs (batch_cli) never query
+    st = None
+
+import query_cache
+import query_planner
+import query_sandbox
+import query_templates
+
+# The "which merchants?" step shared by every bot module: turn a natural-language query into
+# pandas code (via the module's LLM) and run it against the merchant frame.
+# Recognizable queries are answered by the local planner, repeated ones from the code cache, queries
+# shaped like an earlier one from its code template, and only the rest reach the LLM. Each answer
+# reports which path produced it.
+
+PATH_LABELS = {
+    "planner": "local query planner",
+    "cache": "cached generated code",
+    "template": "generated code reused with new parameters",
+    "llm": "LLM code generation",
+}
+
+path_counts = {path: 0 for path in PATH_LABELS}
+_counts_lock = threading.Lock()
+
+
+def execute_code(python_code, df):
+    # Generated code displays its result with Streamlit and leaves it in `output_data`.
+    # It runs in a sandbox worker process (see query_sandbox); its display calls are replayed here.
+    output_data, calls = query_sandbox.run(python_code, df)
+    for name, args, kwargs in calls:
+        getattr(st, name)(*args, **kwargs)
+    return output_data
+
+
+def prewarm(df):
+    # Called by the bot modules at import so the sandbox workers are up before the first query
+    query_sandbox.prewarm(df)
+
+
+def _is_valid_result(output_data):
+    return isinstance(output_data, pd.DataFrame) and not output_data.empty
+
+
+def _report(query, path):
+    with _counts_lock:
+        path_counts[path] += 1
+        offline = path_counts["planner"] + path_counts["cache"] + path_counts["template"]
+        share = 100 * offline / sum(path_counts.values())
+    print(f"Query '{query}' answered by {path}")
+    st.caption(
+        f"Answered by {PATH_LABELS[path]} · {share:.0f}% of queries so far answered without an LLM call"
+    )
+
+
+def _answer(query, df, generate_code):
+    plan = query_planner.plan_query(query, df)
+    if plan is not None:
+        output_data = query_planner.apply_plan(plan, df)
+        st.write(f"Matched: {plan.description}")
+        st.dataframe(output_data)
+        return output_data, "planner"
+
+    python_code = query_cache.get(query, df)
+    if python_code is not None:
+        try:
+            output_data = execute_code(python_code, df)
+            if _is_valid_result(output_data):
+                return output_data, "cache"
+        except Exception as e:
+            print(f"Cached code for '{query}' failed, regenerating: {e}")
+        query_cache.discard(query, df)
+
+    python_code = query_templates.instantiate(query, df)
+    if python_code is not None:
+        try:
+            output_data = execute_code(python_code, df)
+            if _is_valid_result(output_data):
+                query_cache.put(query, df, python_code)
+                return output_data, "template"
+        except Exception as e:
+            print(f"Template code for '{query}' failed, regenerating: {e}")
+            query_templates.discard(query, df)
+        # An empty result keeps the template: these literals may just match no merchants this way
+
+    python_code = generate_code()
+    output_data = execute_code(python_code, df)
+    if _is_valid_result(output_data):
+        query_cache.put(query, df, python_code)
+        query_templates.learn(query, df, python_code)
+    return output_data, "llm"
+
+
+def run_query(query, df, generate_code):
+    # `generate_code()` asks the module's LLM for code; it is only called when nothing local can answer
+    output_data, path = _answer(query, df, generate_code)
+    _report(query, path)
+    return output_data
@@ -0,0 +1,199 @@
+import re
+from collections import namedtuple
+
+import pandas as pd
+
+# Deterministic fast path for common merchant queries.
+# Recognizes filters by category/cuisine, location and rating/review thresholds, sorting by rating or
+# review count, and top-N, and answers them with vectorized DataFrame operations. A query containing
+# any word the planner can't account for returns None so it falls back to LLM code generation.
+
+DEFAULT_TOP_N = 10
+
+# Each filter is (kind, value); `sort_by` is a column name or None
+Plan = namedtuple("Plan", ["filters", "sort_by", "limit", "description"])
+
+LOCATION_COLUMNS = ["city", "nearest_city", "merchant_street", "merchant_address"]
+CATEGORY_COLUMNS = ["merchant_category", "Cuisine_Type"]
+
+# Words that carry no filtering meaning in these queries
+FILLER_WORDS = {
+    "a", "all", "an", "and", "any", "are", "based", "best", "can", "find", "for", "get", "give", "good",
+    "great", "i", "is", "list", "me", "merchant", "merchants", "of", "on", "ones", "outlets", "place",
+    "places", "please", "popular", "seeking", "show", "some", "that", "the", "their", "them", "these",
+    "those", "to", "top", "want", "what", "which", "who", "with", "you", "my", "looking", "businesses",
+    "business", "stores", "store", "spots", "shops", "shop", "f&b",
+}
+
+_NUMBER = r"(\d+(?:\.\d+)?)"
+_ABOVE = r"(?:above|over|greater than|more than|higher than|at least|>=|>|min(?:imum)?(?: of)?)"
+_BELOW = r"(?:below|under|less than|lower than|at most|<=|<|max(?:imum)?(?: of)?)"
+
+_TOP_N = re.compile(r"\b(?:top|best|first)\s+(\d+)\b|\b(\d+)\s+(?:top|best)\b")
+_RATING = re.compile(
+    rf"\b(?:with\s+)?(?:a\s+)?(?:google\s+)?(?:rating|rated|score|stars?)\s+(?:of\s+)?({_ABOVE}|{_BELOW})\s*{_NUMBER}(?:\s*stars?)?"
+)
+_REVIEWS = re.compile(rf"\b(?:with\s+)?({_ABOVE}|{_BELOW})\s*{_NUMBER}\s*(?:google\s+)?reviews?\b")
+_SORT_REVIEWS = re.compile(
+    r"\b(?:most\s+reviewed|most\s+reviews|most\s+popular|(?:sorted|ordered|sort|order|ranked)?\s*by\s+(?:the\s+)?(?:number\s+of\s+|review\s+)?(?:reviews?|review count|popularity))\b"
+)
+_SORT_RATING = re.compile(
+    r"\b(?:highest[\s-]+rated|best[\s-]+rated|top[\s-]+rated|(?:sorted|ordered|sort|order|ranked)?\s*by\s+(?:google\s+)?(?:rating|score|stars))\b"
+)
+_LOCATION = re.compile(
+    r"\b(?:in|at|near|around|located in|based in)\s+([a-z0-9][a-z0-9 '&.-]*?)"
+    r"(?=\s+(?:with|that|which|having|sorted|ordered|by|rated|and|above|over|under|below)\b|$)"
+)
+
+
+def review_counts(df):
+    # "2000+", "~2984", "1,200" -> lower-bound number of reviews (already parsed by merchant_store)
+    if "review_count_min" in df.columns:
+        return df["review_count_min"].astype("float64")
+    counts = df["google_review_count"].astype(str).str.replace(",", "", regex=False).str.extract(r"(\d+)")[0]
+    return pd.to_numeric(counts, errors="coerce")
+
+
+def _singular(word):
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("ches", "shes", "sses")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def _category_vocabulary(df):
+    words = set()
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns:
+            for value in df[column].dropna().astype(str).unique():
+                words.update(re.findall(r"[a-z]+", value.lower()))
+    return words
+
+
+def _contains_any(df, columns, text):
+    mask = pd.Series(False, index=df.index)
+    for column in columns:
+        if column in df.columns:
+            mask |= df[column].astype(str).str.contains(text, case=False, regex=False, na=False)
+    return mask
+
+
+def _word_in_any(df, columns, word):
+    pattern = rf"\b{re.escape(word)}"
+    mask = pd.Series(False, index=df.index)
+    for column in columns:
+        if column in df.columns:
+            mask |= df[column].astype(str).str.contains(pattern, case=False, regex=True, na=False)
+    return mask
+
+
+def _comparison(phrase):
+    # "at least"/"minimum" include the bound, "above"/"over" don't
+    if re.fullmatch(_ABOVE, phrase):
+        return ">=" if re.match(r"at least|>=|min", phrase) else ">"
+    return "<=" if re.match(r"at most|<=|max", phrase) else "<"
+
+
+_COMPARE = {
+    ">": lambda values, bound: values > bound,
+    ">=": lambda values, bound: values >= bound,
+    "<": lambda values, bound: values < bound,
+    "<=": lambda values, bound: values <= bound,
+}
+
+
+def plan_query(query, df):
+    text = re.sub(r"\s+", " ", query.lower()).strip().rstrip("?.! ")
+    if df.empty or not text:
+        return None
+    filters, sort_by, limit = [], None, None
+
+    def consume(pattern, handler):
+        nonlocal text
+        for match in list(pattern.finditer(text)):
+            handler(match)
+        text = pattern.sub(" ", text)
+
+    def on_top_n(match):
+        nonlocal limit
+        limit = int(match.group(1) or match.group(2))
+
+    def on_rating(match):
+        filters.append((f"rating {_comparison(match.group(1))}", float(match.group(2))))
+
+    def on_reviews(match):
+        filters.append((f"reviews {_comparison(match.group(1))}", float(match.group(2))))
+
+    def on_sort(column):
+        def handler(match):
+            nonlocal sort_by
+            sort_by = column
+        return handler
+
+    consume(_TOP_N, on_top_n)
+    consume(_RATING, on_rating)
+    consume(_REVIEWS, on_reviews)
+    consume(_SORT_REVIEWS, on_sort("google_review_count"))
+    consume(_SORT_RATING, on_sort("google_review_score"))
+
+    for match in list(_LOCATION.finditer(text)):
+        place = match.group(1).strip()
+        if not _contains_any(df, LOCATION_COLUMNS, place).any():
+            return None  # not a place we know; let the LLM interpret it
+        filters.append(("location", place))
+    text = _LOCATION.sub(" ", text)
+
+    vocabulary = _category_vocabulary(df)
+    for word in re.findall(r"[a-z&]+|\d+", text):
+        if word in FILLER_WORDS:
+            continue
+        if word in vocabulary or _singular(word) in vocabulary:
+            filters.append(("category", word if word in vocabulary else _singular(word)))
+            continue
+        return None  # unrecognized intent
+
+    if re.search(r"\b(?:top|best)\b", query.lower()) and limit is None:
+        limit = DEFAULT_TOP_N
+    if limit is not None and sort_by is None:
+        sort_by = "google_review_score"
+    if not filters and sort_by is None:
+        return None
+
+    description = ", ".join(
+        f"{kind} {value}" if kind.startswith(("rating", "reviews")) else f"{kind}={value}" for kind, value in filters
+    ) or "all merchants"
+    if sort_by:
+        description += f"; sorted by {sort_by}"
+    if limit:
+        description += f"; top {limit}"
+    return Plan(filters, sort_by, limit, description)
+
+
+def apply_plan(plan, df):
+    mask = pd.Series(True, index=df.index)
+    counts = review_counts(df)
+    for kind, value in plan.filters:
+        if kind == "location":
+            mask &= _contains_any(df, LOCATION_COLUMNS, value)
+        elif kind == "category":
+            mask &= _word_in_any(df, CATEGORY_COLUMNS, value)
+        elif kind.startswith("rating "):
+            mask &= _COMPARE[kind.split()[1]](df["google_review_score"], value)
+        elif kind.startswith("reviews "):
+            mask &= _COMPARE[kind.split()[1]](counts, value)
+    result = df[mask]
+
+    if plan.sort_by == "google_review_count":
+        order = counts[mask].sort_values(ascending=False, na_position="last").index
+        result = result.loc[order]
+    elif plan.sort_by == "google_review_score":
+        # Ties on rating go to the merchant with more reviews
+        ranked = pd.DataFrame({"score": result["google_review_score"], "count": counts[mask]})
+        order = ranked.sort_values(["score", "count"], ascending=False, na_position="last").index
+        result = result.loc[order]
+    if plan.limit:
+        result = result.head(plan.limit)
+    return result
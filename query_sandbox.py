@@ -0,0 +1,247 @@
+import io
+import multiprocessing
+import os
+import pickle
+import queue
+import re
+import threading
+import time
+
+import pandas as pd
+import pyarrow as pa
+
+import code_guard
+import merchant_store
+
+# Sandboxed execution of LLM-generated pandas code.
+# Generated code used to be exec'd in the Streamlit server thread, where a looping snippet froze the
+# session and a memory-hungry one could take the whole server down. It now runs in a pool of worker
+# processes that are started ahead of time with pandas and the merchant frames already loaded:
+#   - every run has a wall-clock deadline; a worker that misses it is killed and replaced, and the
+#     caller gets SandboxTimeout instead of waiting (also when no worker frees up before the deadline)
+#   - every worker caps its address space at what it uses once warmed up plus MEMORY_HEADROOM, so a
+#     runaway allocation fails with MemoryError inside the worker rather than in the server
+#   - the code sees `df`, `pd`, `px` and a recording `st`; its Streamlit calls are sent back with
+#     the result and replayed on the page by the caller (only DISPLAY_CALLS are kept). plotly is only
+#     imported (once per worker) when the code refers to `px` or `plotly`
+#   - a DataFrame `output_data` comes back as Arrow IPC bytes, anything else pickled
+#   - workers inherit the server's environment, so they drop its credentials (CREDENTIAL_VARIABLES, e.g.
+#     EMAILBOT_OPENAI_API_KEY, OPENAI_API_KEY) before anything else runs
+# Frames loaded through merchant_store.shared_merchants() are referenced by their CSV path and read by
+# each worker from the memory-mapped Arrow cache; any other frame travels with the request as Arrow IPC.
+# Each Streamlit session takes its own worker, so concurrent queries run on separate cores.
+# Code is checked (and rewritten where needed) by code_guard before it is sent to a worker.
+
+POOL_SIZE = min(4, os.cpu_count() or 1)
+EXEC_TIMEOUT = 20  # seconds per run, including the wait for a free worker
+MEMORY_HEADROOM = 1 << 30  # bytes of address space a run may add on top of a warmed-up worker
+
+CREDENTIAL_VARIABLES = re.compile(r"^EMAILBOT_|API_KEY|SECRET|TOKEN|PASSWORD", re.IGNORECASE)
+
+DISPLAY_CALLS = {
+    "write", "dataframe", "table", "markdown", "text", "caption", "header", "subheader", "title",
+    "json", "metric", "info", "success", "warning", "error", "plotly_chart", "bar_chart", "line_chart",
+}
+
+
+_USES_PLOTLY = re.compile(r"\b(px|plotly)\b")
+
+
+class SandboxError(Exception):
+    pass
+
+
+class SandboxTimeout(SandboxError):
+    pass
+
+
+# Worker side
+class _RecordingStreamlit:
+    # Stands in for `st` in the generated code; display calls are recorded for the caller to replay
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        def record(*args, **kwargs):
+            if name in DISPLAY_CALLS:
+                try:
+                    self.calls.append(pickle.dumps((name, args, kwargs)))
+                except Exception:
+                    self.calls.append(pickle.dumps((name, tuple(str(arg) for arg in args), {})))
+        return record
+
+
+def _frame_bytes(frame):
+    table = pa.Table.from_pandas(frame)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def _read_frame(data):
+    return pa.ipc.open_stream(data).read_all().to_pandas()
+
+
+def _encode_output(output_data):
+    if isinstance(output_data, pd.DataFrame):
+        try:
+            return "arrow", _frame_bytes(output_data)
+        except (pa.ArrowException, TypeError, ValueError):
+            pass  # mixed-type object columns; pickle keeps them as they are
+    return "pickle", pickle.dumps(output_data)
+
+
+def _decode_output(kind, data):
+    return _read_frame(data) if kind == "arrow" else pickle.loads(data)
+
+
+def _address_space():
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _limit_memory():
+    # Linux only; elsewhere the worker runs without a cap
+    try:
+        import resource
+        limit = _address_space() + MEMORY_HEADROOM
+    except (ImportError, OSError, ValueError):
+        return
+    resource.setrlimit(resource.RLIMIT_AS, (limit, resource.getrlimit(resource.RLIMIT_AS)[1]))
+
+
+def _worker_frame(dataset):
+    kind, value = dataset
+    return merchant_store.shared_merchants(value) if kind == "path" else _read_frame(value)
+
+
+def _run(code, dataset):
+    recorder = _RecordingStreamlit()
+    try:
+        # A copy, so code that modifies `df` doesn't leak into the next run on this worker
+        exec_globals = {"df": _worker_frame(dataset).copy(), "pd": pd, "st": recorder}
+        if _USES_PLOTLY.search(code):
+            import plotly
+            import plotly.express as px
+            exec_globals.update(px=px, plotly=plotly)
+        exec(code_guard.compiled(code), exec_globals)
+        kind, data = _encode_output(exec_globals.get("output_data", pd.DataFrame()))
+    except BaseException as e:
+        return "error", f"{type(e).__name__}: {e}", recorder.calls
+    return kind, data, recorder.calls
+
+
+def _drop_credentials():
+    for name in [name for name in os.environ if CREDENTIAL_VARIABLES.search(name)]:
+        del os.environ[name]
+
+
+def _worker_main(conn, preload_paths):
+    _drop_credentials()
+    # Warm up before reporting ready: the merchant frames the app has already loaded
+    for path in preload_paths:
+        try:
+            merchant_store.shared_merchants(path)
+        except OSError:
+            pass
+    _limit_memory()
+    conn.send("ready")
+    while True:
+        try:
+            code, dataset = conn.recv()
+        except (EOFError, OSError):
+            return
+        conn.send(_run(code, dataset))
+
+
+# Pool side
+class _Worker:
+    def __init__(self, context, preload_paths):
+        self.conn, child_conn = context.Pipe()
+        # Spawned rather than forked: the Streamlit server is multi-threaded
+        self.process = context.Process(target=_worker_main, args=(child_conn, preload_paths), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+
+    def wait(self, deadline):
+        # True once a message is waiting, False if the deadline passes first
+        return self.conn.poll(max(0.0, deadline - time.monotonic()))
+
+    def kill(self):
+        self.process.kill()
+        self.conn.close()
+
+
+class SandboxPool:
+    def __init__(self, size=POOL_SIZE, preload_paths=()):
+        self.context = multiprocessing.get_context("spawn")
+        self.preload_paths = list(preload_paths)
+        self.idle = queue.Queue()
+        for _ in range(size):
+            self.idle.put(_Worker(self.context, self.preload_paths))
+
+    def _replace(self, worker):
+        worker.kill()
+        self.idle.put(_Worker(self.context, self.preload_paths))
+
+    def run(self, code, dataset, timeout=EXEC_TIMEOUT):
+        # -> (kind, data, calls); raises SandboxTimeout past the deadline, SandboxError if a worker dies
+        deadline = time.monotonic() + timeout
+        try:
+            worker = self.idle.get(timeout=timeout)
+        except queue.Empty:
+            raise SandboxTimeout(f"No sandbox worker became free within {timeout}s")
+        try:
+            if not worker.ready:
+                if not worker.wait(deadline):
+                    raise SandboxTimeout(f"The sandbox worker did not start within {timeout}s")
+                worker.conn.recv()
+                worker.ready = True
+            worker.conn.send((code, dataset))
+            if not worker.wait(deadline):
+                raise SandboxTimeout(f"Generated code ran longer than {timeout}s and was stopped")
+            result = worker.conn.recv()
+        except SandboxTimeout:
+            self._replace(worker)
+            raise
+        except (EOFError, OSError) as e:
+            # Killed by the OS (e.g. out of memory) or otherwise gone
+            self._replace(worker)
+            raise SandboxError(f"The sandbox worker exited while running generated code ({e or 'no reply'})")
+        self.idle.put(worker)
+        return result
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool(preload_paths=()):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SandboxPool(preload_paths=preload_paths)
+        return _pool
+
+
+def _dataset(df):
+    path = merchant_store.source_path(df)
+    return ("path", path) if path is not None else ("frame", _frame_bytes(df))
+
+
+def prewarm(df):
+    # Start the workers now, with this frame loaded, so the first query doesn't pay for the start-up
+    path = merchant_store.source_path(df)
+    pool([path] if path is not None else [])
+
+
+def run(code, df, timeout=EXEC_TIMEOUT):
+    # -> (output_data, calls) where calls are (name, args, kwargs) Streamlit display calls to replay
+    code = code_guard.validate(code)  # raises code_guard.UnsafeCode before any worker is involved
+    kind, data, calls = pool().run(code, _dataset(df), timeout)
+    calls = [pickle.loads(call) for call in calls]
+    if kind == "error":
+        raise SandboxError(data)
+    return _decode_output(kind, data), calls
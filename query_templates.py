@@ -0,0 +1,138 @@
+import ast
+import json
+import re
+
+import code_guard
+import query_cache
+import query_planner
+
+# Parameterized reuse of generated query code.
+# "Top 5 cafes in Singapore" and "top 10 bakeries in Singapore" have the same shape,
+# "top <number> <category> in <city>", and differ only in their literals. Once code generated for one
+# of them has run successfully, it is stored as a template for that shape together with the literals it
+# was written for; a later query of the same shape gets a copy of the code with its own literals
+# substituted, and only structurally new queries reach the LLM.
+# Literals are numbers, city names (city / nearest_city values) and category words (from
+# merchant_category / Cuisine_Type). A template is only stored when every literal of the query appears
+# in the code as a constant, and no two literals are equal, so substitution can't be ambiguous.
+
+CITY_COLUMNS = ["city", "nearest_city"]
+MAX_CATEGORY_WORDS = 3  # longer Cuisine_Type values are free-text descriptions, not categories
+
+_NUMBER = r"\d+(?:\.\d+)?"
+
+
+def _cities(df):
+    names = set()
+    for column in CITY_COLUMNS:
+        if column in df.columns:
+            names.update(str(value).strip().lower() for value in df[column].dropna().unique())
+    return sorted((name for name in names if name), key=len, reverse=True)
+
+
+def _category_words(df):
+    words = set()
+    for column in query_planner.CATEGORY_COLUMNS:
+        if column in df.columns:
+            for value in df[column].dropna().astype(str).unique():
+                value_words = re.findall(r"[a-z]+", re.sub(r"\(.*?\)", "", value.lower()))
+                if len(value_words) <= MAX_CATEGORY_WORDS:
+                    words.update(value_words)
+    return words - query_planner.FILLER_WORDS
+
+
+def parameters(query, df):
+    # -> (shape, [[kind, value, word], ...]); `word` is the literal as written, `value` its normalized form
+    vocabulary = _category_words(df)
+    cities = "|".join(re.escape(city) for city in _cities(df))
+    pattern = (rf"\b(?P<city>{cities})\b|" if cities else "") + rf"\b(?P<number>{_NUMBER})\b|(?P<word>[a-z]+)"
+    literals = []
+
+    def replace(match):
+        if match.lastgroup == "city":
+            literals.append(["city", match.group(), match.group()])
+        elif match.lastgroup == "number":
+            literals.append(["number", match.group(), match.group()])
+        elif query_planner._singular(match.group()) in vocabulary:
+            literals.append(["category", query_planner._singular(match.group()), match.group()])
+        else:
+            return match.group()
+        return f"<{literals[-1][0]}>"
+
+    shape = re.sub(pattern, replace, query_cache.normalize_query(query))
+    return shape, literals
+
+
+def _matches(node, literal):
+    # Whether a constant in the code is this literal
+    kind, value, _ = literal
+    if kind == "number":
+        return isinstance(node.value, (int, float)) and not isinstance(node.value, bool) and node.value == float(value)
+    if not isinstance(node.value, str):
+        return False
+    text = node.value.strip().lower()
+    return query_planner._singular(text) == value if kind == "category" else text == value
+
+
+def _styled(original, text):
+    # Keep the constant's capitalization
+    if original.isupper():
+        return text.upper()
+    if original[:1].isupper():
+        return text.title()
+    return text
+
+
+def _replacement(node, old, new):
+    kind = old[0]
+    if kind == "number":
+        number = float(new[1])
+        return int(number) if isinstance(node.value, int) and number.is_integer() else number
+    # A plural constant ('cafes') takes the new literal as written ('bakeries')
+    plural = kind == "category" and node.value.strip().lower() != old[1]
+    return _styled(node.value.strip(), new[2] if plural else new[1])
+
+
+class _Substitute(ast.NodeTransformer):
+    def __init__(self, old_literals, new_literals):
+        self.pairs = list(zip(old_literals, new_literals))
+
+    def visit_Constant(self, node):
+        for old, new in self.pairs:
+            if _matches(node, old):
+                return ast.copy_location(ast.Constant(_replacement(node, old, new)), node)
+        return node
+
+
+def learn(query, df, code):
+    # Store successfully run code as a template for its query's shape, if it can be parameterized
+    shape, literals = parameters(query, df)
+    if not literals or len({(kind, value) for kind, value, _ in literals}) < len(literals):
+        return False
+    try:
+        # Stored as validated, so the dataset file name of a rewritten read_csv isn't taken for a literal
+        code = code_guard.validate(code)
+    except (SyntaxError, ValueError):
+        return False
+    constants = [node for node in ast.walk(ast.parse(code)) if isinstance(node, ast.Constant)]
+    if not all(any(_matches(node, literal) for node in constants) for literal in literals):
+        return False
+    query_cache.put_template(shape, df, code, json.dumps(literals))
+    return True
+
+
+def instantiate(query, df):
+    # -> code for this query from a stored template of the same shape, or None
+    shape, literals = parameters(query, df)
+    if not literals:
+        return None
+    template = query_cache.get_template(shape, df)
+    if template is None:
+        return None
+    code, stored = template
+    tree = _Substitute(json.loads(stored), literals).visit(ast.parse(code))
+    return ast.unparse(ast.fix_missing_locations(tree))
+
+
+def discard(query, df):
+    query_cache.discard_template(parameters(query, df)[0], df)
@@ -0,0 +1,171 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+
+import token_ledger
+
+# Process-wide request/token rate limiting for the LLM providers.
+# Limiters live at module level, so every Streamlit session and every bot module that talks to the
+# same endpoint with the same API key draws from one shared budget.
+# The budgets are the key's real quota: EMAILBOT_<PROVIDER>_RPM / EMAILBOT_<PROVIDER>_TPM when set
+# (e.g. EMAILBOT_GROQ_TPM), otherwise the x-ratelimit-limit-* headers of the provider's responses, which
+# replace the starting guesses below as soon as the first response arrives.
+# Each request reserves its prompt estimate plus the completion the key's recent replies actually used
+# (within the payload's cap), and settle() squares the reservation with the reported usage.
+
+# Starting per-minute budgets (requests, tokens), matched against the endpoint URL
+PROVIDER_LIMITS = {
+    "groq.com": (30, 6000),
+    "openai.com": (500, 30000),
+}
+DEFAULT_LIMITS = (60, 100000)  # Kluster and anything else
+# Groq's x-ratelimit-limit-requests is a daily limit, so only its token limit is read from the headers
+DAILY_REQUEST_LIMIT_HOSTS = ("groq.com",)
+
+DEFAULT_COMPLETION_TOKENS = 1024  # used when a payload does not cap its output
+EXPECTED_COMPLETION_TOKENS = 512  # reserved for a reply until the key's own replies say otherwise
+COMPLETION_SMOOTHING = 0.2  # weight of the newest reply in the running completion average
+CHARS_PER_TOKEN = 4  # rough average for English prompts
+
+
+class TokenBucket:
+    def __init__(self, capacity, period=60.0):
+        self.period = period
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period  # units refilled per second
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def resize(self, capacity):
+        # A new budget per period; what is left of the current one changes by the same amount
+        capacity = float(capacity)
+        self.level = min(capacity, self.level + capacity - self.capacity)
+        self.capacity, self.rate = capacity, capacity / self.period
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        # Seconds until `amount` units are available (0 if they already are)
+        missing = amount - self.level
+        return 0.0 if missing <= 0 else missing / self.rate
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute, tokens_per_minute, header_limits=("requests", "tokens")):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.header_limits = header_limits  # the x-ratelimit-limit-* kinds that are per-minute budgets to follow
+        self.expected_completion = None  # running average of the completion tokens replies used
+        self.paused_until = 0.0  # set when the provider tells us to back off
+        self._lock = threading.Lock()
+
+    def observe(self, headers):
+        # Follow the limits the provider reports for this key
+        buckets = {"requests": self.requests, "tokens": self.tokens}
+        for kind in self.header_limits:
+            try:
+                limit = float((headers or {}).get(f"x-ratelimit-limit-{kind}"))
+            except (TypeError, ValueError):
+                continue
+            if limit > 0 and limit != buckets[kind].capacity:
+                with self._lock:
+                    buckets[kind].refill(time.monotonic())
+                    buckets[kind].resize(limit)
+
+    def estimate(self, payload):
+        # Tokens to reserve for a request: its prompt plus the completion replies have been using
+        with self._lock:
+            expected = self.expected_completion or EXPECTED_COMPLETION_TOKENS
+        return prompt_tokens(payload) + min(completion_cap(payload), round(expected))
+
+    def _try_acquire(self, tokens):
+        # Take one request and `tokens` tokens if both budgets allow it, otherwise report the wait
+        tokens = min(tokens, self.tokens.capacity)  # an oversized request must still go through eventually
+        with self._lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens), self.paused_until - now)
+            if wait == 0:
+                self.requests.level -= 1
+                self.tokens.level -= tokens
+            return tokens, wait
+
+    def acquire(self, tokens):
+        while True:
+            reserved, wait = self._try_acquire(tokens)
+            if wait == 0:
+                return reserved
+            time.sleep(wait)
+
+    async def async_acquire(self, tokens):
+        while True:
+            reserved, wait = self._try_acquire(tokens)
+            if wait == 0:
+                return reserved
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        # Hold every caller sharing this key, not just the one that got rate limited
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def settle(self, reserved, usage):
+        # Give back (or charge) the difference between the estimate and the provider-reported usage
+        used, completion = usage.get("total_tokens"), usage.get("completion_tokens")
+        with self._lock:
+            if completion is not None:
+                previous = self.expected_completion
+                self.expected_completion = completion if previous is None else (
+                    previous + COMPLETION_SMOOTHING * (completion - previous)
+                )
+            if used is None:
+                return
+            self.tokens.refill(time.monotonic())
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + reserved - used)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _new_limiter(api_url):
+    requests_per_minute, tokens_per_minute = next(
+        (limits for host, limits in PROVIDER_LIMITS.items() if host in api_url), DEFAULT_LIMITS
+    )
+    header_limits = ["tokens"] if any(host in api_url for host in DAILY_REQUEST_LIMIT_HOSTS) else ["requests", "tokens"]
+    # Limits set in the environment are used as given; the headers don't override them
+    provider = token_ledger.provider_name(api_url).upper()
+    configured = {}
+    for kind, suffix in (("requests", "RPM"), ("tokens", "TPM")):
+        value = os.environ.get(f"EMAILBOT_{provider}_{suffix}")
+        if value:
+            configured[kind] = float(value)
+    return RateLimiter(
+        configured.get("requests", requests_per_minute),
+        configured.get("tokens", tokens_per_minute),
+        tuple(kind for kind in header_limits if kind not in configured),
+    )
+
+
+def limiter_for(api_url, api_key):
+    # The key is hashed so the registry never holds raw credentials
+    key = (str(api_url), hashlib.sha256(str(api_key).encode()).hexdigest())
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = _new_limiter(key[0])
+        return _limiters[key]
+
+
+def completion_cap(payload):
+    return payload.get("max_completion_tokens") or payload.get("max_tokens") or DEFAULT_COMPLETION_TOKENS
+
+
+def prompt_tokens(payload):
+    # Rough pre-flight estimate of the prompt
+    prompt_chars = sum(len(str(message.get("content", ""))) for message in payload.get("messages", []))
+    return prompt_chars // CHARS_PER_TOKEN
@@ -0,0 +1,147 @@
+import contextvars
+import threading
+from collections import deque
+
+import rate_limiter
+
+# Reasoning control for the DeepSeek (Kluster) bots.
+# DeepSeek-R1 spends much of its token budget and latency on a <think> section before answering.
+# Tasks that don't need it (pandas code generation, the short email variant) are routed to the
+# non-reasoning DeepSeek-V3, and R1 emails get a reasoning budget: a reply still thinking past it is
+# cut off and answered by V3 instead. Streamed replies drop the reasoning as it arrives (ThinkFilter)
+# and every call logs its reasoning vs answer tokens.
+
+REASONING_MODEL = "deepseek-ai/DeepSeek-R1"
+FAST_MODEL = "deepseek-ai/DeepSeek-V3-0324"
+
+REASONING_BUDGET = 800  # tokens of <think> allowed before an R1 reply falls back to FAST_MODEL
+
+# "auto": route by task and cap R1's reasoning; "off": never reason; "full": always R1, uncapped
+MODES = {
+    "auto": "Auto (reason only for full emails, capped)",
+    "off": "Off (DeepSeek-V3 everywhere)",
+    "full": "Full (DeepSeek-R1 everywhere)",
+}
+AUTO_ROUTES = {"code": FAST_MODEL, "short_email": FAST_MODEL, "email": REASONING_MODEL}
+
+# Set per Streamlit run from the sidebar; batch tasks inherit it
+current_mode = contextvars.ContextVar("reasoning_mode", default="auto")
+
+LOG_SIZE = 200
+calls = deque(maxlen=LOG_SIZE)
+_calls_lock = threading.Lock()
+
+
+class ReasoningOverBudget(Exception):
+    # Not retryable as is; callers answer with the non-reasoning model instead
+    pass
+
+
+def model_for(task):
+    mode = current_mode.get()
+    if mode == "off":
+        return FAST_MODEL
+    if mode == "full":
+        return REASONING_MODEL
+    return AUTO_ROUTES[task]
+
+
+def budget_for(payload):
+    if payload.get("model") == REASONING_MODEL and current_mode.get() == "auto":
+        return REASONING_BUDGET
+    return None
+
+
+def without_reasoning(payload):
+    return dict(payload, model=FAST_MODEL)
+
+
+class ThinkFilter:
+    # Splits streamed content into reasoning (inside <think>...</think>, counted and dropped) and answer.
+    # Only a few characters are held back, in case a tag is split across chunks.
+    OPEN, CLOSE = "<think>", "</think>"
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.reasoning_chars = 0
+        self.answer_chars = 0
+        self.in_think = False
+        self.held = ""
+
+    def add_reasoning(self, text):
+        # Reasoning delivered separately (`reasoning_content` deltas)
+        self.reasoning_chars += len(text)
+        self._check_budget()
+
+    def feed(self, text):
+        text = self.held + text
+        self.held = ""
+        answer = []
+        while text:
+            tag = self.CLOSE if self.in_think else self.OPEN
+            position = text.find(tag)
+            if position == -1:
+                # Hold back a possible partial tag at the end
+                keep = next((size for size in range(len(tag) - 1, 0, -1) if text.endswith(tag[:size])), 0)
+                text, self.held = text[:len(text) - keep], text[len(text) - keep:]
+                position, tag = len(text), ""
+            if self.in_think:
+                self.reasoning_chars += position
+            else:
+                answer.append(text[:position])
+            text = text[position + len(tag):]
+            if tag:
+                self.in_think = not self.in_think
+        self._check_budget()
+        answer = "".join(answer)
+        self.answer_chars += len(answer)
+        return answer
+
+    def flush(self):
+        # Text held back at the end of the stream was not a tag after all
+        held, self.held = self.held, ""
+        if self.in_think:
+            self.reasoning_chars += len(held)
+            return ""
+        self.answer_chars += len(held)
+        return held
+
+    @property
+    def reasoning_tokens(self):
+        return self.reasoning_chars // rate_limiter.CHARS_PER_TOKEN
+
+    @property
+    def answer_tokens(self):
+        return self.answer_chars // rate_limiter.CHARS_PER_TOKEN
+
+    def _check_budget(self):
+        if self.budget is not None and self.reasoning_tokens > self.budget:
+            raise ReasoningOverBudget(f"Reasoning passed its budget of {self.budget} tokens")
+
+
+def record(model, reasoning_tokens, answer_tokens, seconds, first_answer_seconds):
+    entry = {
+        "model": model,
+        "reasoning_tokens": reasoning_tokens,
+        "answer_tokens": answer_tokens,
+        "seconds": round(seconds, 2),
+        "first_answer_seconds": None if first_answer_seconds is None else round(first_answer_seconds, 2),
+    }
+    with _calls_lock:
+        calls.append(entry)
+    print(
+        f"{model}: {reasoning_tokens} reasoning / {answer_tokens} answer tokens, {seconds:.1f}s"
+        + (f" (answer after {first_answer_seconds:.1f}s)" if first_answer_seconds is not None else "")
+    )
+
+
+def summary():
+    with _calls_lock:
+        logged = list(calls)
+    if not logged:
+        return "Reasoning: no calls yet"
+    reasoning_tokens = sum(entry["reasoning_tokens"] for entry in logged)
+    answer_tokens = sum(entry["answer_tokens"] for entry in logged)
+    waits = [entry["first_answer_seconds"] for entry in logged if entry["first_answer_seconds"] is not None]
+    wait = f", {sum(waits) / len(waits):.1f}s to first answer token" if waits else ""
+    return f"Reasoning: {reasoning_tokens} reasoning / {answer_tokens} answer tokens over {len(logged)} calls{wait}"
@@ -0,0 +1,189 @@
+import asyncio
+import contextvars
+import math
+import random
+import re
+import sys
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+# Retry handling for provider calls.
+# Only transient failures (429, 5xx, timeouts, dropped connections) are retried, and the wait comes
+# from the server's Retry-After / x-ratelimit-reset-* headers whenever it sends them. Streamed replies
+# aborted as malformed (see stream_parser) are retried immediately.
+# Server-directed waits are honoured in full up to MAX_SERVER_DELAY; a longer one (e.g. a spent daily
+# quota) fails the call at once instead of stalling the batch. Only our own backoff is capped by max_delay.
+# A RetryBudget caps the retries across a whole batch beyond each request's first retry, so one wave of
+# 429s that every request rides out once doesn't use it up.
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+MAX_SERVER_DELAY = 300.0  # seconds
+
+# Exception class names per library. They are looked up in sys.modules rather than imported, so this
+# module doesn't load the provider SDKs: an error can only come from a library that is already loaded.
+RETRYABLE_EXCEPTIONS = {
+    "openai": ("APITimeoutError", "APIConnectionError"),
+    "requests": ("Timeout", "ConnectionError"),
+    "httpx": ("TimeoutException", "TransportError"),
+}
+
+
+def _loaded_classes(module_name, class_names):
+    module = sys.modules.get(module_name)
+    return tuple(getattr(module, name) for name in class_names) if module is not None else ()
+
+
+class ProviderHTTPError(Exception):
+    # Raised by the raw REST transports (Groq) for any non-200 response
+    def __init__(self, status_code, headers, message=""):
+        super().__init__(f"API request failed with status code {status_code}{': ' + message if message else ''}")
+        self.status_code = status_code
+        self.headers = headers
+
+
+class RetryBudgetExceeded(Exception):
+    pass
+
+
+class MalformedResponse(Exception):
+    # Raised when a streamed reply is cut off because it can no longer match the expected format.
+    # Retried straight away: the provider is fine, only that sample was bad.
+    pass
+
+
+class RetryBudget:
+    def __init__(self, max_retries):
+        self.max_retries = max_retries
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def spend(self):
+        with self._lock:
+            if self.used >= self.max_retries:
+                return False
+            self.used += 1
+            return True
+
+
+def budget_for_batch(batch_size, ratio=0.2, minimum=5):
+    # Retries beyond each request's first one (see RetryPolicy._next_delay)
+    return RetryBudget(max(minimum, math.ceil(batch_size * ratio)))
+
+
+# Budget of the batch currently running in this context (set by batch_engine, inherited by its tasks)
+current_budget = contextvars.ContextVar("retry_budget", default=None)
+
+
+def error_details(error):
+    # (status_code, headers) for an HTTP error, (None, {}) otherwise
+    if isinstance(error, ProviderHTTPError):
+        return error.status_code, error.headers
+    if isinstance(error, _loaded_classes("openai", ("APIStatusError",))):
+        return error.status_code, error.response.headers
+    return None, {}
+
+
+def is_retryable(error):
+    if isinstance(error, MalformedResponse):
+        return True
+    status_code, _ = error_details(error)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS
+    return any(isinstance(error, _loaded_classes(module, names)) for module, names in RETRYABLE_EXCEPTIONS.items())
+
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+def parse_duration(value):
+    # Seconds from "12", "1.5", "250ms", "7.66s", "2m59.56s" or an HTTP date; None if unreadable
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if parts and "".join(number + unit for number, unit in parts) == value:
+        scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+        return sum(float(number) * scale[unit] for number, unit in parts)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def server_delay(headers):
+    # How long the provider asked us to wait, if it said so
+    if not headers:
+        return None
+    if headers.get("retry-after-ms") is not None:
+        delay = parse_duration(headers.get("retry-after-ms"))
+        if delay is not None:
+            return delay / 1000
+    delay = parse_duration(headers.get("retry-after"))
+    if delay is not None:
+        return delay
+    # Groq/OpenAI report when each exhausted budget refills
+    resets = [
+        parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+        for kind in ("requests", "tokens")
+        if headers.get(f"x-ratelimit-remaining-{kind}") == "0"
+    ]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+class RetryPolicy:
+    def __init__(self, max_retries=3, base_delay=1.0, max_delay=60.0, max_server_delay=MAX_SERVER_DELAY):
+        self.max_retries = max_retries  # retries after the first attempt
+        self.base_delay = base_delay
+        self.max_delay = max_delay  # cap on our own backoff
+        self.max_server_delay = max_server_delay  # a longer server-directed wait fails the call instead
+
+    def delay_for(self, error, retries):
+        # The wait the server asked for, as given, or our own backoff with jitter
+        if isinstance(error, MalformedResponse):
+            return 0.0
+        _, headers = error_details(error)
+        delay = server_delay(headers)
+        if delay is not None:
+            return delay
+        return min(self.base_delay * 2 ** (retries - 1) + random.uniform(0, self.base_delay), self.max_delay)
+
+    def _next_delay(self, error, retries):
+        # Wait before the next attempt, or re-raise if this error should not be retried
+        if not is_retryable(error) or retries > self.max_retries:
+            raise error
+        delay = self.delay_for(error, retries)
+        if delay > self.max_server_delay:
+            print(f"Not retrying: the server asked to wait {delay:.0f} seconds after: {error}")
+            raise error
+        budget = current_budget.get()
+        if retries > 1 and budget is not None and not budget.spend():
+            raise RetryBudgetExceeded(f"Batch retry budget exhausted: {error}") from error
+        print(f"Retrying ({retries}/{self.max_retries}) in {delay:.2f} seconds after: {error}")
+        return delay
+
+    def call(self, attempt):
+        retries = 0
+        while True:
+            try:
+                return attempt()
+            except Exception as e:
+                retries += 1
+                time.sleep(self._next_delay(e, retries))
+
+    async def acall(self, attempt):
+        retries = 0
+        while True:
+            try:
+                return await attempt()
+            except Exception as e:
+                retries += 1
+                await asyncio.sleep(self._next_delay(e, retries))
+
+
+DEFAULT_POLICY = RetryPolicy()
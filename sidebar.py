@@ -0,0 +1,37 @@
+import batch_engine
+import llm_cache
+import merchant_prompt
+import multi_merchant
+import stream_parser
+import structured_output
+import token_ledger
+
+# Sidebar settings and summaries of the "Generate Emails" section, the same for every bot.
+
+
+def summaries():
+    return [
+        llm_cache.summary(), multi_merchant.summary(), structured_output.summary(), stream_parser.summary(),
+        merchant_prompt.summary(), token_ledger.summary(),
+    ]
+
+
+def generation_settings(controller, extra_summaries=()):
+    # -> (concurrency, group_size); also applies the cache bypass to this script run
+    import streamlit as st  # only the app has a sidebar; batch_cli passes its settings on the command line
+
+    # Number of merchants whose emails are generated at the same time
+    concurrency = st.sidebar.number_input(
+        "Max concurrent requests", min_value=1, max_value=64, value=batch_engine.DEFAULT_CONCURRENCY
+    )
+    # Merchants packed into one request to share the instruction block (1 sends each merchant alone)
+    group_size = st.sidebar.number_input(
+        "Merchants per request", min_value=1, max_value=20, value=multi_merchant.DEFAULT_GROUP_SIZE
+    )
+    # Concurrency the adaptive controller currently allows for this provider (AIMD on 429s/latency)
+    st.sidebar.metric("Adaptive concurrency", controller.current_limit)
+
+    # Identical prompts are answered from the on-disk response cache unless bypassed
+    llm_cache.bypass.set(st.sidebar.checkbox("Bypass LLM cache", value=False))
+    st.sidebar.caption("  \n".join(summaries() + list(extra_summaries)))
+    return concurrency, group_size
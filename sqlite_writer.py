@@ -0,0 +1,49 @@
+import atexit
+import queue
+import sqlite3
+import threading
+
+# Append-only SQLite writes (token_ledger, email_journal) handed off to one background thread.
+# Rows are recorded from inside a batch's event loop, where a write (connect, insert, commit) would hold up
+# every request in flight; here the caller only queues the row. The thread writes whatever has piled up
+# in one call per file, so a busy batch commits once per burst instead of once per row. Readers flush()
+# first to see everything recorded so far; pending rows are also flushed when the process exits.
+
+
+class BackgroundWriter:
+    def __init__(self, name, write, label):
+        self.name = name  # of the thread
+        self.write = write  # write(path, rows), called on the thread
+        self.label = label  # for the message when a write fails
+        self._pending = queue.Queue()  # (path, row)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def append(self, path, row):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)  # batch_cli exits right after its last call
+        self._pending.put((path, row))
+
+    def flush(self):
+        # Wait until every row appended so far is written
+        self._pending.join()
+
+    def _run(self):
+        while True:
+            items = [self._pending.get()]
+            while True:
+                try:
+                    items.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                for path in dict.fromkeys(path for path, _ in items):
+                    self.write(path, [row for row_path, row in items if row_path == path])
+            except sqlite3.Error as e:
+                print(f"{self.label} write failed: {e}")  # never fail a request over bookkeeping
+            finally:
+                for _ in items:
+                    self._pending.task_done()
@@ -0,0 +1,80 @@
+import builtins
+import contextlib
+import os
+import sys
+import threading
+import time
+
+# Startup profiler for app.py (and any other entry point), enabled with EMAILBOT_PROFILE_STARTUP=1.
+# enable() wraps __import__ so every module imported for the first time is timed: "self" is the time
+# spent in the module's own body, "total" includes the modules it imported in turn. phase() times
+# named steps such as importing a bot module and running its main(); Streamlit re-runs the script on
+# every interaction, so only the first (cold) run of each step is kept. The report is printed to the
+# server log and, in the app, shown in the sidebar.
+
+ENABLED = os.environ.get("EMAILBOT_PROFILE_STARTUP", "").lower() in ("1", "true", "yes")
+TOP_MODULES = 15
+
+imports = {}  # module -> [total seconds, self seconds]
+phases = {}  # name -> seconds, first (cold) run only
+_original_import = builtins.__import__
+_local = threading.local()
+_lock = threading.Lock()
+_printed = 0  # phases already printed to the log
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level or name in sys.modules:  # already loaded (or relative): nothing to measure
+        return _original_import(name, globals, locals, fromlist, level)
+    stack = _local.__dict__.setdefault("stack", [])
+    stack.append(0.0)  # time spent in nested first-time imports
+    started = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        total = time.perf_counter() - started
+        nested = stack.pop()
+        if stack:
+            stack[-1] += total
+        with _lock:
+            imports.setdefault(name, [total, total - nested])
+
+
+def enable():
+    # Idempotent; Streamlit re-runs app.py on every interaction but imports only happen once
+    global ENABLED
+    ENABLED = True
+    if builtins.__import__ is not _timed_import:
+        builtins.__import__ = _timed_import
+
+
+@contextlib.contextmanager
+def phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if ENABLED:
+            with _lock:
+                phases.setdefault(name, time.perf_counter() - started)
+
+
+def report(limit=TOP_MODULES):
+    with _lock:
+        slowest = sorted(imports.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+        steps = list(phases.items())
+    lines = [f"{name}: {seconds * 1000:.0f} ms" for name, seconds in steps]
+    lines += [f"import {name}: {own * 1000:.0f} ms self, {total * 1000:.0f} ms total" for name, (total, own) in slowest]
+    return "\n".join(lines)
+
+
+def render():
+    import streamlit as st
+
+    global _printed
+    text = report()
+    if len(phases) != _printed:  # log each new measurement once, not on every re-run
+        _printed = len(phases)
+        print("Startup profile:\n" + text)
+    with st.sidebar.expander("Startup profile"):
+        st.code(text or "Nothing measured yet.", language=None)
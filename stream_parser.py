@@ -0,0 +1,264 @@
+import re
+import threading
+
+import rate_limiter
+import retry_policy
+
+# Incremental reader for streamed email replies.
+# Fed chunk by chunk, it skips a leading <think> block (llm_client normally drops it already), then
+# follows the JSON reply (see structured_output) character by character and pulls out
+# to/subject/body as they arrive, for the live view. As soon as the reply clearly can't be parsed it raises retry_policy.MalformedResponse,
+# which cuts the stream and retries at once. That happens when:
+#   - there is no JSON or To:/Subject: layout within the first MAX_PREAMBLE_CHARS
+#   - the JSON structure breaks (stray text, a missing ',' or ':', trailing commas, mismatched brackets,
+#     bad escapes)
+#   - a 'To:' line isn't followed by a 'Subject:' line within SUBJECT_WITHIN_LINES
+#   - the reasoning leaves less than MIN_ANSWER_TOKENS of the completion cap for the email
+# `complete` turns true once the JSON value closes, so the caller can stop reading right there.
+
+MAX_PREAMBLE_CHARS = 300
+MIN_ANSWER_TOKENS = 300
+SUBJECT_WITHIN_LINES = 4
+
+EMAIL_FIELDS = ("to", "subject", "body")
+
+_ESCAPES = {"n": "\n", "t": "\t", "r": "", '"': '"', "\\": "\\", "/": "/", "b": "", "f": ""}
+_LITERAL_CHARS = set("0123456789+-.eEtruefalsn")
+_LAYOUT_START = re.compile(r"(?im)^[ \t*]*(to|subject)\s*:")
+_SUBJECT_LINE = re.compile(r"(?im)^[ \t*]*subject\s*:")
+
+stats = {"aborted": 0, "tokens_saved": 0}
+_stats_lock = threading.Lock()
+
+
+def summary():
+    with _stats_lock:
+        return f"Streaming: {stats['aborted']} malformed replies cut short, ~{stats['tokens_saved']} tokens saved"
+
+
+def _format(email):
+    lines = []
+    if "to" in email:
+        lines.append(f"To: {''.join(email['to'])}")
+    if "subject" in email:
+        lines.append(f"Subject: {''.join(email['subject'])}")
+    if "body" in email:
+        lines.extend(["", "".join(email["body"])])
+    return "\n".join(lines)
+
+
+class EmailStreamParser:
+    def __init__(self, completion_cap=rate_limiter.DEFAULT_COMPLETION_TOKENS):
+        self.completion_cap = completion_cap
+        self.restart()
+
+    def restart(self):
+        self.chunks = []
+        self.received = 0  # characters so far
+        self.pending = ""  # text not yet classified as reasoning, JSON or layout
+        self.phase = "start"  # start | think | json | layout
+        self.think_chars = 0
+        self.emails = []
+        self.complete = False
+        # JSON lexer state. `expect` is what the grammar allows next inside the innermost container:
+        # "value", "key", "colon" or "comma" (a ',' or the closing bracket); `empty` is true right after
+        # an opening bracket, where the closing bracket is allowed too
+        self.stack = []
+        self.expect = "value"
+        self.empty = False
+        self.in_literal = False
+        self.in_string = False
+        self.string_is_key = False
+        self.escape = None  # None, "" right after a backslash, or "u" plus the hex digits read so far
+        self.key_parts = []
+        self.key = None
+        self.field = None
+        self.email = None
+        self.layout_text = ""
+
+    @property
+    def done(self):
+        return self.complete
+
+    def write(self, chunk):
+        self.chunks.append(chunk)
+        self.received += len(chunk)
+        if self.complete:
+            return
+        if self.phase in ("start", "think"):
+            self.pending += chunk
+            self._classify()
+        elif self.phase == "json":
+            self._lex(chunk)
+        elif self.phase == "layout":
+            self._check_layout(chunk)
+
+    def close(self):
+        pass
+
+    def render(self):
+        if self.phase == "think":
+            return f"Thinking… (~{self.think_chars // rate_limiter.CHARS_PER_TOKEN} tokens so far)"
+        if self.phase == "json":
+            return "\n\n---\n\n".join(_format(email) for email in self.emails) or "…"
+        return "".join(self.chunks)
+
+    def _abort(self, reason):
+        saved = max(0, self.completion_cap - self.received // rate_limiter.CHARS_PER_TOKEN)
+        with _stats_lock:
+            stats["aborted"] += 1
+            stats["tokens_saved"] += saved
+        raise retry_policy.MalformedResponse(f"Reply cut short, {reason} (~{saved} tokens saved)")
+
+    def _classify(self):
+        while True:
+            if self.phase == "think":
+                # Reasoning is only counted; just enough is kept to spot a closing tag split across chunks
+                end = self.pending.find("</think>")
+                if end == -1:
+                    keep = len("</think>") - 1
+                    self.think_chars += max(0, len(self.pending) - keep)
+                    self.pending = self.pending[-keep:]
+                    if self.think_chars // rate_limiter.CHARS_PER_TOKEN > self.completion_cap - MIN_ANSWER_TOKENS:
+                        self._abort("the reasoning leaves no room for the email")
+                    return
+                self.think_chars += end
+                self.pending = self.pending[end + len("</think>"):]
+                self.phase = "start"
+            stripped = self.pending.lstrip()
+            if stripped.startswith("<think>"):
+                self.pending = stripped[len("<think>"):]
+                self.phase = "think"
+                continue
+            if "<think>".startswith(stripped):
+                return  # nothing yet, or a tag split across chunks
+            break
+
+        brackets = [position for position in (self.pending.find("{"), self.pending.find("[")) if position != -1]
+        layout = _LAYOUT_START.search(self.pending)
+        if brackets and (layout is None or min(brackets) < layout.start()):
+            rest, self.pending, self.phase = self.pending[min(brackets):], "", "json"
+            self._lex(rest)
+        elif layout:
+            rest, self.pending, self.phase = self.pending[layout.start():], "", "layout"
+            self._check_layout(rest)
+        elif len(stripped) > MAX_PREAMBLE_CHARS:
+            self._abort("it doesn't start with JSON or the email layout")
+
+    def _check_layout(self, chunk):
+        # The plain 'To: / Subject: / Body:' layout is still accepted by the text parsers
+        self.layout_text += chunk
+        if _SUBJECT_LINE.search(self.layout_text):
+            self.phase = "layout_ok"
+        elif self.layout_text.count("\n") > SUBJECT_WITHIN_LINES:
+            self._abort("there is no 'Subject:' line after 'To:'")
+
+    def _unexpected(self, char):
+        reasons = {
+            "key": "an object key is missing",
+            "colon": "a ':' is missing after a key",
+            "comma": "a ',' is missing between members",
+        }
+        self._abort(reasons.get(self.expect, f"unexpected {char!r} in the JSON"))
+
+    def _value_done(self):
+        self.expect, self.empty = "comma", False
+
+    def _lex(self, chunk):
+        for char in chunk:
+            if self.complete:
+                return
+            if self.in_string:
+                self._string_char(char)
+                continue
+            if self.in_literal:
+                if char in _LITERAL_CHARS:
+                    continue
+                self.in_literal = False  # a number, true, false or null ends at the first other character
+            if char in " \t\r\n":
+                continue
+            elif char == '"':
+                if self.expect not in ("key", "value") or not self.stack:
+                    self._unexpected(char)
+                self._open_string()
+            elif char in "{[":
+                if self.expect != "value":
+                    self._unexpected(char)
+                self.stack.append(char)
+                self.expect, self.empty = ("key" if char == "{" else "value"), True
+                if char == "{":
+                    self.email = None  # the next email field starts a new email
+            elif char in "}]":
+                if not self.stack or self.stack[-1] != "{["["}]".index(char)]:
+                    self._abort("the JSON brackets don't match")
+                if self.expect != "comma" and not self.empty:
+                    self._abort("a value is missing before the closing bracket")  # e.g. a trailing ','
+                self.stack.pop()
+                self.email = None
+                if self.stack:
+                    self._value_done()
+                else:
+                    self.complete = True
+            elif char == ",":
+                if self.expect != "comma":
+                    self._unexpected(char)
+                self.expect, self.empty = ("key" if self.stack[-1] == "{" else "value"), False
+            elif char == ":":
+                if self.expect != "colon":
+                    self._abort("a ':' is out of place")
+                self.expect = "value"
+            elif char in _LITERAL_CHARS and self.stack and self.expect == "value":
+                self.in_literal = True
+                self._value_done()
+            else:
+                self._unexpected(char)
+
+    def _open_string(self):
+        self.in_string, self.empty = True, False
+        self.string_is_key = self.expect == "key"
+        if self.string_is_key:
+            self.key_parts = []
+            return
+        self.field = self.key if self.stack and self.stack[-1] == "{" and self.key in EMAIL_FIELDS else None
+        if self.field:
+            if self.email is None or self.field in self.email:
+                self.email = {}
+                self.emails.append(self.email)
+            self.email[self.field] = []
+
+    def _string_char(self, char):
+        if self.escape is not None:
+            if self.escape == "" and char == "u":
+                self.escape = "u"
+            elif self.escape.startswith("u"):
+                self.escape += char
+                if len(self.escape) == 5:
+                    try:
+                        decoded = chr(int(self.escape[1:], 16))
+                    except ValueError:
+                        self._abort("the JSON has a bad \\u escape")
+                    self.escape = None
+                    self._string_text(decoded)
+            else:
+                if char not in _ESCAPES:
+                    self._abort("the JSON has a bad escape")
+                self.escape = None
+                self._string_text(_ESCAPES[char])
+        elif char == "\\":
+            self.escape = ""
+        elif char == '"':
+            self.in_string = False
+            if self.string_is_key:
+                self.key = "".join(self.key_parts)
+                self.expect = "colon"
+            else:
+                self._value_done()
+            self.field = None
+        else:
+            self._string_text(char)
+
+    def _string_text(self, text):
+        if self.string_is_key:
+            self.key_parts.append(text)
+        elif self.field:
+            self.email[self.field].append(text)
@@ -0,0 +1,130 @@
+import json
+import re
+import threading
+
+# Structured (JSON) email output.
+# Prompts ask for {"to", "subject", "body"} as a JSON object. Where the provider supports it the request
+# also carries a response_format: a strict JSON schema (OpenAI) or plain JSON mode (Groq); elsewhere
+# (DeepSeek via Kluster) the prompt instruction alone asks for strict JSON. Replies that still come back
+# in the old 'To: / Subject: / Body:' layout are read by the bot's text parser as a fallback.
+
+JSON_SCHEMA = "json_schema"
+JSON_OBJECT = "json_object"
+PROMPT_ONLY = "prompt"
+
+EMAIL_FIELDS = ("to", "subject", "body")
+
+EMAIL_SCHEMA = {
+    "type": "object",
+    "properties": {name: {"type": "string"} for name in EMAIL_FIELDS},
+    "required": list(EMAIL_FIELDS),
+    "additionalProperties": False,
+}
+
+# Several emails in one reply (multi_merchant); `merchant` is the 1-based position in the prompt
+GROUP_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "emails": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"merchant": {"type": "integer"}, **EMAIL_SCHEMA["properties"]},
+                "required": ["merchant", *EMAIL_FIELDS],
+                "additionalProperties": False,
+            },
+        }
+    },
+    "required": ["emails"],
+    "additionalProperties": False,
+}
+
+EMAIL_INSTRUCTIONS = """
+
+        JSON OUTPUT:
+        Return the email as a single JSON object with exactly these string fields:
+        "to": the merchant's email address
+        "subject": the subject line
+        "body": the complete email body from the greeting through the signature, with line breaks written as \\n
+        Do not write anything before or after the JSON object.
+        """
+
+stats = {"structured": 0, "text_fallback": 0, "parse_failures": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        stats[name] += 1
+
+
+def summary():
+    with _stats_lock:
+        return (
+            f"Parsing: {stats['structured']} JSON, {stats['text_fallback']} text fallback, "
+            f"{stats['parse_failures']} failures"
+        )
+
+
+def _schema_format(name, schema):
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+
+
+def request_json(payload, mode):
+    # Add the JSON instructions (and the provider's response_format) to an email payload
+    messages = [dict(message) for message in payload["messages"]]
+    # Into the first user message: the static instructions, which stay a cacheable prompt prefix
+    next(message for message in messages if message["role"] == "user")["content"] += EMAIL_INSTRUCTIONS
+    payload = dict(payload, messages=messages)
+    if mode == JSON_SCHEMA:
+        payload["response_format"] = _schema_format("email", EMAIL_SCHEMA)
+    elif mode == JSON_OBJECT:
+        payload["response_format"] = {"type": "json_object"}
+    return payload
+
+
+def for_group(payload):
+    # A grouped request answers with {"emails": [...]}, so a single-email schema has to be swapped out
+    if payload.get("response_format", {}).get("type") == "json_schema":
+        payload = dict(payload, response_format=_schema_format("emails", GROUP_SCHEMA))
+    return payload
+
+
+def extract_json(response_text):
+    # The first JSON object or array in the reply, ignoring reasoning blocks and code fences
+    text = re.sub(r"<think>.*?</think>", "", response_text, flags=re.DOTALL).strip()
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text)
+    starts = [position for position in (text.find("{"), text.find("[")) if position != -1]
+    if not starts:
+        raise ValueError("Response contains no JSON.")
+    # strict=False lets raw line breaks inside strings through; models often write them
+    value, _ = json.JSONDecoder(strict=False).raw_decode(text, min(starts))
+    return value
+
+
+def email_fields(value):
+    if not isinstance(value, dict):
+        raise ValueError("Structured email is not a JSON object.")
+    fields = tuple(str(value.get(name) or "").strip() for name in EMAIL_FIELDS)
+    if not all(fields):
+        raise ValueError("Structured email is missing to, subject or body.")
+    return fields
+
+
+def parse_email(response_text, fallback=None):
+    # -> (to, subject, body); `fallback` parses the plain-text layout when the reply isn't JSON
+    try:
+        fields = email_fields(extract_json(response_text))
+        _count("structured")
+        return fields
+    except ValueError as e:
+        error = e
+    if fallback is not None:
+        try:
+            fields = fallback(response_text)
+            _count("text_fallback")
+            return fields
+        except Exception:
+            pass
+    _count("parse_failures")
+    raise error
@@ -0,0 +1,134 @@
+import pytest
+
+import code_guard
+
+
+def validate(code):
+    return code_guard.validate(code).splitlines()
+
+
+def test_provided_imports_under_their_usual_names_are_dropped():
+    assert validate("import pandas as pd\nimport streamlit as st\noutput_data = df") == ["output_data = df"]
+
+
+@pytest.mark.parametrize(
+    "code, binding",
+    [
+        ("import pandas", "pandas = pd"),
+        ("import pandas as pds", "pds = pd"),
+        ("import plotly.express as plt", "plt = px"),
+        ("import streamlit", "streamlit = st"),
+        ("from pandas import DataFrame", "DataFrame = pd.DataFrame"),
+        ("from pandas import DataFrame as Frame", "Frame = pd.DataFrame"),
+        ("from plotly.express import bar", "bar = px.bar"),
+        ("from plotly import express", "express = px"),
+    ],
+)
+def test_provided_modules_under_other_names_are_bound(code, binding):
+    assert validate(code) == [binding]
+
+
+def test_plain_plotly_express_import_uses_the_provided_package():
+    assert validate("import plotly.express\nfig = plotly.express.bar(df)") == ["fig = plotly.express.bar(df)"]
+
+
+def test_dataset_reads_through_any_pandas_name_use_the_loaded_frame():
+    code = "import pandas as pds\na = pds.read_csv('x.csv')\nb = pd.read_csv('/etc/passwd')"
+    assert validate(code)[-2:] == ["a = df", "b = df"]
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "import numpy as np\nrng = np.random.default_rng(0)\nx = np.where(df.a > 1, np.nan, np.linalg.norm([1, 2]))",
+        "from datetime import datetime, timedelta\nx = datetime.now() - timedelta(days=1)",
+        "text = df.head().to_csv(index=False)",
+        "fig = px.bar(df, x='a', color_discrete_sequence=px.colors.qualitative.Set2)",
+        "numeric = pd.api.types.is_numeric_dtype(df['a'])",
+        "top = df.query('google_review_score > 4 and `Cuisine Type` == @cuisine')",
+        "df2 = df.eval('c = a * 2')",
+    ],
+)
+def test_everyday_code_passes(code):
+    code_guard.validate(code)
+
+
+def test_safe_and_provided_imports_can_share_a_statement():
+    assert validate("import math, pandas") == ["import math", "pandas = pd"]
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "import os",
+        "import pandas as exec",
+        "from pandas import *",
+        "from pandas import __builtins__",
+        "from plotly import io",
+        "from subprocess import run",
+    ],
+)
+def test_unsafe_imports_are_rejected(code):
+    with pytest.raises(code_guard.UnsafeCode):
+        code_guard.validate(code)
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "pd.io.common.os.system('id')",
+        "keys = pd.io.common.os.environ",
+        "page = pd.io.common.urlopen(url)",
+        "import datetime\nmodules = datetime.sys.modules",
+        "import json\ndecoder = json.decoder",
+        "import numpy as np\nlib = np.lib",
+        "import numpy.lib.npyio",
+        "def f():\n    return np.lib\nimport numpy as np",
+        "import numpy as np\nm = np\nm.lib",
+        "import numpy as np\nprint(np)",
+        "px.np.load('x.npy')",
+        "result = pd.eval('1 + 1')",
+        "writer = pd.ExcelWriter('x.xlsx')",
+    ],
+)
+def test_modules_reached_through_other_modules_are_rejected(code):
+    with pytest.raises(code_guard.UnsafeCode):
+        code_guard.validate(code)
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "import numpy as np\nx = np.load('x.npy')",
+        "import numpy as np\nnp.save('x', df.values)",
+        "import numpy as np\nnp.savetxt('x.txt', df.values)",
+        "import numpy as np\nx = np.fromfile('x.bin')",
+        "from numpy import load",
+        "df.values.tofile('/tmp/x')",
+        "df.values.dump('/tmp/x')",
+        "f = pd.read_csv\nf(path)",
+        "from pandas import read_csv as load\nb = load('/etc/passwd')",
+        "frames = list(map(pd.read_csv, paths))",
+        "f = df.to_csv\nf('/tmp/x')",
+        "df.apply('to_pickle', path='/tmp/x')",
+        "df.pipe(pd.DataFrame.to_pickle, '/tmp/x')",
+    ],
+)
+def test_file_access_in_any_form_is_rejected(code):
+    with pytest.raises(code_guard.UnsafeCode):
+        code_guard.validate(code)
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "df.query(\"a.to_pickle('/tmp/x') == 1\")",
+        "df.query('a == @pd.io.common.os.getcwd()')",
+        "df.eval('b = a.values.tofile(`path`)')",
+        "expression = 'a > 1'\ndf.query(expression)",
+        "df.query(f'a > {limit}')",
+    ],
+)
+def test_query_expressions_are_checked_like_code(code):
+    with pytest.raises(code_guard.UnsafeCode):
+        code_guard.validate(code)
@@ -0,0 +1,104 @@
+import contextlib
+
+import pytest
+
+import email_journal
+import llm_cache
+
+SENDER = ("Sumit", "Partnerships", "sumit@example.com", "+65 8000 0000")
+
+
+def merchant(number):
+    return {"merchant_name": f"Cafe {number}", "merchant_email": f"cafe{number}@example.sg"}
+
+
+class FakeAgent:
+    # Writes each merchant's email without a provider; `failing` names never get one
+    def __init__(self, failing=(), subject="Hello"):
+        self.failing = set(failing)
+        self.subject = subject
+        self.calls = []
+
+    def build_payload(self, merchant_details, your_name, your_position, your_email, your_phone):
+        return {"model": "fake", "messages": [{"role": "user", "content": f"From {your_name}: {merchant_details}"}]}
+
+    @contextlib.asynccontextmanager
+    async def async_session(self):
+        yield None
+
+    async def agenerate_email(self, session, merchant_details, your_name, your_position, your_email, your_phone):
+        self.calls.append(merchant_details["merchant_name"])
+        if merchant_details["merchant_name"] in self.failing:
+            raise ValueError("no email")
+        return merchant_details["merchant_email"], self.subject, f"Hi {merchant_details['merchant_name']}"
+
+
+@pytest.fixture(autouse=True)
+def journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(email_journal, "JOURNAL_PATH", str(tmp_path / "journal.sqlite"))
+
+
+def emails(results):
+    return [result.value and result.value[0] for result in results]
+
+
+def test_second_run_restores_the_batch_without_generating():
+    rows = [merchant(number) for number in range(4)]
+    first = email_journal.generate_batch(FakeAgent(), rows, SENDER)
+    agent = FakeAgent()
+    restored = []
+    second = email_journal.generate_batch(agent, rows, SENDER, on_restored=restored.extend)
+    assert agent.calls == []
+    assert second == first
+    assert sorted(result.index for result in restored) == [0, 1, 2, 3]
+
+
+def test_results_map_back_to_their_rows():
+    rows = [merchant(number) for number in range(6)]
+    email_journal.generate_batch(FakeAgent(failing={"Cafe 4"}), rows[3:], SENDER)
+    # The journaled ones now sit between new ones, and the failure is retried
+    agent, restored, generated = FakeAgent(), [], []
+    rows = [rows[4], rows[0], rows[3], rows[1], rows[5], rows[2]]
+    results = email_journal.generate_batch(
+        agent, rows, SENDER, on_result=generated.append, on_restored=restored.extend
+    )
+    assert sorted(agent.calls) == ["Cafe 0", "Cafe 1", "Cafe 2", "Cafe 4"]
+    assert emails(results) == [row["merchant_email"] for row in rows]
+    assert [result.index for result in results] == list(range(6))
+    assert sorted(result.index for result in restored) == [2, 4]
+    assert sorted(result.index for result in generated) == [0, 1, 3, 5]
+    assert all(result.value[0] == rows[result.index]["merchant_email"] for result in restored + generated)
+
+
+def test_failures_are_not_journaled():
+    rows = [merchant(number) for number in range(3)]
+    first = email_journal.generate_batch(FakeAgent(failing={"Cafe 1"}), rows, SENDER)
+    assert isinstance(first[1].error, ValueError)
+    agent = FakeAgent()
+    second = email_journal.generate_batch(agent, rows, SENDER)
+    assert agent.calls == ["Cafe 1"]
+    assert emails(second) == [row["merchant_email"] for row in rows]
+
+
+def test_bypassing_the_cache_regenerates_and_the_newest_email_wins():
+    rows = [merchant(number) for number in range(3)]
+    email_journal.generate_batch(FakeAgent(), rows, SENDER)
+    agent = FakeAgent(subject="Hello again")
+    token = llm_cache.bypass.set(True)
+    try:
+        email_journal.generate_batch(agent, rows, SENDER)
+    finally:
+        llm_cache.bypass.reset(token)
+    assert sorted(agent.calls) == ["Cafe 0", "Cafe 1", "Cafe 2"]
+    agent = FakeAgent()
+    results = email_journal.generate_batch(agent, rows, SENDER)
+    assert agent.calls == []
+    assert [result.value[1] for result in results] == ["Hello again"] * 3
+
+
+def test_a_new_prompt_version_starts_over():
+    rows = [merchant(number) for number in range(2)]
+    email_journal.generate_batch(FakeAgent(), rows, SENDER)
+    agent = FakeAgent()
+    email_journal.generate_batch(agent, rows, ("Anna",) + SENDER[1:])
+    assert sorted(agent.calls) == ["Cafe 0", "Cafe 1"]
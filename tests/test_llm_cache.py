@@ -0,0 +1,52 @@
+import asyncio
+import threading
+
+import pytest
+
+import llm_cache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "CACHE_PATH", str(tmp_path / "responses.sqlite"))
+    monkeypatch.setattr(llm_cache, "CACHE_MAX_BYTES", 1000)
+
+
+def payload(number):
+    return {"model": "test-model", "messages": [{"role": "user", "content": f"merchant {number}"}]}
+
+
+def stored_bytes():
+    with llm_cache._connection() as connection:
+        return connection.execute("SELECT SUM(size) FROM responses").fetchone()[0]
+
+
+def test_running_total_follows_puts_and_eviction(cache):
+    for number in range(12):
+        llm_cache.put(payload(number), "x" * 100)
+    llm_cache.put(payload(11), "x" * 50)  # a replaced entry only counts once
+    assert llm_cache._sizes[llm_cache.CACHE_PATH] == stored_bytes() <= 1000
+    assert llm_cache.get(payload(0)) is None  # the least recently used went first
+    assert llm_cache.get(payload(11)) == "x" * 50
+
+
+def test_batches_use_the_cache_off_the_event_loop(cache, monkeypatch):
+    threads = []
+    for name in ("get", "put"):
+        original = getattr(llm_cache, name)
+
+        def tracked(*args, original=original):
+            threads.append(threading.current_thread())
+            return original(*args)
+
+        monkeypatch.setattr(llm_cache, name, tracked)
+
+    async def fetch():
+        return '{"subject": "Hi"}'
+
+    async def cached_twice():
+        first = await llm_cache.async_cached_text(payload(1), fetch, len)
+        return first, await llm_cache.async_cached_text(payload(1), fetch, len)
+
+    assert asyncio.run(cached_twice()) == (17, 17)
+    assert len(threads) == 3 and threading.main_thread() not in threads
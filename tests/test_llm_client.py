@@ -0,0 +1,149 @@
+import asyncio
+import json
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+import live_output
+import llm_client
+import rate_limiter
+import token_ledger
+
+EMAIL = {"to": "owner@cafe.sg", "subject": "More weekday diners", "body": "Hi Anna,\n\nQuick idea.\n\nBest,\nSumit"}
+PAYLOAD = {"model": "test-model", "max_tokens": 800, "messages": [{"role": "user", "content": "Write an email " * 20}]}
+USAGE = {
+    "prompt_tokens": 120, "completion_tokens": 40, "total_tokens": 160, "prompt_tokens_details": {"cached_tokens": 96},
+}
+
+
+def reply_pieces():
+    # The email in small pieces, then text after the JSON that is never shown
+    text = json.dumps(EMAIL)
+    return [text[start:start + 7] for start in range(0, len(text), 7)] + ["\n\nHope this helps!"]
+
+
+@pytest.fixture
+def ledger(tmp_path, monkeypatch):
+    monkeypatch.setattr(token_ledger, "LEDGER_PATH", str(tmp_path / "ledger.sqlite"))
+    return token_ledger.load
+
+
+# OpenAI SDK stand-ins: content chunks, then the include_usage chunk without choices
+class FakeUsage(dict):
+    def model_dump(self):
+        return dict(self)
+
+
+def sdk_chunk(content=None, usage=None):
+    choices = [SimpleNamespace(delta=SimpleNamespace(content=content))] if content is not None else []
+    return SimpleNamespace(choices=choices, usage=FakeUsage(usage) if usage else None)
+
+
+class FakeSdkStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.response = SimpleNamespace(headers={})
+        self.closed = False
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeAsyncOpenAI:
+    def __init__(self, chunks):
+        self.base_url = "https://api.kluster.ai/v1/"
+        self.api_key = uuid.uuid4().hex  # a limiter of its own for each test
+        self.stream = FakeSdkStream(chunks)
+
+        async def create(**payload):
+            assert payload["stream"] and payload["stream_options"] == {"include_usage": True}
+            return self.stream
+
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=create))
+
+
+# Groq stand-ins: server-sent events with the usage under x_groq on the last chunk
+class FakeSseResponse:
+    status_code = 200
+    headers = {}
+
+    def __init__(self, lines):
+        self.lines = lines
+
+    async def aiter_lines(self):
+        for line in self.lines:
+            yield line
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeGroqSession:
+    def __init__(self, lines):
+        self.lines = lines
+
+    def stream(self, method, url, json=None, headers=None):
+        return FakeSseResponse(self.lines)
+
+
+def groq_lines():
+    events = [{"choices": [{"delta": {"content": piece}}]} for piece in reply_pieces()]
+    events.append({"choices": [{"delta": {}, "finish_reason": "stop"}], "x_groq": {"usage": USAGE}})
+    return [f"data: {json.dumps(event)}" for event in events] + ["", "data: [DONE]"]
+
+
+def kluster_stream():
+    client = FakeAsyncOpenAI([sdk_chunk(piece) for piece in reply_pieces()] + [sdk_chunk(usage=USAGE)])
+    text = asyncio.run(llm_client.async_openai_stream(client, PAYLOAD, live_output.sink("Cafe", PAYLOAD)))
+    return client, text
+
+
+def groq_stream():
+    headers = llm_client.groq_headers(uuid.uuid4().hex)
+    text = asyncio.run(
+        llm_client.async_groq_stream(FakeGroqSession(groq_lines()), PAYLOAD, headers, live_output.sink("Cafe", PAYLOAD))
+    )
+    return headers, text
+
+
+@pytest.mark.parametrize("run", [kluster_stream, groq_stream])
+def test_streamed_email_reads_on_to_the_usage(ledger, run):
+    _, text = run()
+    assert json.loads(text) == EMAIL  # the text after the JSON is dropped
+    row = ledger().iloc[0]
+    assert (row["prompt_tokens"], row["completion_tokens"], row["total_tokens"], row["aborted"]) == (120, 40, 160, 0)
+    assert row["estimated_prompt_tokens"] > 0  # reconciled against the provider's prompt_tokens
+    assert row["cached_tokens"] == 96  # the instruction prefix served from the provider's prompt cache
+
+
+def test_sdk_stream_is_closed_after_the_usage(ledger):
+    client, _ = kluster_stream()
+    assert client.stream.closed
+
+
+@pytest.mark.parametrize(
+    "run, limiter",
+    [
+        (kluster_stream, llm_client._openai_limiter),
+        (groq_stream, lambda headers: llm_client._groq_limiter(headers, llm_client.GROQ_API_URL)),
+    ],
+)
+def test_streamed_usage_settles_the_reservation(ledger, monkeypatch, run, limiter):
+    # A stopped clock, so the bucket only moves by what is reserved and settled
+    monkeypatch.setattr(rate_limiter, "time", SimpleNamespace(monotonic=lambda: 1000.0))
+    key, _ = run()
+    limiter = limiter(key)
+    assert limiter.tokens.level == limiter.tokens.capacity - USAGE["total_tokens"]  # the estimate refunded
+    assert limiter.expected_completion == USAGE["completion_tokens"]  # what the next reservation expects
+    assert limiter.estimate(PAYLOAD) == rate_limiter.prompt_tokens(PAYLOAD) + USAGE["completion_tokens"]
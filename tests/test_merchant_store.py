@@ -0,0 +1,74 @@
+import math
+
+import pytest
+
+import merchant_store
+
+WEEK = list(range(7))
+
+
+def same(actual, expected):
+    return actual == expected or (isinstance(actual, float) and math.isnan(actual) and math.isnan(expected))
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("S$160-240", ("SGD", 160, 240)),
+        ("S$10-20", ("SGD", 10, 20)),
+        ("Approximately S$5 - S$10 per person", ("SGD", 10, 20)),
+        ("Approximately S$20 to S$30,", ("SGD", 20, 30)),
+        ("AED 900+", ("AED", 900, math.nan)),
+        ("US$1,200-1,500", ("USD", 1200, 1500)),
+        ("Varies", (None, math.nan, math.nan)),
+        (None, (None, math.nan, math.nan)),
+    ],
+)
+def test_parse_cost(value, expected):
+    assert all(same(actual, wanted) for actual, wanted in zip(merchant_store.parse_cost(value), expected))
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("Daily 11:00am-10:00pm", [[day, 660, 1320] for day in WEEK]),
+        ("Tue-Thu 9:00am-10:00pm", [[day, 540, 1320] for day in (1, 2, 3)]),
+        ("Daily 8:00am-2:00am", [[day, 480, 1560] for day in WEEK]),
+        (
+            "Mon-Fri 12:00pm-2:30pm & 3:00pm-10:30pm",
+            [[day, 720, 870] for day in range(5)] + [[day, 900, 1350] for day in range(5)],
+        ),
+        ("Daily from 10:00 AM to 9:30 PM", [[day, 600, 1290] for day in WEEK]),
+        (
+            "Lunch: 10:30AM to 1:30PM, Dinner 5:30pm to 7:30pm",
+            [[day, 630, 810] for day in WEEK] + [[day, 1050, 1170] for day in WEEK],
+        ),
+        ("Mon to Fri 9am to 5pm", [[day, 540, 1020] for day in range(5)]),
+        ("Sat-Sun 3:00-10:30pm", [[day, 900, 1350] for day in (5, 6)]),
+        ("Daily 6pm-midnight", [[day, 1080, 1440] for day in WEEK]),
+        ("Open 24 hours", [[day, 0, 1440] for day in WEEK]),
+        ("S$15-20", []),  # a price in the hours column
+        (None, []),
+    ],
+)
+def test_parse_operating_hours(value, expected):
+    assert merchant_store.parse_operating_hours(value) == expected
+
+
+@pytest.mark.parametrize(
+    "code, country, expected",
+    [
+        (238867, "SG", "238867"),
+        (68601, "SG", "068601"),
+        (50335.0, "SG", "050335"),
+        ("018956", "SG", "018956"),
+        (12345, "US", "12345"),
+        ("SW1A 1AA", "GB", "SW1A 1AA"),
+    ],
+)
+def test_postal_code(code, country, expected):
+    assert merchant_store._postal_code(code, country) == expected
+
+
+def test_missing_postal_code_stays_missing():
+    assert merchant_store._postal_code(float("nan"), "SG") is merchant_store.pd.NA
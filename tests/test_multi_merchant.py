@@ -0,0 +1,112 @@
+import asyncio
+import json
+import re
+
+import pytest
+
+import llm_cache
+import multi_merchant
+
+SENDER = ("Sumit", "Partnerships", "sumit@example.com", "+65 8000 0000")
+
+
+def merchant(number):
+    return {"merchant_name": f"Cafe {number}", "merchant_email": f"cafe{number}@example.sg"}
+
+
+class FakeAgent:
+    # Grouped replies come from `reply(names)`, which gets the merchants' names in prompt order
+    def __init__(self, reply):
+        self.reply = reply
+        self.groups = []  # names per grouped request
+        self.singles = []  # names sent on their own
+
+    def build_payload(self, merchant_details, your_name, your_position, your_email, your_phone):
+        prompt = f"Write to {merchant_details}"
+        return {"model": "fake", "max_tokens": 400, "messages": [{"role": "user", "content": prompt}]}
+
+    async def acomplete(self, session, payload, title):
+        names = re.findall(r"name: (Cafe \d+)", payload["messages"][-1]["content"])
+        self.groups.append(names)
+        return json.dumps({"emails": self.reply(names)})
+
+    def parse_email(self, response_text, merchant_details, your_name, your_position, your_email, your_phone):
+        email = json.loads(response_text)
+        if not email.get("to") or not email.get("body"):
+            raise ValueError("incomplete email")
+        return email["to"], email["subject"], email["body"]
+
+    async def agenerate_email(self, session, merchant_details, your_name, your_position, your_email, your_phone):
+        self.singles.append(merchant_details["merchant_name"])
+        return merchant_details["merchant_email"], "Hello", f"Hi {merchant_details['merchant_name']}"
+
+
+def email(number, name):
+    return {"merchant": number, "to": name.lower().replace(" ", "") + "@example.sg", "subject": "Hello", "body": "Hi"}
+
+
+def every_email(names):
+    return [email(number, name) for number, name in enumerate(names, 1)]
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "CACHE_PATH", str(tmp_path / "responses.sqlite"))
+
+
+def generate(agent, count):
+    group = [merchant(number) for number in range(count)]
+    return asyncio.run(multi_merchant.agenerate_group(agent, None, group, SENDER))
+
+
+def test_a_complete_reply_needs_one_request():
+    agent = FakeAgent(every_email)
+    results = generate(agent, 3)
+    assert [value[0] for value, _ in results] == ["cafe0@example.sg", "cafe1@example.sg", "cafe2@example.sg"]
+    assert (agent.groups, agent.singles) == ([["Cafe 0", "Cafe 1", "Cafe 2"]], [])
+
+
+def test_entries_in_any_order_go_to_their_merchant():
+    agent = FakeAgent(lambda names: every_email(names)[::-1])
+    assert [value[0] for value, _ in generate(agent, 3)] == ["cafe0@example.sg", "cafe1@example.sg", "cafe2@example.sg"]
+
+
+def test_only_the_merchant_whose_email_is_incomplete_is_retried():
+    def reply(names):
+        emails = every_email(names)
+        emails[1]["body"] = ""  # Cafe 1's email came back without a body
+        return emails
+
+    agent = FakeAgent(reply)
+    results = generate(agent, 3)
+    assert all(error is None for _, error in results)
+    assert [value[0] for value, _ in results] == ["cafe0@example.sg", "cafe1@example.sg", "cafe2@example.sg"]
+    assert agent.singles == ["Cafe 1"]
+
+
+def test_a_reply_missing_an_email_is_split_in_halves():
+    # The first request drops an email, so neither is usable; each half is then answered in full
+    agent = FakeAgent(lambda names: every_email(names)[:-1] if len(names) == 4 else every_email(names))
+    results = generate(agent, 4)
+    assert [value[0] for value, _ in results] == [f"cafe{number}@example.sg" for number in range(4)]
+    assert agent.groups[0] == ["Cafe 0", "Cafe 1", "Cafe 2", "Cafe 3"]
+    assert sorted(agent.groups[1:]) == [["Cafe 0", "Cafe 1"], ["Cafe 2", "Cafe 3"]]  # the halves run concurrently
+    assert agent.singles == []
+
+
+def test_a_merchant_that_keeps_failing_gets_its_error_without_failing_the_rest():
+    class FailingAgent(FakeAgent):
+        async def agenerate_email(self, session, merchant_details, *sender):
+            await super().agenerate_email(session, merchant_details, *sender)
+            raise ValueError("no email")
+
+    def reply(names):
+        emails = every_email(names)
+        emails[-1]["to"] = ""  # Cafe 2 never gets a usable email
+        return emails
+
+    agent = FailingAgent(reply)
+    results = generate(agent, 3)
+    assert agent.singles == ["Cafe 2"]
+    assert [value[0] if value else None for value, _ in results] == ["cafe0@example.sg", "cafe1@example.sg", None]
+    assert isinstance(results[2][1], ValueError)
@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+
+import query_planner
+
+MERCHANTS = pd.DataFrame(
+    {
+        "merchant_name": ["Kopi Corner", "Bean There", "Spice Route", "Noodle Bar", "Tampines Brew", "Curry Leaf"],
+        "merchant_category": ["Cafe", "Cafe", "Restaurant", "Restaurant", "Cafe", "Restaurant"],
+        "Cuisine_Type": ["Coffee", "Coffee", "Indian", "Japanese", "Coffee", "Indian"],
+        "city": ["Singapore"] * 6,
+        "nearest_city": ["Orchard", "Orchard", "Tampines", "Orchard", "Tampines", "Tampines"],
+        "merchant_street": ["Orchard Road", "Scotts Road", "Tampines Ave", "Orchard Road", "Tampines St", "Tampines Ave"],
+        "merchant_address": [""] * 6,
+        "google_review_score": [4.5, 4.8, 4.2, 3.9, 4.7, 4.6],
+        "google_review_count": ["2000+", "~300", "1,200", "150", "80", "2,984"],
+    }
+)
+
+
+def names(query):
+    plan = query_planner.plan_query(query, MERCHANTS)
+    return query_planner.apply_plan(plan, MERCHANTS)["merchant_name"].tolist()
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("cafes in Orchard", ["Kopi Corner", "Bean There"]),
+        ("Show me Indian restaurants in Tampines", ["Spice Route", "Curry Leaf"]),
+        ("top 2 cafes", ["Bean There", "Tampines Brew"]),
+        ("cafes with rating above 4.6", ["Bean There", "Tampines Brew"]),
+        ("restaurants with at least 1000 reviews", ["Spice Route", "Curry Leaf"]),
+        ("most reviewed restaurants", ["Curry Leaf", "Spice Route", "Noodle Bar"]),
+        ("best rated merchants in Tampines", ["Tampines Brew", "Curry Leaf", "Spice Route"]),
+    ],
+)
+def test_recognized_queries_are_answered_without_the_llm(query, expected):
+    assert names(query) == expected
+
+
+def test_top_without_a_number_takes_the_default():
+    plan = query_planner.plan_query("top cafes", MERCHANTS)
+    assert (plan.limit, plan.sort_by) == (query_planner.DEFAULT_TOP_N, "google_review_score")
+
+
+def test_rating_ties_go_to_the_merchant_with_more_reviews():
+    frame = MERCHANTS.assign(google_review_score=4.5)
+    plan = query_planner.plan_query("top 2 restaurants", frame)
+    assert query_planner.apply_plan(plan, frame)["merchant_name"].tolist() == ["Curry Leaf", "Spice Route"]
+
+
+def test_a_category_alone_is_a_filter():
+    assert query_planner.plan_query("cafes", MERCHANTS).filters == [("category", "cafe")]
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "",
+        "cafes that serve vegan food",
+        "restaurants in Jurong",  # not a place in the data
+        "which cafes have the friendliest staff",
+        "average rating by category",
+        "plot cafes by rating",
+    ],
+)
+def test_queries_it_cannot_account_for_fall_back(query):
+    assert query_planner.plan_query(query, MERCHANTS) is None
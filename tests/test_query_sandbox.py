@@ -0,0 +1,29 @@
+import pandas as pd
+import pytest
+
+import query_sandbox
+
+
+@pytest.fixture
+def environment(monkeypatch):
+    monkeypatch.setenv("EMAILBOT_OPENAI_API_KEY", "sk-emailbot")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-openai")
+    monkeypatch.setenv("EMAILBOT_SANDBOX_CHECK", "1")
+    monkeypatch.setenv("SANDBOX_CHECK_LANGUAGE", "en")
+
+
+@pytest.fixture
+def sandbox(environment):
+    pool = query_sandbox.SandboxPool(size=1)  # spawned with the environment above
+    yield pool
+    while not pool.idle.empty():
+        pool.idle.get().kill()
+
+
+def test_workers_see_no_credentials(sandbox):
+    # Straight to the worker, past code_guard (which rejects this), as an escape that got through would run
+    dataset = ("frame", query_sandbox._frame_bytes(pd.DataFrame({"a": [1]})))
+    kind, data, _ = sandbox.run("output_data = dict(pd.io.common.os.environ)", dataset)
+    seen = query_sandbox._decode_output(kind, data)
+    assert not {"EMAILBOT_OPENAI_API_KEY", "OPENAI_API_KEY", "EMAILBOT_SANDBOX_CHECK"} & set(seen)
+    assert seen["SANDBOX_CHECK_LANGUAGE"] == "en"  # the rest of the environment is kept
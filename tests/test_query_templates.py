@@ -0,0 +1,77 @@
+import pandas as pd
+import pytest
+
+import query_cache
+import query_templates
+
+MERCHANTS = pd.DataFrame(
+    {
+        "merchant_name": ["Kopi Corner", "Bean There", "Crumbs", "Rise Up", "Tampines Brew", "Loaf Life"],
+        "merchant_category": ["Cafe", "Cafe", "Bakery", "Bakery", "Cafe", "Bakery"],
+        "city": ["Singapore", "Singapore", "Singapore", "Tampines", "Tampines", "Tampines"],
+        "google_review_score": [4.5, 4.8, 4.2, 3.9, 4.7, 4.6],
+    }
+)
+
+CODE = """
+matches = df[df['merchant_category'].str.lower() == 'cafe']
+matches = matches[matches['city'] == 'Singapore']
+output_data = matches.nlargest(1, 'google_review_score')
+"""
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(query_cache, "CACHE_PATH", str(tmp_path / "query_code.sqlite"))
+
+
+def run(code):
+    scope = {"df": MERCHANTS, "pd": pd}
+    exec(code, scope)
+    return scope["output_data"]["merchant_name"].tolist()
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("top 2 cafes in singapore", ["Bean There", "Kopi Corner"]),
+        ("top 1 bakeries in singapore", ["Crumbs"]),
+        ("Top 3 Bakeries in Tampines", ["Loaf Life", "Rise Up"]),
+        ("top 1 cafes in tampines", ["Tampines Brew"]),
+    ],
+)
+def test_a_learned_template_answers_queries_of_the_same_shape(query, expected):
+    assert query_templates.learn("top 1 cafes in singapore", MERCHANTS, CODE)
+    assert run(query_templates.instantiate(query, MERCHANTS)) == expected
+
+
+def test_plural_constants_take_the_new_literal_as_written():
+    code = "output_data = df[df['merchant_category'].str.lower() + 's' == 'cafes'].head(2)"
+    assert query_templates.learn("2 cafes", MERCHANTS, code)
+    assert "'bakeries'" in query_templates.instantiate("2 bakeries", MERCHANTS)
+
+
+def test_queries_of_another_shape_get_no_template():
+    query_templates.learn("top 1 cafes in singapore", MERCHANTS, CODE)
+    assert query_templates.instantiate("cafes in singapore with rating above 4", MERCHANTS) is None
+    assert query_templates.instantiate("how many merchants are there", MERCHANTS) is None
+
+
+@pytest.mark.parametrize(
+    "query, code",
+    [
+        ("top 1 cafes in tampines", CODE),  # 'tampines' isn't in the code, so it can't be substituted
+        ("top 1 cafes with 1 review", CODE),  # two equal literals would be ambiguous
+        ("how many merchants are there", "output_data = len(df)"),  # nothing to parameterize
+        ("top 1 cafes in singapore", "import os\n" + CODE),  # code that doesn't pass code_guard
+    ],
+)
+def test_code_that_cannot_be_parameterized_is_not_stored(query, code):
+    assert not query_templates.learn(query, MERCHANTS, code)
+    assert query_templates.instantiate(query, MERCHANTS) is None
+
+
+def test_a_discarded_template_is_not_reused():
+    query_templates.learn("top 1 cafes in singapore", MERCHANTS, CODE)
+    query_templates.discard("top 3 bakeries in tampines", MERCHANTS)
+    assert query_templates.instantiate("top 2 cafes in singapore", MERCHANTS) is None
@@ -0,0 +1,34 @@
+import rate_limiter
+
+GROQ_URL = "https://api.groq.com/openai/v1/chat/completions"
+OPENAI_URL = "https://api.openai.com/v1/"
+PAYLOAD = {"max_tokens": 2000, "messages": [{"role": "user", "content": "x" * 400}]}
+
+
+def test_limits_follow_the_response_headers():
+    limiter = rate_limiter._new_limiter(OPENAI_URL)
+    limiter.observe({"x-ratelimit-limit-requests": "10000", "x-ratelimit-limit-tokens": "2000000"})
+    assert (limiter.requests.capacity, limiter.tokens.capacity) == (10000, 2000000)
+    assert limiter.tokens.level > 1900000  # the extra quota is usable right away
+
+
+def test_groq_daily_request_limit_is_not_a_per_minute_budget():
+    limiter = rate_limiter._new_limiter(GROQ_URL)
+    limiter.observe({"x-ratelimit-limit-requests": "14400", "x-ratelimit-limit-tokens": "18000"})
+    assert (limiter.requests.capacity, limiter.tokens.capacity) == (30, 18000)
+
+
+def test_environment_limits_win_over_headers(monkeypatch):
+    monkeypatch.setenv("EMAILBOT_GROQ_TPM", "250000")
+    limiter = rate_limiter._new_limiter(GROQ_URL)
+    limiter.observe({"x-ratelimit-limit-tokens": "18000"})
+    assert limiter.tokens.capacity == 250000
+
+
+def test_reservation_follows_the_completions_actually_used():
+    limiter = rate_limiter._new_limiter(OPENAI_URL)
+    assert limiter.estimate(PAYLOAD) == 100 + rate_limiter.EXPECTED_COMPLETION_TOKENS
+    reserved = limiter.acquire(limiter.estimate(PAYLOAD))
+    limiter.settle(reserved, {"completion_tokens": 300, "total_tokens": 400})
+    assert limiter.estimate(PAYLOAD) == 400
+    assert limiter.estimate(dict(PAYLOAD, max_tokens=200)) == 300  # never more than the payload's cap
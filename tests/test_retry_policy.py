@@ -0,0 +1,61 @@
+import pytest
+
+import retry_policy
+
+
+def rate_limited(retry_after):
+    return retry_policy.ProviderHTTPError(429, {"retry-after": str(retry_after)})
+
+
+def failing_then_ok(errors):
+    errors = list(errors)
+
+    def attempt():
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    return attempt
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    waits = []
+    monkeypatch.setattr(retry_policy.time, "sleep", waits.append)
+    return waits
+
+
+def test_server_wait_is_not_clipped(no_sleep):
+    policy = retry_policy.RetryPolicy(max_delay=60)
+    assert policy.call(failing_then_ok([rate_limited(90)])) == "ok"
+    assert no_sleep == [90.0]
+
+
+def test_own_backoff_is_capped():
+    policy = retry_policy.RetryPolicy(base_delay=10, max_delay=15)
+    assert policy.delay_for(retry_policy.ProviderHTTPError(503, {}), 3) == 15
+
+
+def test_too_long_server_wait_fails_fast(no_sleep):
+    policy = retry_policy.RetryPolicy(max_server_delay=300)
+    with pytest.raises(retry_policy.ProviderHTTPError):
+        policy.call(failing_then_ok([rate_limited(3600)]))
+    assert no_sleep == []
+
+
+def test_first_retry_of_each_request_is_free(no_sleep):
+    token = retry_policy.current_budget.set(retry_policy.RetryBudget(0))
+    try:
+        policy = retry_policy.RetryPolicy()
+        for _ in range(20):  # a 429 wave across a whole batch
+            assert policy.call(failing_then_ok([rate_limited(1)])) == "ok"
+        with pytest.raises(retry_policy.RetryBudgetExceeded):
+            policy.call(failing_then_ok([rate_limited(1), rate_limited(1)]))
+    finally:
+        retry_policy.current_budget.reset(token)
+
+
+def test_non_retryable_errors_are_raised_at_once(no_sleep):
+    with pytest.raises(retry_policy.ProviderHTTPError):
+        retry_policy.RetryPolicy().call(failing_then_ok([retry_policy.ProviderHTTPError(400, {})]))
+    assert no_sleep == []
@@ -0,0 +1,109 @@
+import json
+import re
+
+import pytest
+
+import retry_policy
+import stream_parser
+
+EMAIL = {"to": "owner@cafe.sg", "subject": "More weekday diners", "body": "Hi Anna,\n\nQuick idea…\n\nBest,\nSumit"}
+
+
+def feed(text, chunk_size=1, completion_cap=1000):
+    parser = stream_parser.EmailStreamParser(completion_cap)
+    for start in range(0, len(text), chunk_size):
+        parser.write(text[start:start + chunk_size])
+    return parser
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 1000])
+def test_valid_email_is_rendered_field_by_field(chunk_size):
+    parser = feed(json.dumps(EMAIL), chunk_size)
+    assert parser.complete
+    assert parser.render() == (
+        "To: owner@cafe.sg\nSubject: More weekday diners\n\nHi Anna,\n\nQuick idea…\n\nBest,\nSumit"
+    )
+
+
+def test_partial_email_renders_the_fields_so_far():
+    parser = feed('{"to": "owner@cafe.sg", "subject": "More week')
+    assert not parser.complete
+    assert parser.render() == "To: owner@cafe.sg\nSubject: More week"
+
+
+def test_group_reply_with_literals_and_nesting():
+    reply = {"emails": [dict(EMAIL, merchant=1), dict(EMAIL, merchant=2, to="b@x.sg")], "ok": True, "n": -1.5e3}
+    parser = feed(json.dumps(reply))
+    assert parser.complete
+    assert [("".join(email["to"])) for email in parser.emails] == ["owner@cafe.sg", "b@x.sg"]
+
+
+def test_empty_containers_and_null():
+    assert feed('{"to": "a", "extra": {}, "list": [], "none": null}').complete
+
+
+def test_escapes_are_decoded():
+    parser = feed('{"to": "a", "subject": "Caf\\u00e9 \\"deal\\"", "body": "line\\nnext"}')
+    assert parser.render() == 'To: a\nSubject: Café "deal"\n\nline\nnext'
+
+
+def test_stops_at_the_end_of_the_json():
+    parser = feed(json.dumps(EMAIL) + "\n\nHope this helps!")
+    assert parser.complete
+
+
+def test_reasoning_and_code_fence_before_the_json():
+    assert feed("<think>weighing the tone</think>\n```json\n" + json.dumps(EMAIL)).complete
+
+
+def test_plain_text_layout_is_accepted():
+    parser = feed("To: owner@cafe.sg\nSubject: Hello\nBody:\nHi")
+    assert parser.phase == "layout_ok"
+
+
+@pytest.mark.parametrize(
+    "reply, reason",
+    [
+        ('{"to": "a", "subject": "b" "body": "c"}', "',' is missing"),
+        ('{"to": "a" "subject": "b"}', "',' is missing"),
+        ('{"emails": [{"to": "a"} {"to": "b"}]}', "',' is missing"),
+        ('["a" "b"]', "',' is missing"),
+        ('{"n": 1 "to": "a"}', "',' is missing"),
+        ('{"to" "a"}', "':' is missing"),
+        ('{"to": "a",}', "value is missing"),
+        ('{"to": }', "value is missing"),
+        ('{"to"}', "value is missing"),
+        ('{"to": "a"]', "brackets don't match"),
+        ('{"to": "a", : "b"}', "':' is out of place"),
+        ('{"to": "a", ["b"]}', "key is missing"),
+        ('{"to": "a\\q"}', "bad escape"),
+        ('{"to": "\\uZZZZ"}', "bad \\u escape"),
+        ('{"to": "a", "subject": Hello}', "unexpected 'H'"),
+        ('{: "a"}', "':' is out of place"),
+    ],
+)
+def test_malformed_json_is_cut_short(reply, reason):
+    with pytest.raises(retry_policy.MalformedResponse, match=re.escape(reason)):
+        feed(reply)
+
+
+def test_missing_json_or_layout_is_cut_short():
+    with pytest.raises(retry_policy.MalformedResponse, match="doesn't start with JSON"):
+        feed("Sure! Here is a lovely email for the merchant. " * 10)
+
+
+def test_layout_without_subject_is_cut_short():
+    with pytest.raises(retry_policy.MalformedResponse, match="no 'Subject:' line"):
+        feed("To: owner@cafe.sg\nDear owner,\nWe\nhelp\nmerchants\ngrow\n")
+
+
+def test_long_reasoning_is_cut_short():
+    with pytest.raises(retry_policy.MalformedResponse, match="reasoning leaves no room"):
+        feed("<think>" + "hmm " * 2000, chunk_size=50, completion_cap=1000)
+
+
+def test_restart_clears_the_previous_attempt():
+    parser = feed('{"to": "a", "subj')
+    parser.restart()
+    parser.write(json.dumps(EMAIL))
+    assert parser.complete and len(parser.emails) == 1
@@ -0,0 +1,71 @@
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+
+import live_output
+import llm_client
+import retry_policy
+import token_ledger
+
+PAYLOAD = {"model": "test-model", "max_tokens": 800, "messages": [{"role": "user", "content": "Write an email"}]}
+
+
+@pytest.fixture
+def ledger(tmp_path, monkeypatch):
+    monkeypatch.setattr(token_ledger, "LEDGER_PATH", str(tmp_path / "ledger.sqlite"))
+    return token_ledger.load
+
+
+def reader():
+    return llm_client._StreamReader(PAYLOAD, live_output.sink("Cafe", PAYLOAD), None, token_ledger.Entry("test", PAYLOAD))
+
+
+def test_calls_recorded_in_an_event_loop_are_written_by_the_writer_thread(ledger, monkeypatch):
+    writers, schema_setups = set(), []
+    insert, connect = token_ledger._writer.write, sqlite3.connect
+
+    def tracked_insert(path, rows):
+        writers.add(threading.current_thread().name)
+        insert(path, rows)
+
+    def tracked_connect(*args, **kwargs):
+        if token_ledger.LEDGER_PATH not in token_ledger._schema_ready:
+            schema_setups.append(args[0])
+        return connect(*args, **kwargs)
+
+    monkeypatch.setattr(token_ledger._writer, "write", tracked_insert)
+    monkeypatch.setattr(sqlite3, "connect", tracked_connect)
+
+    async def calls():
+        for tokens in (10, 20, 30):
+            token_ledger.Entry("test", PAYLOAD).record({"prompt_tokens": tokens, "total_tokens": tokens})
+
+    asyncio.run(calls())
+    assert ledger()["prompt_tokens"].tolist() == [10, 20, 30]
+    assert writers == {"token-ledger-writer"}
+    assert len(schema_setups) == 1
+
+
+def test_stream_cut_short_is_recorded_as_aborted(ledger):
+    stream = reader()
+    with pytest.raises(retry_policy.MalformedResponse):
+        try:
+            stream.content('{"to": "a@b.sg" "subject": "Hi"}')
+        finally:
+            stream.close()
+    row = ledger().iloc[0]
+    assert row["aborted"] == 1
+    assert row["completion_tokens"] > 0
+
+
+def test_old_ledgers_gain_the_new_columns(ledger):
+    with sqlite3.connect(token_ledger.LEDGER_PATH) as connection:
+        connection.execute(
+            "CREATE TABLE calls (ts REAL, provider TEXT, model TEXT, variant TEXT, batch TEXT, "
+            "estimated_prompt_tokens INTEGER, prompt_tokens INTEGER, completion_tokens INTEGER, "
+            "reasoning_tokens INTEGER, total_tokens INTEGER, seconds REAL, sections TEXT)"
+        )
+    token_ledger.Entry("test", PAYLOAD).record({"prompt_tokens": 5}, aborted=True)
+    assert ledger()["aborted"].tolist() == [1]
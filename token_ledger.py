@@ -0,0 +1,262 @@
+import contextlib
+import contextvars
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+import pandas as pd
+
+import sqlite_writer
+
+# Per-call token ledger.
+# Every request that reaches a provider is counted offline before it is sent (tiktoken when installed,
+# otherwise an estimate from words and punctuation), split by prompt section. When the reply arrives the
+# count is reconciled with the provider's `usage` and one row is appended to a SQLite ledger with the
+# provider, model, bot variant and batch. render_panel() shows it in the app and offers a CSV export.
+# Cache hits (llm_cache) never reach a provider and are not recorded.
+# Prompt tokens the provider served from its prompt cache (the prompts keep their static instructions
+# as a leading prefix for this) are recorded as cached_tokens and summarized for the sidebar.
+# Streams cut short (malformed replies, reasoning over budget, dropped connections) are recorded too, with
+# `aborted` set and the completion tokens that arrived before the cut, since the provider bills them.
+# Calls are recorded from inside the batch's event loop, so rows are written by a background thread
+# (sqlite_writer); load() waits for it first. The schema is set up once per ledger file and process.
+
+LEDGER_PATH = os.environ.get("EMAILBOT_TOKEN_LEDGER", ".cache/token_ledger.sqlite")
+
+# Set per Streamlit run (the bot module) and per batch (batch_engine); calls inherit them
+current_variant = contextvars.ContextVar("token_ledger_variant", default=None)
+current_batch = contextvars.ContextVar("token_ledger_batch", default=None)
+
+COLUMNS = [
+    "ts", "provider", "model", "variant", "batch", "estimated_prompt_tokens", "prompt_tokens",
+    "completion_tokens", "reasoning_tokens", "total_tokens", "seconds", "sections", "cached_tokens", "aborted",
+]
+
+# A line on its own in capitals ("SECTION 1: ROLE") or a short label ending in a colon ("Merchant Details:")
+_HEADING = re.compile(r"^\s*(?:([A-Z0-9][^a-z\n]{3,80})|([A-Z][A-Za-z' ]{2,40}):)\s*$")
+_WORD = re.compile(r"\w+|[^\w\s]")
+
+_encodings = {}
+_tiktoken = None  # the module once loaded, False when it isn't installed
+
+stats = {"prompt_tokens": 0, "cached_tokens": 0}
+_stats_lock = threading.Lock()
+_schema_ready = set()
+
+
+def summary():
+    with _stats_lock:
+        prompt_tokens, cached = stats["prompt_tokens"], stats["cached_tokens"]
+    if not prompt_tokens:
+        return "Prompt cache: no usage reported yet"
+    return f"Prompt cache: {cached} of {prompt_tokens} prompt tokens cached ({100 * cached / prompt_tokens:.0f}%)"
+
+
+def cached_tokens(usage):
+    # OpenAI-style prompt_tokens_details, or DeepSeek-style prompt_cache_hit_tokens
+    details = usage.get("prompt_tokens_details") or {}
+    return details.get("cached_tokens") or usage.get("prompt_cache_hit_tokens") or 0
+
+
+def provider_name(url):
+    # "https://api.groq.com/openai/v1/..." -> "groq"
+    host = urlparse(str(url)).hostname or str(url)
+    parts = host.split(".")
+    return parts[-2] if len(parts) >= 2 else host
+
+
+def _tokenizer():
+    # tiktoken is optional and slow to import, so it is loaded on the first count
+    global _tiktoken
+    if _tiktoken is None:
+        try:
+            import tiktoken
+            _tiktoken = tiktoken
+        except ImportError:  # without it prompts are counted with a word-based estimate
+            _tiktoken = False
+    return _tiktoken
+
+
+def _encoding(model):
+    tiktoken = _tokenizer()
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("cl100k_base")  # close enough for non-OpenAI models
+    return _encodings[model]
+
+
+def count_tokens(text, model=None):
+    if not text:
+        return 0
+    if _tokenizer():
+        return len(_encoding(model or "").encode(text, disallowed_special=()))
+    # Words of up to ~4 characters are one token, longer ones one per 4 characters; punctuation one each
+    return sum(math.ceil(len(piece) / 4) for piece in _WORD.findall(text))
+
+
+def sections(payload):
+    # -> {section name: tokens}; user messages are split at their headings
+    model = payload.get("model")
+    counts = {}
+    for message in payload.get("messages", []):
+        if message.get("role") != "user":
+            name = message.get("role", "other")
+            counts[name] = counts.get(name, 0) + count_tokens(str(message.get("content", "")), model)
+            continue
+        name, lines = "instructions", []
+        for line in str(message.get("content", "")).splitlines() + [None]:
+            heading = _HEADING.match(line) if line is not None else None
+            if line is None or heading:
+                counts[name] = counts.get(name, 0) + count_tokens("\n".join(lines), model)
+                if heading:
+                    name, lines = (heading.group(1) or heading.group(2)).strip().rstrip(":"), [line]
+            else:
+                lines.append(line)
+    return {name: tokens for name, tokens in counts.items() if tokens}
+
+
+def new_batch_id():
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+def _connect(path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    connection = sqlite3.connect(path, timeout=10)
+    if path not in _schema_ready:
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS calls ("
+                "ts REAL, provider TEXT, model TEXT, variant TEXT, batch TEXT, estimated_prompt_tokens INTEGER, "
+                "prompt_tokens INTEGER, completion_tokens INTEGER, reasoning_tokens INTEGER, total_tokens INTEGER, "
+                "seconds REAL, sections TEXT, cached_tokens INTEGER, aborted INTEGER)"
+            )
+            # Ledgers written before these columns existed
+            existing = {row[1] for row in connection.execute("PRAGMA table_info(calls)")}
+            for column in ("cached_tokens", "aborted"):
+                if column not in existing:
+                    connection.execute(f"ALTER TABLE calls ADD COLUMN {column} INTEGER")
+        _schema_ready.add(path)
+    return connection
+
+
+@contextlib.contextmanager
+def _connection(path=None):
+    connection = _connect(path or LEDGER_PATH)
+    try:
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def _insert(path, rows):
+    with _connection(path) as connection:
+        connection.executemany(
+            f"INSERT INTO calls ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", rows
+        )
+
+
+_writer = sqlite_writer.BackgroundWriter("token-ledger-writer", _insert, "Token ledger")
+
+
+class Entry:
+    # Created just before a request is sent; record() once its usage is known or it was cut short
+    def __init__(self, provider, payload):
+        self.provider = provider
+        self.model = payload.get("model")
+        self.sections = sections(payload)
+        self.estimated_prompt_tokens = sum(self.sections.values())
+        self.variant = current_variant.get()
+        self.batch = current_batch.get()
+        self.started = time.monotonic()
+
+    def record(self, usage, reasoning_tokens=None, aborted=False):
+        # `reasoning_tokens` is the stream's own count, for providers that don't report it in `usage`
+        usage = usage or {}
+        details = usage.get("completion_tokens_details") or {}
+        row = (
+            time.time(), self.provider, self.model, self.variant, self.batch, self.estimated_prompt_tokens,
+            usage.get("prompt_tokens"), usage.get("completion_tokens"), details.get("reasoning_tokens") or reasoning_tokens,
+            usage.get("total_tokens"), round(time.monotonic() - self.started, 3), json.dumps(self.sections),
+            cached_tokens(usage), int(aborted),
+        )
+        with _stats_lock:
+            stats["prompt_tokens"] += usage.get("prompt_tokens") or 0
+            stats["cached_tokens"] += row[-2]
+        _writer.append(LEDGER_PATH, row)
+
+
+def load():
+    _writer.flush()
+    with _connection() as connection:
+        return pd.read_sql_query("SELECT * FROM calls ORDER BY ts", connection)
+
+
+def by_variant(ledger):
+    grouped = ledger.groupby(["provider", "model", "variant"], dropna=False)
+    table = grouped.agg(
+        calls=("ts", "size"),
+        aborted=("aborted", "sum"),
+        estimated_prompt=("estimated_prompt_tokens", "mean"),
+        prompt=("prompt_tokens", "mean"),
+        cached=("cached_tokens", "mean"),
+        completion=("completion_tokens", "mean"),
+        seconds=("seconds", "mean"),
+    )
+    table["cached_%"] = 100 * table["cached"] / table["prompt"]
+    # Reconciliation: how far the offline count is from what the provider billed
+    table["estimate_error_%"] = 100 * (table["estimated_prompt"] - table["prompt"]) / table["prompt"]
+    return table.round(1).reset_index()
+
+
+def by_batch(ledger, limit=10):
+    batches = ledger.dropna(subset=["batch"]).groupby(["batch", "variant"], dropna=False).agg(
+        calls=("ts", "size"),
+        aborted=("aborted", "sum"),
+        prompt=("prompt_tokens", "sum"),
+        completion=("completion_tokens", "sum"),
+        seconds=("seconds", "sum"),
+    )
+    return batches.sort_index(ascending=False).head(limit).reset_index()
+
+
+def by_section(ledger):
+    rows = [
+        (variant, name, tokens)
+        for variant, counts in zip(ledger["variant"], ledger["sections"])
+        for name, tokens in json.loads(counts or "{}").items()
+    ]
+    table = pd.DataFrame(rows, columns=["variant", "section", "tokens"])
+    return table.groupby(["variant", "section"], dropna=False)["tokens"].mean().round(0).reset_index().sort_values(
+        ["variant", "tokens"], ascending=[True, False]
+    )
+
+
+def render_panel():
+    import streamlit as st  # only the panel needs it; llm_client records calls without Streamlit
+
+    with st.expander("Token ledger"):
+        ledger = load()
+        if ledger.empty:
+            st.caption("No provider calls recorded yet.")
+            return
+        st.caption("Average tokens per call by provider, model and bot variant")
+        st.dataframe(by_variant(ledger))
+        st.caption("Recent batches")
+        st.dataframe(by_batch(ledger))
+        st.caption("Average prompt tokens per section")
+        st.dataframe(by_section(ledger))
+        st.download_button(
+            label="Download ledger as CSV",
+            data=ledger.to_csv(index=False),
+            file_name="token_ledger.csv",
+            mime="text/csv",
+        )